@@ -1,10 +1,31 @@
-from matplotlib import pyplot as plt
+import argparse
 import os
 import pandas as pd
+import pathlib
 import pickle as pkl
-from typing import Callable, Dict, Tuple, Union
+import sys
+from typing import Callable, Dict, List, Tuple, Union
 
+from src.decomposition import (
+    SDA_FACTORS,
+    compute_multipliers,
+    extract_factors,
+    structural_decomposition,
+)
+from src.downloads import Prefetcher, plan_downloads
+from src.jobs import (
+    STRESSORS_PARAMS,
+    counterfactual_name,
+    expand_manifest,
+    is_done,
+    load_manifest,
+    run_manifest,
+    state_dir,
+)
 from src.model import Counterfactual, Model
+from src.panel import PANELS_DIR, PanelStore, open_panel, panel_dir_name
+from src.persistence import load_reference, read_index
+from src.scenario_specs import register_scenarios
 from src.scenarios import DICT_SCENARIOS
 from src.settings import (
     COLORS,
@@ -12,8 +33,16 @@ from src.settings import (
     MODELS_DIR,
     REGIONS_AGG,
     SECTORS_AGG,
+    create_dir,
 )
-from src.stressors import GHG_PARAMS, MATERIAL_PARAMS, COPPER_PARAMS, LANDUSE_PARAMS
+from src.stressors import (
+    GHG_PARAMS,
+    MATERIAL_PARAMS,
+    COPPER_PARAMS,
+    LANDUSE_PARAMS,
+    stressor_shortname,
+)
+from src.threads import split_cores
 from src.utils import footprint_extractor
 
 
@@ -23,6 +52,9 @@ def load_model(
     aggregation_name: str = "opti_S",
     capital: bool = False,
     stressor_name: str = "ghg",
+    precision: str = "float64",
+    solver: str = "dense",
+    counterfactual_names: List[str] = None,
     verbose: bool = True,
 ) -> Model:
     """Loads an existing model
@@ -33,12 +65,15 @@ def load_model(
         aggregation_name (str): name of the aggregation matrix used. Defaults to "opti_S".
         capital (bool, optional): True to endogenize investments and capital. Defaults to False.
         stressor_name (str, optional): stressors' type (in english, for file names). Defaults to "ghg".
+        precision (str, optional): floating point type of the matrices ('float64' or 'float32'). Defaults to 'float64'.
+        solver (str, optional): Leontief solver, see leontief.py. Defaults to 'dense'.
+        counterfactual_names (List[str], optional): names of the saved counterfactuals to load, all of them if None. Defaults to None.
         verbose (bool, optional): True to print infos. Defaults to True.
 
     Returns:
         Model: object Model defined in model.py
     """
-    backup_path = MODELS_DIR / (
+    name = (
         str(base_year)
         + "__"
         + system
@@ -47,15 +82,243 @@ def load_model(
         + "__"
         + stressor_name
         + capital * "__with_capital"
-        + "/backup.pickle"
     )
-    if os.path.isfile(backup_path):
-        with open(backup_path, "rb") as f:
+    # formatted as Model.summary_long
+    model_dir = MODELS_DIR / (
+        name
+        + (precision != "float64") * f"__{precision}"
+        + (solver != "dense") * f"__{solver}"
+    )
+    backup_dir = model_dir / "backup"
+    legacy_backup_dir = MODELS_DIR / name / f"backup__{precision}"
+    if (
+        read_index(backup_dir=backup_dir) is None
+        and precision != "float64"
+        and solver == "dense"
+        and read_index(backup_dir=legacy_backup_dir) is not None
+    ):
+        # reduced precision models saved by former versions, next to the float64 one
+        backup_dir = legacy_backup_dir
+    if read_index(backup_dir=backup_dir) is not None:
+        model = load_reference(backup_dir=backup_dir)
+        saved_counterfactuals = model.get_saved_counterfactuals_list()
+        if counterfactual_names is None:
+            counterfactual_names = saved_counterfactuals
+        for name in counterfactual_names:
+            if name in saved_counterfactuals:
+                model.load_counterfactual(name=name)
+            elif verbose:
+                print(f"Couldn't find a saved counterfactual named {name}.")
+        return model
+    if precision == "float64" and os.path.isfile(model_dir / "backup.pickle"):
+        # whole model pickled by former versions
+        with open(model_dir / "backup.pickle", "rb") as f:
             return pkl.load(f)
     if verbose:
         print(
-            f"Couldn't find an existing model at {backup_path}.\n You should create a new one using the class Model."
+            f"Couldn't find an existing model at {backup_dir}.\n You should create a new one using the class Model."
+        )
+
+
+def load_or_create_model(
+    base_year: int = 2015,
+    system: str = "pxp",
+    aggregation_name: str = "opti_S",
+    capital: bool = False,
+    stressor_params: Dict = GHG_PARAMS,
+    precision: str = "float64",
+    solver: str = "dense",
+) -> Model:
+    """Loads an existing model without its counterfactuals, or creates it if it doesn't exist yet
+
+    Args:
+        base_year (int): year in 4 digits. Defaults to 2015.
+        system (str): product ('pxp') or industry ('ixi'). Defaults to 'pxp'.
+        aggregation_name (str): name of the aggregation matrix used. Defaults to "opti_S".
+        capital (bool, optional): True to endogenize investments and capital. Defaults to False.
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy as a dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight). Defaults to a dictionnary with the GHGs.
+        precision (str, optional): floating point type of the matrices ('float64' or 'float32'). Defaults to 'float64'.
+        solver (str, optional): Leontief solver of a created model, see leontief.py. Defaults to 'dense'.
+
+    Returns:
+        Model: object Model defined in model.py
+    """
+    mod = load_model(
+        base_year=base_year,
+        system=system,
+        aggregation_name=aggregation_name,
+        capital=capital,
+        stressor_name=stressor_shortname(stressor_params),
+        precision=precision,
+        solver=solver,
+        counterfactual_names=[],
+        verbose=False,
+    )
+    if mod is None:
+        mod = Model(
+            base_year=base_year,
+            system=system,
+            aggregation_name=aggregation_name,
+            capital=capital,
+            stressor_params=stressor_params,
+            precision=precision,
+            solver=solver,
+        )
+    return mod
+
+
+### BATCHES ###
+
+
+def run_job(job: Dict) -> None:
+    """Builds the model of a job and those of its counterfactuals which aren't saved yet, see src/jobs.py
+
+    Args:
+        job (Dict): job, as listed by expand_manifest
+    """
+    mod = load_or_create_model(
+        base_year=job["base_year"],
+        system=job["system"],
+        aggregation_name=job["aggregation_name"],
+        capital=job["capital"],
+        stressor_params=STRESSORS_PARAMS[job["stressor"]],
+        precision=job["precision"],
+        solver=job.get("solver", "dense"),
+    )
+    register_scenarios(specs=job.get("scenario_specs", {}))
+    saved_counterfactuals = mod.get_saved_counterfactuals_list()
+    for counterfactual in job["counterfactuals"]:
+        name = counterfactual_name(**counterfactual)
+        if name not in saved_counterfactuals:
+            mod.new_counterfactual(
+                name=name,
+                scenar_function=DICT_SCENARIOS[counterfactual["scenario"]],
+                reloc=counterfactual["reloc"],
+            )
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Builds the models and counterfactuals of a job manifest, skipping the jobs already done"
+    )
+    parser.add_argument("manifest", type=pathlib.Path, help="JSON job manifest")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="number of cores shared by the workers' BLAS threads, all the available ones if omitted",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="lists the jobs without running them"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="maximal number of simultaneous downloads of the missing data while the jobs run, 0 to let each job download its data",
+    )
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest(path=args.manifest)
+    register_scenarios(specs=manifest["scenario_specs"])
+    unknown = set(manifest["scenarios"]) - set(DICT_SCENARIOS.keys())
+    if unknown:
+        parser.error(
+            f"unknown scenarios {sorted(unknown)}, they must be among {list(DICT_SCENARIOS.keys())}"
+        )
+
+    if args.dry_run:
+        directory = state_dir(manifest=manifest)
+        for job in expand_manifest(manifest=manifest):
+            status = "done" if is_done(directory=directory, job=job) else "to run"
+            print(f"{job['id']}: {status}")
+        return
+
+    prefetcher = None
+    if args.prefetch:
+        prefetcher = Prefetcher(
+            tasks=plan_downloads(
+                years=manifest["years"],
+                systems=manifest["systems"],
+                capital=any(manifest["capital"]),
+            ),
+            max_concurrency=args.prefetch,
+        ).start()
+    summary = run_manifest(
+        manifest=manifest,
+        run_job=run_job,
+        workers=args.workers,
+        prefetcher=prefetcher,
+        threads=split_cores(workers=args.workers, cores=args.cores),
+    )
+    if summary["failed"]:
+        print(f"Failed jobs (see {state_dir(manifest=manifest)}): {summary['failed']}")
+    if summary["not_run"]:
+        print(f"Jobs not run: {summary['not_run']}")
+    if summary["failed"] or summary["not_run"]:
+        sys.exit(1)
+
+
+### PANELS ###
+
+
+def build_panel(
+    start_year: int,
+    end_year: int,
+    system: str = "pxp",
+    aggregation_name: str = "opti_S",
+    stressor_params: Dict = GHG_PARAMS,
+    capital: bool = False,
+    matrices: List[str] = None,
+    overwrite: bool = False,
+) -> PanelStore:
+    """Packs the matrices of the models from start_year to end_year into one memory-mapped panel, filling only the missing years of an existing panel
+
+    Args:
+        start_year (int): when to start from (4 digits).
+        end_year (int): when to stop (4 digits).
+        system (str): product ('pxp') or industry ('ixi'). Defaults to 'pxp'.
+        aggregation_name (str): name of the aggregation matrix used. Defaults to "opti_S".
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy as a dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight). Defaults to a dictionnary with the GHGs.
+        capital (bool, optional): True to endogenize investments and capital. Defaults to False.
+        matrices (List[str], optional): names of the matrices to store, all the keys of PANEL_MATRICES if None. Defaults to None.
+        overwrite (bool, optional): True to rebuild the panel from scratch. Defaults to False.
+
+    Returns:
+        PanelStore: the panel, see panel.py
+    """
+    years = list(range(start_year, end_year + 1))
+    panel_dir = PANELS_DIR / (
+        f"{start_year}_{end_year}__"
+        + panel_dir_name(
+            system=system,
+            aggregation_name=aggregation_name,
+            stressor_name=stressor_shortname(stressor_params),
+            capital=capital,
+        )
+    )
+    panel = None if overwrite else open_panel(panel_dir=panel_dir)
+
+    for year in years:
+        if panel is not None and year in panel.manifest["filled"]:
+            continue
+        print(f"\n--- PROCESSING YEAR {year} ---")
+        mod = load_or_create_model(
+            base_year=year,
+            system=system,
+            aggregation_name=aggregation_name,
+            capital=capital,
+            stressor_params=stressor_params,
         )
+        if panel is None:
+            panel = PanelStore.create(
+                panel_dir=panel_dir, years=years, template=mod, matrices=matrices
+            )
+        panel.write_year(year=year, model=mod)
+        del mod
+
+    return panel
 
 
 ### COMPARISONS OF EVOLUTIONS ###
@@ -92,7 +355,7 @@ def endogenous_capital_comparison(
     Returns:
         Dict: contains all the models
     """
-    stressor_name = stressor_params["name_EN"]
+    stressor_name = stressor_shortname(stressor_params)
     stressor_unit = stressor_params["unit"]
 
     models = {}
@@ -115,6 +378,7 @@ def endogenous_capital_comparison(
             aggregation_name=aggregation_name,
             capital=capital,
             stressor_name=stressor_name,
+            counterfactual_names=[] if scenario_name is None else [scenario_name],
             verbose=False,
         )
         if mod is None:
@@ -151,6 +415,8 @@ def endogenous_capital_comparison(
             for f in feature_names:
                 to_display.loc[year, (capital_labels[1 - capital], f)] = features[f]
 
+    from matplotlib import pyplot as plt
+
     to_display.plot(
         color=2 * COLORS[:nb_features],
         style=nb_features * ["-"] + nb_features * ["--"],
@@ -173,9 +439,108 @@ def endogenous_capital_comparison(
         scenario_name = "reference"
     reloc_suffix = reloc * "__with_reloc"
     plt.savefig(
-        FIGURES_MULTIMODEL_DIR
+        create_dir(FIGURES_MULTIMODEL_DIR)
         / f"endogenous_capital_comparison__{start_year}_{end_year}__{feature_name_short}__{system}__{aggregation_name}__{stressor_name}__{scenario_name}{reloc_suffix}.png",
         bbox_inches="tight",
     )
 
     return models
+
+
+def structural_decomposition_comparison(
+    start_year: int,
+    end_year: int,
+    system: str = "pxp",
+    aggregation_name: str = "opti_S",
+    stressor_params: Dict = GHG_PARAMS,
+    capital: bool = False,
+    region: str = "FR",
+    pairs: List[Tuple[int, int]] = None,
+) -> pd.DataFrame:
+    """Decomposes the evolution of region's footprint from start_year to end_year into intensity, Leontief structure, final demand mix and level, and plots it.
+
+    Args:
+        start_year (int): when to start from (4 digits).
+        end_year (int): when to stop (4 digits).
+        system (str): product ('pxp') or industry ('ixi'). Defaults to 'pxp'.
+        aggregation_name (str): name of the aggregation matrix used. Defaults to "opti_S".
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy as a dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight). Defaults to a dictionnary with the GHGs.
+        capital (bool, optional): True to endogenize investments and capital. Defaults to False.
+        region (str, optional): region whose footprint is decomposed. Defaults to "FR".
+        pairs (List[Tuple[int, int]], optional): pairs of years (start, end) to decompose, consecutive years if None. Defaults to None.
+
+    Returns:
+        pd.DataFrame: footprints and contributions of the factors for each pair of years, see structural_decomposition
+    """
+    stressor_name = stressor_shortname(stressor_params)
+    if pairs is None:
+        pairs = [(year, year + 1) for year in range(start_year, end_year)]
+
+    # the years are loaded one at a time and their Leontief inverse (in the 'leontief' product) is dropped once all its multipliers are cached
+    factors = {}
+    cache = {}
+    for year in sorted({year for pair in pairs for year in pair}):
+        print(f"\n--- PROCESSING YEAR {year} ---")
+        mod = load_or_create_model(
+            base_year=year,
+            system=system,
+            aggregation_name=aggregation_name,
+            capital=capital,
+            stressor_params=stressor_params,
+        )
+        factors[year] = extract_factors(model=mod, region=region)
+        del mod
+        loaded_pairs = [pair for pair in pairs if set(pair) <= set(factors.keys())]
+        compute_multipliers(factors=factors, pairs=loaded_pairs, cache=cache)
+        for loaded_year in factors.keys():
+            if all(
+                set(pair) <= set(factors.keys())
+                for pair in pairs
+                if loaded_year in pair
+            ):
+                factors[loaded_year].pop("leontief", None)
+
+    decomposition = structural_decomposition(factors=factors, pairs=pairs, cache=cache)
+
+    from matplotlib import pyplot as plt
+
+    components = SDA_FACTORS + ["direct"]
+    labels = [
+        "Intensités",
+        "Structure productive",
+        "Mix de la demande",
+        "Niveau de la demande",
+        "Émissions directes",
+    ]
+    ax = (
+        decomposition[components]
+        .set_axis(labels, axis=1)
+        .plot.bar(
+            stacked=True, color=COLORS[: len(components)], fontsize=12, figsize=(10, 7)
+        )
+    )
+    ax.scatter(
+        range(len(decomposition)),
+        decomposition["footprint_end"] - decomposition["footprint_start"],
+        color="black",
+        zorder=3,
+        label="Variation totale",
+    )
+    ax.set_xticklabels([f"{start}-{end}" for start, end in decomposition.index])
+    plt.title(f"Décomposition structurelle de l'empreinte de {region}", size=17)
+    plt.ylabel(stressor_params["unit"])
+    plt.tight_layout()
+    plt.grid(visible=True)
+    plt.legend(prop={"size": 12}, loc="center left", bbox_to_anchor=(1.0, 0.5))
+
+    plt.savefig(
+        create_dir(FIGURES_MULTIMODEL_DIR)
+        / f"structural_decomposition__{start_year}_{end_year}__{region}__{system}__{aggregation_name}__{stressor_name}{capital * '__with_capital'}.png",
+        bbox_inches="tight",
+    )
+
+    return decomposition
+
+
+if __name__ == "__main__":
+    main()
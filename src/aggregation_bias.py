@@ -0,0 +1,433 @@
+"""Estimation of the bias of regional or sectorial aggregations on a region's footprint
+
+Merging two categories P and Q of a calibrated system gives the same footprint as keeping them apart with identical input coefficients and stressor intensities, their production-weighted averages.
+Each candidate merge is thus a low-rank update of A (rank = number of categories on the other axis), whose effect on the footprint is computed with the Woodbury formula from blocks of L, without re-calibrating nor inverting any matrix.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+from src.clustering import (
+    clusters_to_matrix,
+    compose_aggregation,
+    name_clusters,
+    write_aggregation,
+)
+from src.utils import load_aggregation_matrices
+
+# maximal size in MB of the stacked blocks of L evaluated at once
+CHUNK_SIZE_MB = 256
+
+
+### AUXILIARY FUNCTIONS ###
+
+
+def extract_arrays(model, region: str = "FR") -> Dict:
+    """Extracts the flows needed to compute region's footprint as float64 arrays
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str, optional): region name. Defaults to "FR".
+
+    Returns:
+        Dict: Z, L, x, emissions (stressors summed), y (region's final demand) and F_Y (region's direct emissions)
+    """
+    iot = model.iot
+    stressor_extension = iot.stressor_extension
+    x = iot.x["indout"].values.astype("float64")
+    S = stressor_extension.S.values.astype("float64").sum(axis=0)
+    return {
+        "Z": iot.Z.values.astype("float64"),
+        "L": iot.L.values.astype("float64"),
+        "x": x,
+        "emissions": S * x,
+        "y": iot.Y[region].values.astype("float64").sum(axis=1),
+        "F_Y": float(stressor_extension.F_Y[region].values.sum()),
+    }
+
+
+def technical_coefficients(Z: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Computes A from Z and x, with zero coefficients for the categories without production
+
+    Args:
+        Z (np.ndarray): intermediate flows
+        x (np.ndarray): production
+
+    Returns:
+        np.ndarray: technical coefficients
+    """
+    inv_x = np.divide(1, x, out=np.zeros_like(x), where=x != 0)
+    return Z * inv_x
+
+
+def technical_emissions_footprint(
+    Z: np.ndarray, x: np.ndarray, emissions: np.ndarray, y: np.ndarray
+) -> float:
+    """Computes the footprint of a final demand, without direct emissions
+
+    Args:
+        Z (np.ndarray): intermediate flows
+        x (np.ndarray): production
+        emissions (np.ndarray): emissions of each category
+        y (np.ndarray): final demand
+
+    Returns:
+        float: footprint
+    """
+    A = technical_coefficients(Z=Z, x=x)
+    s = np.divide(emissions, x, out=np.zeros_like(x), where=x != 0)
+    return float(s @ np.linalg.solve(np.eye(len(x)) - A, y))
+
+
+def axis_permutation(n_regions: int, n_sectors: int, axis: str) -> np.ndarray:
+    """Returns the permutation putting the categories of the merged axis first in the (region, sector) index
+
+    Args:
+        n_regions (int): number of regions
+        n_sectors (int): number of sectors
+        axis (str): 'regions' or 'sectors'
+
+    Returns:
+        np.ndarray: positions in pymrio's region-major index, ordered by (category of axis, category of the other axis)
+    """
+    if axis not in ["regions", "sectors"]:
+        raise ValueError(f"axis must be 'regions' or 'sectors', not {axis}")
+    positions = np.arange(n_regions * n_sectors).reshape(n_regions, n_sectors)
+    if axis == "sectors":
+        positions = positions.T
+    return positions.ravel()
+
+
+### GREEDY MERGES ###
+
+
+class MergeState:
+    def __init__(self, arrays: Dict, n_groups: int):
+        """Inits MergeState class, the system whose categories of one axis are merged step by step
+
+        Args:
+            arrays (Dict): L, x, emissions and y, ordered by (group, category of the other axis), as returned by extract_arrays
+            n_groups (int): number of categories on the merged axis
+        """
+        self.n_groups = n_groups
+        self.n_other = len(arrays["x"]) // n_groups
+        self.L = arrays["L"].copy()
+        self.x = arrays["x"].copy()
+        self.emissions = arrays["emissions"].copy()
+        self.y = arrays["y"].copy()
+        self.update()
+
+    def update(self) -> None:
+        """Computes the quantities derived from L, x, emissions and y"""
+        self.s = np.divide(
+            self.emissions, self.x, out=np.zeros_like(self.x), where=self.x != 0
+        )
+        self.w = self.L @ self.y
+        self.m = self.s @ self.L
+        self.footprint = float(self.s @ self.w)
+
+    def blocks(self, groups: np.ndarray) -> np.ndarray:
+        """Returns the positions of the categories of groups
+
+        Args:
+            groups (np.ndarray): group numbers
+
+        Returns:
+            np.ndarray: positions, one row per group
+        """
+        return groups[:, None] * self.n_other + np.arange(self.n_other)[None, :]
+
+    def weights(self, P: np.ndarray, Q: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the weights of the production-weighted averages of merged pairs
+
+        Args:
+            P (np.ndarray): first group of each pair
+            Q (np.ndarray): second group of each pair
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: shares of Q and of P in the merged production, one row per pair
+        """
+        x_P = self.x[self.blocks(P)]
+        x_Q = self.x[self.blocks(Q)]
+        x_K = x_P + x_Q
+        c_P = np.divide(x_Q, x_K, out=np.full_like(x_K, 0.5), where=x_K != 0)
+        return c_P, 1 - c_P
+
+    def low_rank_terms(
+        self, P: np.ndarray, Q: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Computes V'LU, V'w and the change of stressor intensities of merged pairs, with A' = A + UV'
+
+        Args:
+            P (np.ndarray): first group of each pair
+            Q (np.ndarray): second group of each pair
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: V'LU (pairs x other x other), V'w and delta_s (pairs x other)
+        """
+        c_P, c_Q = self.weights(P=P, Q=Q)
+        block_P, block_Q = self.blocks(P), self.blocks(Q)
+
+        def B_block(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+            # blocks of LA = L - I
+            return self.L[rows[:, :, None], cols[:, None, :]] - (
+                rows[:, :, None] == cols[:, None, :]
+            )
+
+        VLU = c_P[:, :, None] * (
+            B_block(block_P, block_Q) - B_block(block_P, block_P)
+        ) - c_Q[:, :, None] * (B_block(block_Q, block_Q) - B_block(block_Q, block_P))
+        Vw = c_P * self.w[block_P] - c_Q * self.w[block_Q]
+        delta_s = self.s[block_Q] - self.s[block_P]
+        return VLU, Vw, delta_s
+
+    def evaluate(self, P: np.ndarray, Q: np.ndarray) -> np.ndarray:
+        """Computes the footprint after each candidate merge
+
+        Args:
+            P (np.ndarray): first group of each pair
+            Q (np.ndarray): second group of each pair
+
+        Returns:
+            np.ndarray: footprint (without direct emissions) after merging each pair
+        """
+        VLU, Vw, delta_s = self.low_rank_terms(P=P, Q=Q)
+        mA = self.m - self.s  # sLA = sL - s
+        mU = mA[self.blocks(Q)] - mA[self.blocks(P)]
+        z = np.linalg.solve(np.eye(self.n_other)[None] - VLU, Vw[:, :, None])[:, :, 0]
+        return (
+            self.footprint
+            + (mU * z).sum(axis=1)
+            + (delta_s * Vw).sum(axis=1)
+            + np.einsum("pi,pij,pj->p", delta_s, VLU, z)
+        )
+
+    def merge(self, P: int, Q: int) -> None:
+        """Merges group Q into group P, updating L with the Woodbury formula
+
+        Args:
+            P (int): group kept
+            Q (int): group merged into P
+        """
+        P_array, Q_array = np.array([P]), np.array([Q])
+        VLU, _, _ = self.low_rank_terms(P=P_array, Q=Q_array)
+        c_P, c_Q = self.weights(P=P_array, Q=Q_array)
+        block_P, block_Q = self.blocks(P_array)[0], self.blocks(Q_array)[0]
+
+        LU = (
+            self.L[:, block_Q] - self.L[:, block_P]
+        )  # LA = L - I, identity terms cancel
+        LU[block_Q, np.arange(self.n_other)] -= 1
+        LU[block_P, np.arange(self.n_other)] += 1
+        VL = c_P[0][:, None] * self.L[block_P] - c_Q[0][:, None] * self.L[block_Q]
+        L = self.L + LU @ np.linalg.solve(np.eye(self.n_other) - VLU[0], VL)
+
+        # rows are summed, the columns of the merged groups being equal
+        keep = np.setdiff1d(np.arange(len(self.x)), block_Q)
+        L[block_P] += L[block_Q]
+        self.L = L[np.ix_(keep, keep)]
+        for name in ["x", "emissions", "y"]:
+            values = getattr(self, name)
+            values[block_P] += values[block_Q]
+            setattr(self, name, values[keep])
+        self.n_groups -= 1
+        self.update()
+
+
+def merge_frontier(
+    model,
+    axis: str = "regions",
+    region: str = "FR",
+    min_size: int = 1,
+    verbose: bool = True,
+) -> pd.DataFrame:
+    """Greedily merges the regions or the sectors of a calibrated model, each step choosing the merge with the smallest footprint error
+
+    Args:
+        model (Model): object Model defined in model.py, at the finest resolution available
+        axis (str, optional): 'regions' or 'sectors'. Defaults to "regions".
+        region (str, optional): region whose footprint is estimated, never merged when axis is 'regions'. Defaults to "FR".
+        min_size (int, optional): number of categories (region excluded) at which the merges stop. Defaults to 1.
+        verbose (bool, optional): True to print infos. Defaults to True.
+
+    Returns:
+        pd.DataFrame: error-vs-size frontier, with the footprint, its relative error, the merge performed and the group of each category for each number of categories
+    """
+    categories = list(model.regions if axis == "regions" else model.sectors)
+    permutation = axis_permutation(
+        n_regions=len(model.regions), n_sectors=len(model.sectors), axis=axis
+    )
+    arrays = extract_arrays(model=model, region=region)
+    for name in ["x", "emissions", "y"]:
+        arrays[name] = arrays[name][permutation]
+    arrays["L"] = arrays["L"][np.ix_(permutation, permutation)]
+    state = MergeState(arrays=arrays, n_groups=len(categories))
+
+    fixed = [region] if axis == "regions" else []
+    groups = [[category] for category in categories]
+    full_footprint = state.footprint + arrays["F_Y"]
+    pairs_per_chunk = max(1, int(CHUNK_SIZE_MB * 2**20 / (8 * 4 * state.n_other**2)))
+
+    def record(merged: str) -> Dict:
+        footprint = state.footprint + arrays["F_Y"]
+        return {
+            "size": len(groups) - len(fixed),
+            "footprint": footprint,
+            "relative_error": abs(footprint - full_footprint) / abs(full_footprint),
+            "merged": merged,
+            "groups": {
+                category: " + ".join(group) for group in groups for category in group
+            },
+        }
+
+    frontier = [record(merged=None)]
+    while len(groups) - len(fixed) > min_size:
+        candidates = [i for i, group in enumerate(groups) if group[0] not in fixed]
+        P, Q = np.array(
+            [(i, j) for k, i in enumerate(candidates) for j in candidates[k + 1 :]]
+        ).T
+        footprints = np.concatenate(
+            [
+                state.evaluate(
+                    P=P[start : start + pairs_per_chunk],
+                    Q=Q[start : start + pairs_per_chunk],
+                )
+                for start in range(0, len(P), pairs_per_chunk)
+            ]
+        )
+        best = int(np.argmin(np.abs(footprints + arrays["F_Y"] - full_footprint)))
+        best_P, best_Q = int(P[best]), int(Q[best])
+
+        merged = f"{' + '.join(groups[best_P])} <- {' + '.join(groups[best_Q])}"
+        state.merge(P=best_P, Q=best_Q)
+        groups[best_P] += groups.pop(best_Q)
+        frontier.append(record(merged=merged))
+        if verbose:
+            print(
+                f"{frontier[-1]['size']} {axis}: relative error {frontier[-1]['relative_error']:.2e} ({merged})"
+            )
+
+    return pd.DataFrame(frontier).set_index("size")
+
+
+### EXISTING AGGREGATIONS ###
+
+
+def relative_aggregation_matrix(
+    model, aggregation_name: str, axis: str
+) -> pd.DataFrame:
+    """Expresses an aggregation from data/aggregation in terms of the model's categories
+
+    Args:
+        model (Model): object Model defined in model.py
+        aggregation_name (str): name of the aggregation matrix, coarser than the model's one
+        axis (str): 'regions' or 'sectors'
+
+    Returns:
+        pd.DataFrame: aggregation matrix with the model's categories as rows
+    """
+    base_matrix = load_aggregation_matrices(aggregation_name=model.aggregation_name)[
+        axis
+    ]
+    other_matrix = load_aggregation_matrices(aggregation_name=aggregation_name)[axis]
+    counts = base_matrix.T.dot(other_matrix.reindex(base_matrix.index))
+    matrix = counts.div(base_matrix.sum(axis=0), axis=0)
+    if not np.isin(matrix.values, [0, 1]).all():
+        raise ValueError(
+            f"The {axis} of {aggregation_name} are not unions of the {axis} of {model.aggregation_name}"
+        )
+    return matrix.reindex(model.regions if axis == "regions" else model.sectors)
+
+
+def aggregation_bias(
+    model, aggregation_names: List[str], region: str = "FR"
+) -> pd.DataFrame:
+    """Computes the footprint error of aggregations from data/aggregation, relative to the model
+
+    Args:
+        model (Model): object Model defined in model.py, finer than the aggregations
+        aggregation_names (List[str]): names of the aggregation matrices
+        region (str, optional): region whose footprint is estimated. Defaults to "FR".
+
+    Returns:
+        pd.DataFrame: sizes, footprint and relative error of each aggregation (as index)
+    """
+    arrays = extract_arrays(model=model, region=region)
+    full_footprint = (
+        technical_emissions_footprint(
+            Z=arrays["Z"], x=arrays["x"], emissions=arrays["emissions"], y=arrays["y"]
+        )
+        + arrays["F_Y"]
+    )
+    bias = {}
+    for aggregation_name in aggregation_names:
+        G_regions, G_sectors = (
+            relative_aggregation_matrix(
+                model=model, aggregation_name=aggregation_name, axis=axis
+            ).values
+            for axis in ["regions", "sectors"]
+        )
+        G = np.kron(G_regions, G_sectors)
+        footprint = (
+            technical_emissions_footprint(
+                Z=G.T @ arrays["Z"] @ G,
+                x=G.T @ arrays["x"],
+                emissions=G.T @ arrays["emissions"],
+                y=G.T @ arrays["y"],
+            )
+            + arrays["F_Y"]
+        )
+        bias[aggregation_name] = {
+            "regions": G_regions.shape[1],
+            "sectors": G_sectors.shape[1],
+            "footprint": footprint,
+            "relative_error": abs(footprint - full_footprint) / abs(full_footprint),
+        }
+    return pd.DataFrame.from_dict(bias, orient="index")
+
+
+### OUTPUT ###
+
+
+def frontier_aggregation(
+    model,
+    frontier: pd.DataFrame,
+    size: int,
+    axis: str = "regions",
+    region: str = "FR",
+    name: str = None,
+    overwrite: bool = False,
+) -> pd.DataFrame:
+    """Builds the aggregation matrix of a point of the frontier, and writes it in data/aggregation/<name>.xlsx if name is given
+
+    Args:
+        model (Model): object Model defined in model.py
+        frontier (pd.DataFrame): frontier returned by merge_frontier
+        size (int): number of categories (region excluded) of the point
+        axis (str, optional): axis of the frontier, 'regions' or 'sectors'. Defaults to "regions".
+        region (str, optional): region kept as its own category when axis is 'regions'. Defaults to "FR".
+        name (str, optional): name of the aggregation to write, nothing is written if None. Defaults to None.
+        overwrite (bool, optional): True to replace an existing aggregation. Defaults to False.
+
+    Returns:
+        pd.DataFrame: aggregation matrix from the model's categories
+    """
+    groups = frontier.loc[size, "groups"]
+    categories = list(groups.keys())
+    weights = model.iot.x["indout"].groupby(level=axis[:-1]).sum()
+    features = pd.DataFrame({"weight": weights.reindex(categories)})
+    labels = pd.factorize(pd.Series(groups).reindex(categories))[0]
+    matrix = clusters_to_matrix(
+        categories=categories,
+        clusters=name_clusters(features=features, labels=labels),
+        first=[region] if axis == "regions" else None,
+    )
+
+    if name is not None:
+        base_matrix = load_aggregation_matrices(aggregation_name=model.aggregation_name)
+        base_matrix[axis] = compose_aggregation(
+            base_matrix=base_matrix[axis], cluster_matrix=matrix
+        )
+        write_aggregation(agg_matrix=base_matrix, name=name, overwrite=overwrite)
+    return matrix
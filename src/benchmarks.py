@@ -0,0 +1,757 @@
+"""Offline benchmarks of the whole pipeline on synthetic MRIO data
+
+Run with `python -m src.benchmarks --sizes mini opti_S` from the repository root, add --thread-split to find the best split of the cores between parallel models and BLAS threads.
+Results are written as JSON in data/benchmarks.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+import platform
+import pymrio
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+from src.profiling import max_rss_mb
+from src.settings import DATA_DIR, PRECISIONS, create_dir
+from src.stressors import GHG_PARAMS
+from src.threads import available_cores, set_thread_budget, split_cores
+from src.utils import (
+    aggregate_iot,
+    calc_system,
+    cast_iot,
+    endogenize_capital,
+    extract_stressors,
+    recal_stressor_per_region,
+)
+
+BENCHMARKS_DIR = DATA_DIR / "benchmarks"
+
+# absolute differences below which measurements are considered as noise
+MEASUREMENT_NOISE = {"wall_time_s": 0.05, "peak_alloc_mb": 1.0}
+
+# modules only needed for plotting or downloading, which must not be loaded by the compute path
+# (pymrio itself imports matplotlib.pyplot and requests, so these two can't be listed)
+FORBIDDEN_COMPUTE_IMPORTS = [
+    "adjustText",
+    "pycountry",
+    "scipy.io",
+    "seaborn",
+    "sklearn",
+    "src.figures",
+    "wget",
+]
+COMPUTE_MODULES = ["src.model", "src.scenarios"]
+
+
+### SYNTHETIC DATA ###
+
+# (raw regions, raw sectors, aggregated regions, aggregated sectors)
+# the aggregated sizes mimic the aggregation matrices from data/aggregation
+SYNTHETIC_SIZES = {
+    "mini": (12, 50, 4, 17),
+    "opti_S": (25, 100, 13, 17),
+    "maxi": (49, 200, 49, 17),
+    "full": (49, 200, 49, 200),
+}
+
+Y_CATEGORIES = [
+    "Final consumption expenditure by households",
+    "Final consumption expenditure by non-profit organisations serving households (NPISH)",
+    "Final consumption expenditure by government",
+    "Gross fixed capital formation",
+    "Changes in inventories",
+    "Changes in valuables",
+    "Exports: Total (fob)",
+]
+
+FACTOR_INPUTS = [
+    "Taxes less subsidies on products purchased: Total",
+    "Other net taxes on production",
+    "Compensation of employees; wages, salaries, & employers' social contributions: Low-skilled",
+    "Compensation of employees; wages, salaries, & employers' social contributions: Medium-skilled",
+    "Compensation of employees; wages, salaries, & employers' social contributions: High-skilled",
+    "Operating surplus: Consumption of fixed capital",
+    "Operating surplus: Rents on land",
+    "Operating surplus: Royalties on resources",
+    "Operating surplus: Remaining net operating surplus",
+]
+
+
+def build_synthetic_iot(
+    n_regions: int,
+    n_sectors: int,
+    stressor_params: Dict = GHG_PARAMS,
+    seed: int = 0,
+) -> Dict:
+    """Builds a random raw MRIO system formatted like the output of pymrio.parse_exiobase3, with its capital consumption matrix
+
+    Args:
+        n_regions (int): number of regions, the first one being "FR"
+        n_sectors (int): number of sectors
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy as a dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight). Defaults to a dictionnary with the GHGs.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        Dict: raw pymrio object with key 'iot' and capital consumption matrix with key 'Kbar'
+    """
+    rng = np.random.default_rng(seed)
+    regions = ["FR"] + [f"R{i:02d}" for i in range(1, n_regions)]
+    sectors = [f"Product {j:03d}" for j in range(n_sectors)]
+    n = n_regions * n_sectors
+    index = pd.MultiIndex.from_product([regions, sectors], names=["region", "sector"])
+    y_columns = pd.MultiIndex.from_product(
+        [regions, Y_CATEGORIES], names=["region", "category"]
+    )
+
+    # technical coefficients, with a strong domestic bias and column sums in [0.3, 0.7]
+    A = rng.random((n, n)) * (rng.random((n, n)) < 0.3)
+    region_of = np.repeat(np.arange(n_regions), n_sectors)
+    A[region_of[:, None] == region_of[None, :]] *= 5 * n_regions
+    A /= np.maximum(A.sum(axis=0), 1e-12)
+    A *= rng.uniform(0.3, 0.7, size=n)
+
+    # final demand, mostly domestic, capital goods only for some products
+    Y = rng.random((n, n_regions * len(Y_CATEGORIES))) * 10
+    Y[region_of[:, None] == np.repeat(np.arange(n_regions), len(Y_CATEGORIES))] *= (
+        5 * n_regions
+    )
+    gfcf = np.arange(n_regions) * len(Y_CATEGORIES) + Y_CATEGORIES.index(
+        "Gross fixed capital formation"
+    )
+    capital_goods = np.tile(rng.random(n_sectors) < 0.1, n_regions)
+    capital_goods[0] = True
+    Y[:, gfcf] *= capital_goods[:, None] * 20
+
+    x = np.linalg.solve(np.eye(n) - A, Y.sum(axis=1))
+    Z = A * x
+    del A
+
+    # factor inputs balancing the table, consumption of fixed capital included
+    value_added = np.maximum(x - Z.sum(axis=0), 0)
+    F_factors = rng.dirichlet(np.ones(len(FACTOR_INPUTS)), size=n).T * value_added
+
+    # capital consumption, spread over capital goods like gross fixed capital formation
+    cfc_row = FACTOR_INPUTS.index("Operating surplus: Consumption of fixed capital")
+    Kbar = np.zeros((n, n))
+    for reg in range(n_regions):
+        columns = region_of == reg
+        gfcf_shares = Y[:, gfcf[reg]] / Y[:, gfcf[reg]].sum()
+        cfc = F_factors[cfc_row, columns]
+        cfc *= min(1, 0.5 * Y[:, gfcf[reg]].sum() / cfc.sum())
+        Kbar[:, columns] = np.outer(gfcf_shares, cfc)
+
+    # stressors, with log-normal intensities
+    stressors = list(
+        dict.fromkeys(
+            key
+            for proxy in stressor_params["proxy"].values()
+            for key in proxy["exiobase_keys"]
+        )
+    )
+    intensities = rng.lognormal(mean=0, sigma=2, size=(len(stressors), n))
+    F_stressors = intensities * x
+    households = np.arange(n_regions) * len(Y_CATEGORIES)
+    F_Y_stressors = np.zeros((len(stressors), len(y_columns)))
+    F_Y_stressors[:, households] = rng.lognormal(
+        mean=0, sigma=2, size=(len(stressors), n_regions)
+    ) * Y[:, households].sum(axis=0)
+
+    satellite_index = pd.Index(FACTOR_INPUTS + stressors, name="stressor")
+    satellite = {
+        "name": "satellite",
+        "F": pd.DataFrame(
+            np.vstack([F_factors, F_stressors]), index=satellite_index, columns=index
+        ),
+        "F_Y": pd.DataFrame(
+            np.vstack([np.zeros((len(FACTOR_INPUTS), len(y_columns))), F_Y_stressors]),
+            index=satellite_index,
+            columns=y_columns,
+        ),
+        "unit": pd.DataFrame(
+            len(FACTOR_INPUTS) * ["M.EUR"] + len(stressors) * ["kg"],
+            index=satellite_index,
+            columns=["unit"],
+        ),
+    }
+    impacts_index = pd.Index(["synthetic impact"], name="impact")
+    impacts = {
+        "name": "impacts",
+        "F": pd.DataFrame(
+            F_stressors.sum(axis=0, keepdims=True), index=impacts_index, columns=index
+        ),
+        "F_Y": pd.DataFrame(
+            F_Y_stressors.sum(axis=0, keepdims=True),
+            index=impacts_index,
+            columns=y_columns,
+        ),
+        "unit": pd.DataFrame(["kg"], index=impacts_index, columns=["unit"]),
+    }
+
+    iot = pymrio.IOSystem(
+        Z=pd.DataFrame(Z, index=index, columns=index),
+        Y=pd.DataFrame(Y, index=index, columns=y_columns),
+        x=pd.DataFrame(x, index=index, columns=["indout"]),
+        unit=pd.DataFrame("M.EUR", index=index, columns=["unit"]),
+        system="pxp",
+        version="synthetic",
+        name="synthetic",
+        satellite=satellite,
+        impacts=impacts,
+    )
+    Kbar = pd.DataFrame(Kbar, index=index, columns=index)
+
+    return {"iot": iot, "Kbar": Kbar}
+
+
+def build_synthetic_aggregation(
+    regions: List[str],
+    sectors: List[str],
+    n_agg_regions: int,
+    n_agg_sectors: int,
+    seed: int = 0,
+) -> Dict[str, pd.DataFrame]:
+    """Builds random aggregation matrices formatted like the ones returned by load_aggregation_matrices, "FR" being kept alone
+    The first aggregated regions are named "FR", "EU" and "China, RoW Asia and Pacific" so that the default scenarios apply
+
+    Args:
+        regions (List[str]): raw regions, the first one being "FR"
+        sectors (List[str]): raw sectors
+        n_agg_regions (int): number of aggregated regions, at least 3
+        n_agg_sectors (int): number of aggregated sectors
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        Dict[str, pd.DataFrame]: aggregation matrices (old categories as rows, new ones as columns) with keys 'sectors' and 'regions'
+    """
+    rng = np.random.default_rng(seed)
+
+    def random_partition(n_old: int, n_new: int) -> np.array:
+        groups = np.concatenate(
+            [np.arange(n_new), rng.integers(0, n_new, size=n_old - n_new)]
+        )
+        return rng.permutation(groups)
+
+    region_groups = np.concatenate(
+        [[0], 1 + random_partition(len(regions) - 1, n_agg_regions - 1)]
+    )
+    sector_groups = random_partition(len(sectors), n_agg_sectors)
+
+    agg_regions = ["FR", "EU", "China, RoW Asia and Pacific"] + [
+        f"Region {i:02d}" for i in range(3, n_agg_regions)
+    ]  # named after the regions used in DICT_SCENARIOS
+    agg_sectors = [f"Sector {j:02d}" for j in range(n_agg_sectors)]
+
+    return {
+        "regions": pd.DataFrame(
+            (region_groups[:, None] == np.arange(n_agg_regions)).astype(int),
+            index=pd.MultiIndex.from_arrays(
+                [regions, regions], names=["Country name", "Country code"]
+            ),
+            columns=agg_regions,
+        ),
+        "sectors": pd.DataFrame(
+            (sector_groups[:, None] == np.arange(n_agg_sectors)).astype(int),
+            index=pd.MultiIndex.from_arrays(
+                [sectors, sectors, sectors],
+                names=["category", "sub_category", "sector"],
+            ),
+            columns=agg_sectors,
+        ),
+    }
+
+
+def model_from_iot(
+    iot: pymrio.IOSystem,
+    work_dir: pathlib.PosixPath,
+    stressor_params: Dict = GHG_PARAMS,
+    capital: bool = False,
+    solver: str = "dense",
+):
+    """Wraps a calibrated pymrio object into a Model without reading nor writing in data/
+
+    Args:
+        iot (pymrio.IOSystem): calibrated pymrio object
+        work_dir (pathlib.PosixPath): where to save the figures
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy. Defaults to a dictionnary with the GHGs.
+        capital (bool, optional): True if capital is endogenous. Defaults to False.
+        solver (str, optional): Leontief solver the pymrio object was calibrated with, see leontief.py. Defaults to 'dense'.
+
+    Returns:
+        Model: object Model defined in model.py
+    """
+    from src.model import Model
+
+    model = Model.__new__(Model)
+    model._set_parameters(
+        base_year=0,
+        system="pxp",
+        aggregation_name="synthetic",
+        calib=False,
+        capital=capital,
+        stressor_params=stressor_params,
+        precision=iot.Z.values.dtype.name,
+        solver=solver,
+    )
+    # nothing is read nor written in data/
+    model.exiobase_dir = model.model_dir = model.figures_dir = pathlib.Path(work_dir)
+    model.backup_dir = model.model_dir / "backup"
+    model._set_iot(iot=iot)
+    return model
+
+
+### MEASUREMENTS ###
+
+
+@contextmanager
+def measure(results: List[Dict], stage: str, **infos) -> Iterator[None]:
+    """Context manager appending the wall time and the memory peak of a stage to results
+
+    Args:
+        results (List[Dict]): list of stage records to complete
+        stage (str): name of the stage
+        **infos: additional fields of the record
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    start_traced = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_traced = tracemalloc.get_traced_memory()[1]
+        results.append(
+            {
+                "stage": stage,
+                **infos,
+                "wall_time_s": wall_time,
+                "peak_alloc_mb": (peak_traced - start_traced) / 2**20,
+                "max_rss_mb": max_rss_mb(),
+            }
+        )
+
+
+### BENCHMARKS ###
+
+
+def run_pipeline_benchmark(
+    size_name: str,
+    scenarios: Dict[str, Callable] = None,
+    figures: bool = True,
+    stressor_params: Dict = GHG_PARAMS,
+    precision: str = "float64",
+    seed: int = 0,
+) -> List[Dict]:
+    """Times and memory-profiles each stage of the pipeline on synthetic data
+
+    Args:
+        size_name (str): key of SYNTHETIC_SIZES
+        scenarios (Dict[str, Callable], optional): scenarios to benchmark, set as DICT_SCENARIOS from scenarios.py if None. Defaults to None.
+        figures (bool, optional): True to benchmark the figures. Defaults to True.
+        stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy. Defaults to a dictionnary with the GHGs.
+        precision (str, optional): floating point type of the matrices ('float64' or 'float32'). Defaults to 'float64'.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        List[Dict]: one record per stage
+    """
+    if scenarios is None:
+        from src.scenarios import DICT_SCENARIOS
+
+        scenarios = DICT_SCENARIOS
+
+    n_regions, n_sectors, n_agg_regions, n_agg_sectors = SYNTHETIC_SIZES[size_name]
+    results = []
+    infos = {"size": size_name, "precision": precision}
+
+    tracemalloc.start()
+    try:
+        with measure(results, "synthetic_data", **infos):
+            synthetic = build_synthetic_iot(
+                n_regions=n_regions,
+                n_sectors=n_sectors,
+                stressor_params=stressor_params,
+                seed=seed,
+            )
+            iot = synthetic["iot"]
+            agg_matrix = build_synthetic_aggregation(
+                regions=list(iot.get_regions()),
+                sectors=list(iot.get_sectors()),
+                n_agg_regions=n_agg_regions,
+                n_agg_sectors=n_agg_sectors,
+                seed=seed,
+            )
+
+        with measure(results, "capital_endogenisation", **infos):
+            iot = endogenize_capital(iot=iot, Kbar=synthetic["Kbar"], verbose=False)
+        del synthetic
+
+        with measure(results, "aggregation", **infos):
+            iot = aggregate_iot(iot=iot, agg_matrix=agg_matrix)
+
+        with measure(results, "stressor_extraction", **infos):
+            iot = extract_stressors(iot=iot, stressor_dict=stressor_params["proxy"])
+
+        iot = cast_iot(iot=iot, precision=precision)
+        with measure(results, "calc_all", **infos):
+            iot = calc_system(iot=iot)
+
+        with measure(results, "recal_stressor_per_region", **infos):
+            iot.stressor_extension = recal_stressor_per_region(iot=iot)
+        iot = cast_iot(iot=iot, precision=precision)
+
+        with tempfile.TemporaryDirectory() as work_dir:
+
+            with measure(results, "save_all", **infos):
+                iot.save_all(pathlib.Path(work_dir) / "model")
+
+            model = model_from_iot(
+                iot=iot, work_dir=work_dir, stressor_params=stressor_params
+            )
+
+            for name, scenar_function in scenarios.items():
+                with measure(results, "scenario", scenario=name, **infos):
+                    scenar_function(model=model, reloc=False)
+                with measure(
+                    results, "build_counterfactual_data", scenario=name, **infos
+                ):
+                    model.new_counterfactual(
+                        name=name, scenar_function=scenar_function, reloc=False
+                    )
+
+            if figures and len(model.counterfactuals):
+                results += run_figures_benchmark(model=model, infos=infos)
+
+    finally:
+        tracemalloc.stop()
+
+    return results
+
+
+def run_figures_benchmark(model, infos: Dict) -> List[Dict]:
+    """Times and memory-profiles the figure functions on a model with at least one counterfactual
+
+    Args:
+        model (Model): object Model defined in model.py
+        infos (Dict): additional fields of the records
+
+    Returns:
+        List[Dict]: one record per figure function
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import src.figures as figures
+
+    counterfactual_name = model.get_counterfactuals_list()[0]
+    figure_functions = {
+        "plot_footprint_FR": lambda: figures.plot_footprint_FR(model=model),
+        "plot_stressor_content_heatmap": lambda: figures.plot_stressor_content_heatmap(
+            model=model
+        ),
+        "plot_stressor_content_production": lambda: figures.plot_stressor_content_production(
+            model=model
+        ),
+        "plot_trade_synthesis": lambda: figures.plot_trade_synthesis(
+            model=model, counterfactual_name=counterfactual_name
+        ),
+        "plot_stressor_synthesis": lambda: figures.plot_stressor_synthesis(
+            model=model, counterfactual_name=counterfactual_name
+        ),
+    }
+
+    results = []
+    for name, figure_function in figure_functions.items():
+        with measure(results, "figure", figure=name, **infos):
+            figure_function()
+            plt.close("all")
+    return results
+
+
+def run_import_benchmark(modules: List[str] = COMPUTE_MODULES) -> List[Dict]:
+    """Times the import of the compute path in a fresh interpreter and lists the plotting and downloading modules it loads
+
+    Args:
+        modules (List[str], optional): modules to import. Defaults to COMPUTE_MODULES.
+
+    Returns:
+        List[Dict]: one record for the import
+    """
+    code = (
+        "import json, sys, time, tracemalloc\n"
+        "tracemalloc.start()\n"
+        "start = time.perf_counter()\n"
+        f"import {', '.join(modules)}\n"
+        "wall_time = time.perf_counter() - start\n"
+        "print(json.dumps({\n"
+        "    'wall_time_s': wall_time,\n"
+        "    'peak_alloc_mb': tracemalloc.get_traced_memory()[1] / 2**20,\n"
+        f"    'forbidden_modules': [m for m in {FORBIDDEN_COMPUTE_IMPORTS} if m in sys.modules],\n"
+        "}))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=pathlib.Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    record = json.loads(output.stdout.strip().splitlines()[-1])
+    return [
+        {
+            "stage": "import",
+            "modules": ",".join(modules),
+            "wall_time_s": record["wall_time_s"],
+            "peak_alloc_mb": record["peak_alloc_mb"],
+            "forbidden_modules": ",".join(record["forbidden_modules"]),
+        }
+    ]
+
+
+def run_leontief_task(path: pathlib.PosixPath) -> float:
+    """Computes the Leontief inverse and the stressor accounts of a pickled pymrio object, in a worker process
+
+    Args:
+        path (pathlib.PosixPath): pickle of the pymrio object, without its Leontief inverse
+
+    Returns:
+        float: wall time in seconds
+    """
+    import pickle as pkl
+
+    with open(path, "rb") as f:
+        iot = pkl.load(f)
+    start = time.perf_counter()
+    iot = calc_system(iot=iot)
+    iot.stressor_extension = recal_stressor_per_region(iot=iot)
+    return time.perf_counter() - start
+
+
+def run_thread_split_benchmark(
+    size_name: str, n_models: int = 8, cores: int = None, seed: int = 0
+) -> List[Dict]:
+    """Times the calibration of several models in parallel for each split of the cores between worker processes and BLAS threads
+
+    Args:
+        size_name (str): key of SYNTHETIC_SIZES
+        n_models (int, optional): number of models calibrated by each split. Defaults to 8.
+        cores (int, optional): number of cores to share, all the available ones if None. Defaults to None.
+        seed (int, optional): seed of the random generator. Defaults to 0.
+
+    Returns:
+        List[Dict]: one record per split, with the number of workers and of BLAS threads per worker
+    """
+    import concurrent.futures
+    import pickle as pkl
+
+    if cores is None:
+        cores = available_cores()
+    n_regions, n_sectors, n_agg_regions, n_agg_sectors = SYNTHETIC_SIZES[size_name]
+    synthetic = build_synthetic_iot(
+        n_regions=n_regions,
+        n_sectors=n_sectors,
+        stressor_params=GHG_PARAMS,
+        seed=seed,
+    )
+    iot = synthetic["iot"]
+    agg_matrix = build_synthetic_aggregation(
+        regions=list(iot.get_regions()),
+        sectors=list(iot.get_sectors()),
+        n_agg_regions=n_agg_regions,
+        n_agg_sectors=n_agg_sectors,
+        seed=seed,
+    )
+    iot = endogenize_capital(iot=iot, Kbar=synthetic["Kbar"], verbose=False)
+    iot = aggregate_iot(iot=iot, agg_matrix=agg_matrix)
+    iot = extract_stressors(iot=iot, stressor_dict=GHG_PARAMS["proxy"])
+    del synthetic
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = pathlib.Path(work_dir) / "iot.pickle"
+        with open(path, "wb") as f:
+            pkl.dump(iot, f)
+        workers_list = sorted(
+            {min(2**i, cores, n_models) for i in range(cores.bit_length() + 1)}
+        )
+        for workers in workers_list:
+            threads = split_cores(workers=workers, cores=cores)
+            with measure(
+                results,
+                "thread_split",
+                size=size_name,
+                n_models=n_models,
+                workers=workers,
+                blas_threads=threads,
+            ):
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=set_thread_budget,
+                    initargs=(threads,),
+                ) as executor:
+                    list(executor.map(run_leontief_task, [path] * n_models))
+    return results
+
+
+def save_results(
+    results: List[Dict], path: pathlib.PosixPath = None
+) -> pathlib.PosixPath:
+    """Saves benchmark results as a JSON file, along with a description of the machine
+
+    Args:
+        results (List[Dict]): stage records
+        path (pathlib.PosixPath, optional): output file, in data/benchmarks if None. Defaults to None.
+
+    Returns:
+        pathlib.PosixPath: path of the JSON file
+    """
+    if path is None:
+        path = create_dir(BENCHMARKS_DIR) / (
+            "pipeline__" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json"
+        )
+    output = {
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "pymrio": pymrio.__version__,
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+    return path
+
+
+def find_regressions(
+    results: List[Dict], baseline_path: pathlib.PosixPath, tolerance: float = 0.2
+) -> List[Dict]:
+    """Compares stage records with the ones of a previous benchmark
+
+    Args:
+        results (List[Dict]): stage records
+        baseline_path (pathlib.PosixPath): JSON file written by save_results
+        tolerance (float, optional): relative increase of wall time or memory peak considered as a regression. Defaults to 0.2.
+
+    Returns:
+        List[Dict]: stages slower or more memory-consuming than in the baseline
+    """
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)["results"]
+
+    def key(record: Dict) -> tuple:
+        return tuple(
+            (k, v)
+            for k, v in record.items()
+            if k not in ["wall_time_s", "peak_alloc_mb", "max_rss_mb"]
+        )
+
+    baseline = {key(record): record for record in baseline}
+    regressions = []
+    for record in results:
+        if key(record) not in baseline:
+            continue
+        for measurement in ["wall_time_s", "peak_alloc_mb"]:
+            before = baseline[key(record)][measurement]
+            after = record[measurement]
+            if after > (1 + tolerance) * before + MEASUREMENT_NOISE[measurement]:
+                regressions.append(
+                    {
+                        **dict(key(record)),
+                        "measurement": measurement,
+                        "baseline": before,
+                        "current": after,
+                    }
+                )
+    return regressions
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the pipeline on synthetic MRIO data"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        default=["mini", "opti_S"],
+        choices=list(SYNTHETIC_SIZES.keys()),
+    )
+    parser.add_argument("--no-figures", action="store_true")
+    parser.add_argument("--no-import", action="store_true")
+    parser.add_argument("--precision", default="float64", choices=PRECISIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=pathlib.Path, default=None)
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        default=None,
+        help="previous results to compare with, exits with an error on regression",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--thread-split",
+        action="store_true",
+        help="also times each split of the cores between worker processes and BLAS threads",
+    )
+    parser.add_argument("--thread-split-models", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    results = []
+    if not args.no_import:
+        print("--- Benchmarking the import of the compute path ---")
+        results += run_import_benchmark()
+    for size_name in args.sizes:
+        print(f"--- Benchmarking size {size_name} ---")
+        results += run_pipeline_benchmark(
+            size_name=size_name,
+            figures=not args.no_figures,
+            precision=args.precision,
+            seed=args.seed,
+        )
+        if args.thread_split:
+            print(f"--- Benchmarking the thread splits for size {size_name} ---")
+            splits = run_thread_split_benchmark(
+                size_name=size_name, n_models=args.thread_split_models, seed=args.seed
+            )
+            best = min(splits, key=lambda record: record["wall_time_s"])
+            for record in splits:
+                print(
+                    f"{record['workers']} worker(s) x {record['blas_threads']} BLAS thread(s): {record['n_models'] / record['wall_time_s']:.2f} models/s"
+                    + (record is best) * " (best)"
+                )
+            results += splits
+    path = save_results(results=results, path=args.output)
+    print(f"Results saved in {path}")
+
+    if args.baseline is not None:
+        regressions = find_regressions(
+            results=results, baseline_path=args.baseline, tolerance=args.tolerance
+        )
+        for regression in regressions:
+            print(f"Regression: {regression}")
+    else:
+        regressions = []
+    for record in results:
+        if record.get("forbidden_modules"):
+            print(f"Regression: the compute path imports {record['forbidden_modules']}")
+            regressions.append(record)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""Clustering of regions and sectors to generate aggregation matrices
+
+The features are computed from a calibrated model, at the finest resolution wanted (e.g. 'maxi' for the regions), and cached in its directory.
+The clusters are then composed with the model's own aggregation so that the written matrices map the raw Exiobase categories, as the ones from data/aggregation.
+"""
+
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from src.settings import AGGREGATION_DIR, create_dir
+from src.utils import load_aggregation_matrices
+
+CLUSTERING_METHODS = ["ward", "kmeans"]
+FEATURES_CACHE_DIR_NAME = "clustering"
+
+
+### FEATURES ###
+
+
+def compute_regions_features(model, region: str = "FR") -> pd.DataFrame:
+    """Computes the regions' stressor content (stressor intensity weighted by the production of each sector) and their share in region's imports
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str, optional): importing region, left out of the clustering. Defaults to "FR".
+
+    Returns:
+        pd.DataFrame: features of the other regions, and their imports to region as 'weight'
+    """
+    iot = model.iot
+    production = iot.x["indout"]
+    emissions = iot.stressor_extension.S.sum(axis=0) * production
+    stressor_content = (
+        emissions.groupby(level="region").sum()
+        / production.groupby(level="region").sum()
+    )
+
+    imports = (
+        (iot.Z[region].sum(axis=1) + iot.Y[region].sum(axis=1))
+        .groupby(level="region")
+        .sum()
+    )
+    imports = imports.drop(region)
+
+    features = pd.DataFrame(
+        {
+            "stressor_content": stressor_content.reindex(imports.index),
+            "import_share": imports / imports.sum(),
+        }
+    )
+    features["weight"] = imports
+    return features.reindex([reg for reg in model.regions if reg != region])
+
+
+def compute_sectors_features(model) -> pd.DataFrame:
+    """Computes the sectors' stressor content (footprint multiplier) in each region
+
+    Args:
+        model (Model): object Model defined in model.py
+
+    Returns:
+        pd.DataFrame: features of the sectors (one column per region), and their world production as 'weight'
+    """
+    iot = model.iot
+    multipliers = iot.stressor_extension.M.sum(axis=0)
+    features = multipliers.unstack(level="region").reindex(
+        index=model.sectors, columns=model.regions
+    )
+    features["weight"] = (
+        iot.x["indout"].groupby(level="sector").sum().reindex(model.sectors)
+    )
+    return features
+
+
+def get_features(
+    model, axis: str, region: str = "FR", force: bool = False
+) -> pd.DataFrame:
+    """Returns the clustering features of the model, from the cache if it is more recent than the calibration
+
+    Args:
+        model (Model): object Model defined in model.py
+        axis (str): 'regions' or 'sectors'
+        region (str, optional): importing region, for the regions' features. Defaults to "FR".
+        force (bool, optional): True to recompute the features. Defaults to False.
+
+    Returns:
+        pd.DataFrame: features as columns, and the weight of each category as 'weight'
+    """
+    if axis not in ["regions", "sectors"]:
+        raise ValueError(f"axis must be 'regions' or 'sectors', not {axis}")
+
+    cache_dir = model.model_dir / FEATURES_CACHE_DIR_NAME
+    cache_path = cache_dir / (
+        f"features__{axis}" + (axis == "regions") * f"__{region}" + ".pickle"
+    )
+    calibration_path = model.model_dir / "file_parameters.json"
+    if (
+        not force
+        and os.path.isfile(cache_path)
+        and os.path.isfile(calibration_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(calibration_path)
+    ):
+        return pd.read_pickle(cache_path)
+
+    if axis == "regions":
+        features = compute_regions_features(model=model, region=region)
+    else:
+        features = compute_sectors_features(model=model)
+    features = features.astype("float64")
+    create_dir(cache_dir)
+    features.to_pickle(cache_path)
+    return features
+
+
+def standardize(features: pd.DataFrame) -> np.ndarray:
+    """Centers and scales the features, constant features are only centered
+
+    Args:
+        features (pd.DataFrame): features as columns, the column 'weight' is ignored
+
+    Returns:
+        np.ndarray: standardized features
+    """
+    values = features.drop(columns="weight").values
+    std = values.std(axis=0)
+    std[std == 0] = 1
+    return (values - values.mean(axis=0)) / std
+
+
+### K-SWEEP ###
+
+
+def within_cluster_inertia(values: np.ndarray, labels: np.ndarray) -> float:
+    """Computes the sum of squared distances of the observations to their cluster's centroid
+
+    Args:
+        values (np.ndarray): observations as rows
+        labels (np.ndarray): cluster of each observation, from 0 to k-1
+
+    Returns:
+        float: inertia
+    """
+    one_hot = np.eye(labels.max() + 1)[labels]
+    centroids = (one_hot.T @ values) / one_hot.sum(axis=0)[:, None]
+    return float(((values - centroids[labels]) ** 2).sum())
+
+
+def _fit_kmeans(values: np.ndarray, k: int, seed: int) -> np.ndarray:
+    from sklearn.cluster import KMeans
+
+    return KMeans(n_clusters=k, n_init=10, random_state=seed).fit(values).labels_
+
+
+def sweep_k(
+    values: np.ndarray,
+    k_values: List[int],
+    method: str = "ward",
+    seed: int = 0,
+    max_workers: int = None,
+) -> pd.DataFrame:
+    """Clusters the observations for each number of clusters and scores the partitions
+
+    Ward's linkage is computed once and cut at every k, KMeans is fitted for every k in parallel processes.
+
+    Args:
+        values (np.ndarray): standardized observations as rows
+        k_values (List[int]): numbers of clusters to try
+        method (str, optional): 'ward' or 'kmeans'. Defaults to "ward".
+        seed (int, optional): random state of KMeans. Defaults to 0.
+        max_workers (int, optional): number of processes for KMeans, as many as CPUs if None. Defaults to None.
+
+    Returns:
+        pd.DataFrame: labels, inertia and silhouette score for each k (as index)
+    """
+    if method not in CLUSTERING_METHODS:
+        raise ValueError(f"method must be in {CLUSTERING_METHODS}, not {method}")
+    k_values = [k for k in k_values if 1 <= k <= len(values)]
+
+    if method == "ward":
+        from scipy.cluster.hierarchy import cut_tree, linkage
+
+        tree = linkage(values, method="ward", metric="euclidean")
+        all_labels = cut_tree(tree, n_clusters=k_values).T
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            all_labels = list(
+                executor.map(
+                    _fit_kmeans,
+                    [values] * len(k_values),
+                    k_values,
+                    [seed] * len(k_values),
+                )
+            )
+
+    from sklearn.metrics import silhouette_score
+
+    sweep = pd.DataFrame(index=pd.Index(k_values, name="k"))
+    sweep["labels"] = [np.asarray(labels) for labels in all_labels]
+    sweep["inertia"] = [
+        within_cluster_inertia(values=values, labels=labels)
+        for labels in sweep["labels"]
+    ]
+    sweep["silhouette"] = [
+        silhouette_score(values, labels) if 1 < k < len(values) else np.nan
+        for k, labels in sweep["labels"].items()
+    ]
+    return sweep
+
+
+### AGGREGATION MATRICES ###
+
+
+def name_clusters(features: pd.DataFrame, labels: np.ndarray) -> List[str]:
+    """Names each category's cluster after its member with the highest weight
+
+    Args:
+        features (pd.DataFrame): features of the categories (as index), with their 'weight'
+        labels (np.ndarray): cluster of each category
+
+    Returns:
+        List[str]: cluster name of each category
+    """
+    members = pd.DataFrame({"label": labels, "weight": features["weight"].values})
+    members.index = features.index
+    names = {}
+    for label, group in members.groupby("label"):
+        top = group["weight"].idxmax()
+        names[label] = top if len(group) == 1 else f"{top} group"
+    return [names[label] for label in labels]
+
+
+def clusters_to_matrix(
+    categories: List[str], clusters: List[str], first: List[str] = None
+) -> pd.DataFrame:
+    """Builds a 0/1 aggregation matrix from the cluster of each category
+
+    Args:
+        categories (List[str]): categories, in the model's order
+        clusters (List[str]): cluster name of each category
+        first (List[str], optional): clusters to put first. Defaults to None.
+
+    Returns:
+        pd.DataFrame: aggregation matrix with categories as rows and clusters as columns, ordered by first appearance
+    """
+    if first is None:
+        first = []
+    columns = first + [
+        name for name in dict.fromkeys(clusters).keys() if name not in first
+    ]
+    matrix = pd.DataFrame(0, index=categories, columns=columns)
+    matrix.values[np.arange(len(categories)), matrix.columns.get_indexer(clusters)] = 1
+    return matrix
+
+
+def cluster_axis(
+    model,
+    axis: str,
+    n_clusters: int = None,
+    k_values: List[int] = None,
+    method: str = "ward",
+    region: str = "FR",
+    seed: int = 0,
+    max_workers: int = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Clusters the model's regions or sectors
+
+    Args:
+        model (Model): object Model defined in model.py
+        axis (str): 'regions' or 'sectors'
+        n_clusters (int, optional): number of clusters (region excluded), the best silhouette score of the sweep if None. Defaults to None.
+        k_values (List[int], optional): numbers of clusters to try, from 2 to the number of categories if None. Defaults to None.
+        method (str, optional): 'ward' or 'kmeans'. Defaults to "ward".
+        region (str, optional): importing region, kept as its own cluster. Defaults to "FR".
+        seed (int, optional): random state of KMeans. Defaults to 0.
+        max_workers (int, optional): number of processes for KMeans. Defaults to None.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: aggregation matrix from the model's categories, and the k-sweep scores
+    """
+    features = get_features(model=model, axis=axis, region=region)
+    values = standardize(features=features)
+
+    if k_values is None:
+        k_values = list(range(2, len(values)))
+    if n_clusters is not None and n_clusters not in k_values:
+        k_values = sorted(k_values + [n_clusters])
+    sweep = sweep_k(
+        values=values,
+        k_values=k_values,
+        method=method,
+        seed=seed,
+        max_workers=max_workers,
+    )
+    if n_clusters is None:
+        n_clusters = int(sweep["silhouette"].idxmax())
+
+    clusters = name_clusters(features=features, labels=sweep.loc[n_clusters, "labels"])
+    if axis == "regions":
+        matrix = clusters_to_matrix(
+            categories=[region] + list(features.index),
+            clusters=[region] + clusters,
+            first=[region],
+        )
+    else:
+        matrix = clusters_to_matrix(categories=list(features.index), clusters=clusters)
+    return matrix, sweep.drop(columns="labels")
+
+
+def compose_aggregation(
+    base_matrix: pd.DataFrame, cluster_matrix: pd.DataFrame
+) -> pd.DataFrame:
+    """Composes the model's aggregation (raw categories to the model's ones) with a clustering of the model's categories
+
+    Args:
+        base_matrix (pd.DataFrame): model's aggregation matrix, as returned by load_aggregation_matrices
+        cluster_matrix (pd.DataFrame): aggregation matrix from the model's categories to the clusters
+
+    Returns:
+        pd.DataFrame: aggregation matrix from the raw categories to the clusters
+    """
+    return base_matrix[cluster_matrix.index].dot(cluster_matrix).astype(int)
+
+
+def write_aggregation(
+    agg_matrix: Dict[str, pd.DataFrame], name: str, overwrite: bool = False
+) -> pathlib.PosixPath:
+    """Writes aggregation matrices in data/aggregation, readable by load_aggregation_matrices
+
+    Args:
+        agg_matrix (Dict[str, pd.DataFrame]): aggregation matrices with keys 'sectors' and 'regions'
+        name (str): name of the aggregation
+        overwrite (bool, optional): True to replace an existing aggregation. Defaults to False.
+
+    Returns:
+        pathlib.PosixPath: path of the written file
+    """
+    path = create_dir(AGGREGATION_DIR) / f"{name}.xlsx"
+    if os.path.isfile(path) and not overwrite:
+        raise FileExistsError(
+            f"{path} already exists, set overwrite=True to replace it"
+        )
+    with pd.ExcelWriter(path) as writer:
+        for axis in ["sectors", "regions"]:
+            agg_matrix[axis].reset_index().to_excel(
+                writer, sheet_name=axis, index=False
+            )
+    return path
+
+
+def build_clustered_aggregation(
+    model,
+    name: str,
+    n_regions: int = None,
+    n_sectors: int = None,
+    cluster_regions: bool = True,
+    cluster_sectors: bool = False,
+    method: str = "ward",
+    region: str = "FR",
+    seed: int = 0,
+    max_workers: int = None,
+    overwrite: bool = False,
+    verbose: bool = True,
+) -> Dict[str, pd.DataFrame]:
+    """Clusters the model's regions and/or sectors and writes the resulting aggregation in data/aggregation/<name>.xlsx
+
+    Args:
+        model (Model): object Model defined in model.py
+        name (str): name of the new aggregation
+        n_regions (int, optional): number of regions' clusters, region excluded, chosen by silhouette score if None. Defaults to None.
+        n_sectors (int, optional): number of sectors' clusters, chosen by silhouette score if None. Defaults to None.
+        cluster_regions (bool, optional): True to cluster the regions, otherwise the model's regions are kept. Defaults to True.
+        cluster_sectors (bool, optional): True to cluster the sectors, otherwise the model's sectors are kept. Defaults to False.
+        method (str, optional): 'ward' or 'kmeans'. Defaults to "ward".
+        region (str, optional): importing region, kept as its own cluster. Defaults to "FR".
+        seed (int, optional): random state of KMeans. Defaults to 0.
+        max_workers (int, optional): number of processes for KMeans. Defaults to None.
+        overwrite (bool, optional): True to replace an existing aggregation. Defaults to False.
+        verbose (bool, optional): True to print infos. Defaults to True.
+
+    Returns:
+        Dict[str, pd.DataFrame]: aggregation matrices with keys 'sectors' and 'regions', and the k-sweep scores with keys 'sweep_sectors' and 'sweep_regions'
+    """
+    base_matrix = load_aggregation_matrices(aggregation_name=model.aggregation_name)
+    result = {}
+    for axis, cluster, n_clusters in [
+        ("regions", cluster_regions, n_regions),
+        ("sectors", cluster_sectors, n_sectors),
+    ]:
+        if not cluster:
+            result[axis] = base_matrix[axis]
+            continue
+        cluster_matrix, sweep = cluster_axis(
+            model=model,
+            axis=axis,
+            n_clusters=n_clusters,
+            method=method,
+            region=region,
+            seed=seed,
+            max_workers=max_workers,
+        )
+        result[axis] = compose_aggregation(
+            base_matrix=base_matrix[axis], cluster_matrix=cluster_matrix
+        )
+        result[f"sweep_{axis}"] = sweep
+        if verbose:
+            print(
+                f"{len(cluster_matrix.columns)} {axis}: {list(cluster_matrix.columns)}"
+            )
+
+    path = write_aggregation(agg_matrix=result, name=name, overwrite=overwrite)
+    if verbose:
+        print(f"Aggregation written in {path}")
+    return result
+
+
+def main(argv: List[str] = None) -> None:
+    from src.model import Model
+
+    parser = argparse.ArgumentParser(
+        description="Generates an aggregation matrix by clustering a calibrated model"
+    )
+    parser.add_argument("name", help="name of the new aggregation")
+    parser.add_argument("--base-year", type=int, default=2015)
+    parser.add_argument("--system", default="pxp")
+    parser.add_argument(
+        "--aggregation",
+        default="maxi",
+        help="aggregation of the model the features are computed from",
+    )
+    parser.add_argument("--calib", action="store_true")
+    parser.add_argument("--n-regions", type=int, default=None)
+    parser.add_argument("--n-sectors", type=int, default=None)
+    parser.add_argument("--no-regions", action="store_true")
+    parser.add_argument("--sectors", action="store_true")
+    parser.add_argument("--method", default="ward", choices=CLUSTERING_METHODS)
+    parser.add_argument("--region", default="FR")
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args(argv)
+
+    model = Model(
+        base_year=args.base_year,
+        system=args.system,
+        aggregation_name=args.aggregation,
+        calib=args.calib,
+    )
+    build_clustered_aggregation(
+        model=model,
+        name=args.name,
+        n_regions=args.n_regions,
+        n_sectors=args.n_sectors,
+        cluster_regions=not args.no_regions,
+        cluster_sectors=args.sectors,
+        method=args.method,
+        region=args.region,
+        max_workers=args.max_workers,
+        overwrite=args.overwrite,
+    )
+
+
+if __name__ == "__main__":
+    main()
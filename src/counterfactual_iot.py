@@ -0,0 +1,208 @@
+"""Copy-on-write pymrio objects for the counterfactuals
+
+A counterfactual only changes some columns of Z and Y, and recomputes x, L and the account matrices D_cba, D_pba, D_imp and D_exp.
+CounterfactualIOSystem stores these changed columns and recomputed matrices, and reads every other attribute from the reference's pymrio object, which must be left unchanged.
+The full Z, Y and A are materialized on first access and kept until release() is called, they are never pickled.
+"""
+
+import copy
+import numpy as np
+import pandas as pd
+import pymrio
+from typing import Dict
+
+ACCOUNTS = ["D_cba", "D_pba", "D_imp", "D_exp"]
+
+
+def changed_columns(reference: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Keeps the columns of new which differ from the reference
+
+    Args:
+        reference (pd.DataFrame): reference matrix
+        new (pd.DataFrame): new matrix, with the same index and columns
+
+    Returns:
+        pd.DataFrame: changed columns of new
+    """
+    if not (
+        new.index.equals(reference.index) and new.columns.equals(reference.columns)
+    ):
+        raise ValueError(
+            "The new matrix must have the same index and columns as the reference"
+        )
+    changed = (new.values != reference.values).any(axis=0)
+    return new.loc[:, changed]
+
+
+def apply_columns(reference: pd.DataFrame, columns: pd.DataFrame) -> pd.DataFrame:
+    """Rebuilds a full matrix from the reference and its changed columns
+
+    Args:
+        reference (pd.DataFrame): reference matrix
+        columns (pd.DataFrame): changed columns, see changed_columns
+
+    Returns:
+        pd.DataFrame: new matrix
+    """
+    values = reference.values.astype(columns.values.dtype, copy=True)
+    values[:, reference.columns.get_indexer(columns.columns)] = columns.values
+    return pd.DataFrame(values, index=reference.index, columns=reference.columns)
+
+
+class CounterfactualExtension:
+    def __init__(self, parent: pymrio.Extension, accounts: Dict[str, pd.DataFrame]):
+        """Inits CounterfactualExtension class
+
+        Args:
+            parent (pymrio.Extension): stressor extension of the reference
+            accounts (Dict[str, pd.DataFrame]): recomputed account matrices D_cba, D_pba, D_imp and D_exp
+        """
+        self._parent = parent
+        for name in ACCOUNTS:
+            setattr(self, name, accounts[name])
+
+    def __getattr__(self, name: str):
+        parent = self.__dict__.get("_parent")
+        if parent is None or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(parent, name)
+
+    def __getstate__(self) -> Dict:
+        return {
+            name: value for name, value in self.__dict__.items() if name != "_parent"
+        }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._parent = None
+
+    def attach(self, parent: pymrio.Extension) -> None:
+        """Links the extension to the reference's one, after unpickling
+
+        Args:
+            parent (pymrio.Extension): stressor extension of the reference
+        """
+        self._parent = parent
+
+    def materialize(self) -> pymrio.Extension:
+        """Builds a full pymrio extension, independent from the reference
+
+        Returns:
+            pymrio.Extension: copy of the reference's extension with the counterfactual's accounts
+        """
+        extension = self._parent.copy()
+        for name in ACCOUNTS:
+            setattr(extension, name, getattr(self, name).copy())
+        return extension
+
+
+class CounterfactualIOSystem:
+    def __init__(
+        self,
+        parent: pymrio.IOSystem,
+        Z: pd.DataFrame,
+        Y: pd.DataFrame,
+        x: pd.DataFrame,
+        L: pd.DataFrame,
+    ):
+        """Inits CounterfactualIOSystem class
+
+        Args:
+            parent (pymrio.IOSystem): pymrio object of the reference
+            Z (pd.DataFrame): new intermediate consumption matrix, only its changed columns are kept
+            Y (pd.DataFrame): new final demand matrix, only its changed columns are kept
+            x (pd.DataFrame): recomputed production
+            L (pd.DataFrame): recomputed Leontief inverse, None if the model's solver is matrix-free
+        """
+        self._parent = parent
+        self._materialized = {}
+        self.Z_columns = changed_columns(reference=parent.Z, new=Z)
+        self.Y_columns = changed_columns(reference=parent.Y, new=Y)
+        self.x = x
+        self.L = L
+        self.stressor_extension = None
+
+    def __getattr__(self, name: str):
+        parent = self.__dict__.get("_parent")
+        if parent is None or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(parent, name)
+
+    def __getstate__(self) -> Dict:
+        return {
+            name: value
+            for name, value in self.__dict__.items()
+            if name not in ["_parent", "_materialized"]
+        }
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._parent = None
+        self._materialized = {}
+
+    def attach(self, parent: pymrio.IOSystem) -> None:
+        """Links the counterfactual to the reference's pymrio object, after unpickling
+
+        Args:
+            parent (pymrio.IOSystem): pymrio object of the reference
+        """
+        self._parent = parent
+        self.stressor_extension.attach(parent=parent.stressor_extension)
+
+    ## lazily materialized matrices
+
+    @property
+    def Z(self) -> pd.DataFrame:
+        if "Z" not in self._materialized:
+            self._materialized["Z"] = apply_columns(
+                reference=self._parent.Z, columns=self.Z_columns
+            )
+        return self._materialized["Z"]
+
+    @property
+    def Y(self) -> pd.DataFrame:
+        if "Y" not in self._materialized:
+            self._materialized["Y"] = apply_columns(
+                reference=self._parent.Y, columns=self.Y_columns
+            )
+        return self._materialized["Y"]
+
+    @property
+    def A(self) -> pd.DataFrame:
+        if "A" not in self._materialized:
+            x = self.x["indout"].values
+            recix = np.zeros_like(x)
+            np.divide(1, x, out=recix, where=x != 0)
+            self._materialized["A"] = self.Z * recix
+        return self._materialized["A"]
+
+    def release(self) -> None:
+        """Forgets the materialized Z, Y and A"""
+        self._materialized = {}
+
+    def materialize(self) -> pymrio.IOSystem:
+        """Builds a full pymrio object, independent from the reference
+
+        Returns:
+            pymrio.IOSystem: pymrio object of the counterfactual
+        """
+        iot = pymrio.IOSystem(
+            Z=self.Z.copy(),
+            Y=self.Y.copy(),
+            x=self.x.copy(),
+            A=self.A.copy(),
+            L=None if self.L is None else self.L.copy(),
+            unit=self._parent.unit,
+            population=self._parent.population,
+            meta=copy.deepcopy(self._parent.meta),
+        )
+        iot.stressor_extension = self.stressor_extension.materialize()
+        return iot
+
+    def copy(self) -> pymrio.IOSystem:
+        """Same as materialize, for code written for pymrio objects
+
+        Returns:
+            pymrio.IOSystem: pymrio object of the counterfactual
+        """
+        return self.materialize()
@@ -0,0 +1,171 @@
+"""Structural decomposition analysis (SDA) of a region's footprint between years
+
+The footprint of region's final demand is s L y + F_Y, with s the stressor intensities (summed over the stressors), L the Leontief inverse and y = level * mix the final demand of the region.
+The change of s L (mix * level) between two years is split between the four factors with the Shapley weights (average over the 24 orders of substitution), so that the components add up exactly to the change; the change of F_Y is reported apart.
+All the products s_a L_b needed by a set of year pairs are computed in one matrix product per year b and cached, the other terms are vector operations.
+"""
+
+import itertools
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+from src.leontief import leontief_operator
+
+SDA_FACTORS = ["intensity", "structure", "mix", "level"]
+
+
+### FACTORS ###
+
+
+def extract_factors(model, region: str = "FR") -> Dict:
+    """Extracts the factors of region's footprint from a model
+
+    Args:
+        model (Union[Model, Counterfactual]): object Model or Counterfactual defined in model.py
+        region (str, optional): region whose footprint is decomposed. Defaults to "FR".
+
+    Returns:
+        Dict: intensities s, product by the Leontief inverse (see leontief_operator), final demand mix and level, and direct emissions of the final demand
+    """
+    iot = model.iot
+    y = iot.Y[region].values.sum(axis=1).astype("float64")
+    level = y.sum()
+    return {
+        "s": iot.stressor_extension.S.values.sum(axis=0).astype("float64"),
+        # models and counterfactuals saved before the matrix-free solvers have no solver
+        "leontief": leontief_operator(
+            iot=iot, method=getattr(model, "solver", "dense")
+        ),
+        "mix": y / level,
+        "level": level,
+        "direct": iot.stressor_extension.F_Y[region].values.sum(),
+    }
+
+
+### MULTIPLIERS ###
+
+
+def compute_multipliers(
+    factors: Dict[int, Dict], pairs: List[Tuple[int, int]], cache: Dict = None
+) -> Dict[Tuple[int, int], np.ndarray]:
+    """Computes the multipliers s_a L_b that the decomposition of pairs of years needs
+
+    Args:
+        factors (Dict[int, Dict]): factors of each year, see extract_factors
+        pairs (List[Tuple[int, int]]): pairs of years (start, end) to decompose
+        cache (Dict, optional): multipliers already computed, completed in place. Defaults to None.
+
+    Returns:
+        Dict[Tuple[int, int], np.ndarray]: multipliers s_a L_b by (a, b)
+    """
+    if cache is None:
+        cache = {}
+    needed = {}  # intensities' years for each Leontief inverse's year
+    for start, end in pairs:
+        for a, b in itertools.product([start, end], repeat=2):
+            if (a, b) not in cache:
+                needed.setdefault(b, set()).add(a)
+    for b, intensities_years in needed.items():
+        intensities_years = sorted(intensities_years)
+        intensities = np.stack([factors[a]["s"] for a in intensities_years])
+        products = factors[b]["leontief"](intensities.T, transpose=True).T
+        for a, multipliers in zip(intensities_years, products):
+            cache[(a, b)] = multipliers
+    return cache
+
+
+### DECOMPOSITION ###
+
+
+def shapley_weights(n_factors: int) -> List[float]:
+    """Weights of the marginal contributions of a factor given the number of other factors already substituted
+
+    Args:
+        n_factors (int): number of factors
+
+    Returns:
+        List[float]: weight for 0, 1, ..., n_factors - 1 factors already substituted
+    """
+    return [
+        math.factorial(k)
+        * math.factorial(n_factors - 1 - k)
+        / math.factorial(n_factors)
+        for k in range(n_factors)
+    ]
+
+
+def decompose_pair(
+    factors_start: Dict, factors_end: Dict, multipliers: Dict[Tuple[int, int], float]
+) -> Dict:
+    """Splits the change of the footprint between two years into the contributions of the factors
+
+    Args:
+        factors_start (Dict): factors of the start year, see extract_factors
+        factors_end (Dict): factors of the end year, see extract_factors
+        multipliers (Dict[Tuple[int, int], float]): multipliers s_a L_b, with 0 for the start year and 1 for the end year
+
+    Returns:
+        Dict: footprints of both years and contribution of each factor, and of the direct emissions
+    """
+    factors = (factors_start, factors_end)
+    # footprint for each choice of years (intensity, structure, mix, level)
+    footprints = {
+        choice: (multipliers[choice[:2]] @ factors[choice[2]]["mix"])
+        * factors[choice[3]]["level"]
+        for choice in itertools.product([0, 1], repeat=len(SDA_FACTORS))
+    }
+
+    weights = shapley_weights(len(SDA_FACTORS))
+    components = {}
+    for k, factor in enumerate(SDA_FACTORS):
+        contribution = 0.0
+        for choice in itertools.product([0, 1], repeat=len(SDA_FACTORS) - 1):
+            before = choice[:k] + (0,) + choice[k:]
+            after = choice[:k] + (1,) + choice[k:]
+            contribution += weights[sum(choice)] * (
+                footprints[after] - footprints[before]
+            )
+        components[factor] = contribution
+    components["direct"] = factors_end["direct"] - factors_start["direct"]
+
+    return {
+        "footprint_start": footprints[(0, 0, 0, 0)] + factors_start["direct"],
+        "footprint_end": footprints[(1, 1, 1, 1)] + factors_end["direct"],
+        **components,
+    }
+
+
+def structural_decomposition(
+    factors: Dict[int, Dict],
+    pairs: List[Tuple[int, int]] = None,
+    cache: Dict = None,
+) -> pd.DataFrame:
+    """Decomposes the change of the footprint between pairs of years
+
+    Args:
+        factors (Dict[int, Dict]): factors of each year, see extract_factors
+        pairs (List[Tuple[int, int]], optional): pairs of years (start, end) to decompose, consecutive years if None. Defaults to None.
+        cache (Dict, optional): multipliers already computed, see compute_multipliers. Defaults to None.
+
+    Returns:
+        pd.DataFrame: footprints and contributions of intensity, structure, mix, level and direct emissions (columns) for each pair of years (rows)
+    """
+    if pairs is None:
+        years = sorted(factors.keys())
+        pairs = list(zip(years[:-1], years[1:]))
+    cache = compute_multipliers(factors=factors, pairs=pairs, cache=cache)
+
+    rows = {}
+    for start, end in pairs:
+        multipliers = {
+            (i, j): cache[(a, b)]
+            for (i, a), (j, b) in itertools.product(enumerate([start, end]), repeat=2)
+        }
+        rows[(start, end)] = decompose_pair(
+            factors_start=factors[start],
+            factors_end=factors[end],
+            multipliers=multipliers,
+        )
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis(["start", "end"])
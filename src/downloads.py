@@ -0,0 +1,385 @@
+"""Concurrent downloads of the EXIOBASE tables and of the capital consumption matrices
+
+The files of a planned run are listed from the Zenodo records (with their md5 checksums) and fetched by an asyncio loop running in a background thread, with a bounded number of simultaneous downloads.
+Each file is written in a .part file, resumed with an HTTP Range request after an interruption, checked against its checksum and renamed into place.
+The record API URL can point to any server answering like Zenodo, e.g. a local HTTP server for tests.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List
+
+from src.settings import CAPITAL_CONS_DIR, EXIOBASE_DIR, create_dir
+
+ZENODO_API_URL = "https://zenodo.org/api/records/"
+# EXIOBASE 3.8, the latest version documented by pymrio 0.4.5, pinned since the concept record 3583070 resolves to newer releases
+EXIOBASE_RECORD_ID = "4277368"
+EXIOBASE_DOI = "10.5281/zenodo." + EXIOBASE_RECORD_ID
+KBAR_RECORD_ID = "3874309"
+CHUNK_SIZE = 2**20
+
+
+### PLANNING ###
+
+
+def exiobase_path(year: int, system: str) -> pathlib.PosixPath:
+    """Path of a raw EXIOBASE table, as expected by Model
+
+    Args:
+        year (int): year in 4 digits
+        system (str): product ('pxp') or industry ('ixi')
+
+    Returns:
+        pathlib.PosixPath: path of the zip file
+    """
+    return EXIOBASE_DIR / f"{year}__{system}" / f"IOT_{year}_{system}.zip"
+
+
+def kbar_path(year: int, system: str) -> pathlib.PosixPath:
+    """Path of a capital consumption matrix, as expected by Model
+
+    Args:
+        year (int): year in 4 digits
+        system (str): product ('pxp') or industry ('ixi')
+
+    Returns:
+        pathlib.PosixPath: path of the .mat file
+    """
+    return CAPITAL_CONS_DIR / f"Kbar_exio_v3_6_{year}{system}.mat"
+
+
+def required_files(
+    base_year: int, system: str, capital: bool, **kwargs
+) -> List[pathlib.PosixPath]:
+    """Lists the downloaded files a model needs
+
+    Args:
+        base_year (int): year in 4 digits
+        system (str): product ('pxp') or industry ('ixi')
+        capital (bool): True to endogenize investments and capital
+        **kwargs: other settings of the model, ignored (a job of src/jobs.py can be passed as is)
+
+    Returns:
+        List[pathlib.PosixPath]: paths of the files
+    """
+    paths = [exiobase_path(year=base_year, system=system)]
+    if capital:
+        paths.append(kbar_path(year=base_year, system=system))
+    return paths
+
+
+def fetch_record_files(record_id: str, api_url: str = ZENODO_API_URL) -> Dict:
+    """Lists the files of a Zenodo record
+
+    Args:
+        record_id (str): id of the record
+        api_url (str, optional): URL of the records API. Defaults to ZENODO_API_URL.
+
+    Returns:
+        Dict: URL, checksum ('md5:...') and size of each file, by file name
+    """
+    with urllib.request.urlopen(api_url + record_id) as response:
+        record = json.load(response)
+    return {
+        file["key"]: {
+            "url": file["links"]["self"],
+            "checksum": file.get("checksum"),
+            "size": file.get("size"),
+        }
+        for file in record["files"]
+    }
+
+
+def plan_downloads(
+    years: List[int],
+    systems: List[str],
+    capital: bool = False,
+    api_url: str = ZENODO_API_URL,
+) -> List[Dict]:
+    """Lists the files missing on disk for a run
+
+    Args:
+        years (List[int]): years in 4 digits
+        systems (List[str]): product ('pxp') and/or industry ('ixi')
+        capital (bool, optional): True to fetch the capital consumption matrices too. Defaults to False.
+        api_url (str, optional): URL of the records API. Defaults to ZENODO_API_URL.
+
+    Returns:
+        List[Dict]: download tasks with the URL, destination path, checksum and size of each missing file
+    """
+    missing = {
+        path: (year, system, path.name)
+        for year in years
+        for system in systems
+        for path in required_files(base_year=year, system=system, capital=capital)
+        if not os.path.isfile(path)
+    }
+    if not missing:
+        return []
+
+    records = {}
+    tasks = []
+    for path, (year, system, name) in missing.items():
+        record_id = KBAR_RECORD_ID if name.startswith("Kbar") else EXIOBASE_RECORD_ID
+        if record_id not in records:
+            records[record_id] = fetch_record_files(
+                record_id=record_id, api_url=api_url
+            )
+        if name not in records[record_id]:
+            raise ValueError(f"{name} isn't available in the record {record_id}")
+        tasks.append({"path": path, **records[record_id][name]})
+    return tasks
+
+
+### DOWNLOAD ###
+
+
+def file_checksum(path: pathlib.PosixPath, algorithm: str = "md5") -> str:
+    """Hashes a file
+
+    Args:
+        path (pathlib.PosixPath): file to hash
+        algorithm (str, optional): hashlib algorithm. Defaults to "md5".
+
+    Returns:
+        str: checksum formatted as '<algorithm>:<hex digest>'
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f"{algorithm}:{digest.hexdigest()}"
+
+
+def download_file(task: Dict, timeout: float = 60) -> pathlib.PosixPath:
+    """Downloads one file, resuming its .part file if any, and checks it
+
+    Args:
+        task (Dict): download task, see plan_downloads
+        timeout (float, optional): timeout of the connection in seconds. Defaults to 60.
+
+    Returns:
+        pathlib.PosixPath: path of the downloaded file
+    """
+    path = pathlib.Path(task["path"])
+    part_path = path.with_name(path.name + ".part")
+    create_dir(path.parent)
+
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if task.get("size") is None or offset < task["size"]:
+        request = urllib.request.Request(task["url"])
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as error:
+            if error.code != 416:  # 416: the .part file is already complete
+                raise
+        else:
+            with response:
+                # the server may ignore Range and send the whole file
+                mode = "ab" if response.status == 206 else "wb"
+                with open(part_path, mode) as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        f.write(chunk)
+
+    if task.get("size") is not None and os.path.getsize(part_path) < task["size"]:
+        raise IOError(f"Incomplete download of {path.name}, it will be resumed")
+    if task.get("checksum") is not None:
+        algorithm = task["checksum"].split(":")[0]
+        checksum = file_checksum(path=part_path, algorithm=algorithm)
+        if checksum != task["checksum"]:
+            os.remove(part_path)
+            raise ValueError(
+                f"Checksum mismatch for {path.name}: expected {task['checksum']}, got {checksum}"
+            )
+    os.replace(part_path, path)
+    return path
+
+
+async def download_all(
+    tasks: List[Dict],
+    max_concurrency: int = 4,
+    retries: int = 3,
+    futures: Dict[pathlib.PosixPath, concurrent.futures.Future] = None,
+    verbose: bool = True,
+) -> Dict[pathlib.PosixPath, Exception]:
+    """Downloads files concurrently, retrying (and resuming) the failed ones
+
+    Args:
+        tasks (List[Dict]): download tasks, see plan_downloads
+        max_concurrency (int, optional): maximal number of simultaneous downloads. Defaults to 4.
+        retries (int, optional): number of retries of a failed download. Defaults to 3.
+        futures (Dict[pathlib.PosixPath, concurrent.futures.Future], optional): futures completed when each file is downloaded, by path. Defaults to None.
+        verbose (bool, optional): True to print infos. Defaults to True.
+
+    Returns:
+        Dict[pathlib.PosixPath, Exception]: errors of the files which couldn't be downloaded
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+    errors = {}
+
+    async def fetch(task: Dict) -> None:
+        path = pathlib.Path(task["path"])
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    await loop.run_in_executor(None, download_file, task)
+                    break
+                except Exception as error:
+                    if attempt == retries:
+                        errors[path] = error
+                    else:
+                        await asyncio.sleep(2**attempt)
+        if verbose:
+            print(f"{path.name}: " + ("failed" if path in errors else "downloaded"))
+        if futures is not None and path in futures:
+            if path in errors:
+                futures[path].set_exception(errors[path])
+            else:
+                futures[path].set_result(path)
+
+    await asyncio.gather(*[fetch(task) for task in tasks])
+    return errors
+
+
+### PREFETCHER ###
+
+
+class Prefetcher:
+    def __init__(
+        self, tasks: List[Dict], max_concurrency: int = 4, verbose: bool = True
+    ):
+        """Inits Prefetcher class, which downloads files in a background thread while the caller goes on
+
+        Args:
+            tasks (List[Dict]): download tasks, see plan_downloads
+            max_concurrency (int, optional): maximal number of simultaneous downloads. Defaults to 4.
+            verbose (bool, optional): True to print infos. Defaults to True.
+        """
+        self.tasks = tasks
+        self.max_concurrency = max_concurrency
+        self.verbose = verbose
+        self.futures = {
+            pathlib.Path(task["path"]): concurrent.futures.Future() for task in tasks
+        }
+        self.errors = {}
+        self._thread = None
+
+    def start(self) -> "Prefetcher":
+        """Starts the downloads
+
+        Returns:
+            Prefetcher: self
+        """
+        self._thread = threading.Thread(
+            target=lambda: self.errors.update(
+                asyncio.run(
+                    download_all(
+                        tasks=self.tasks,
+                        max_concurrency=self.max_concurrency,
+                        futures=self.futures,
+                        verbose=self.verbose,
+                    )
+                )
+            ),
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def is_ready(self, paths: List[pathlib.PosixPath]) -> bool:
+        """Checks whether some files don't need to be waited for anymore
+
+        Args:
+            paths (List[pathlib.PosixPath]): paths of the files
+
+        Returns:
+            bool: True if none of them is still being downloaded
+        """
+        return all(
+            self.futures[pathlib.Path(path)].done()
+            for path in paths
+            if pathlib.Path(path) in self.futures
+        )
+
+    def wait(self, paths: List[pathlib.PosixPath]) -> bool:
+        """Waits for the download of some files, if they are being downloaded
+
+        Args:
+            paths (List[pathlib.PosixPath]): paths of the files
+
+        Returns:
+            bool: True if all of them were downloaded successfully or were already on disk
+        """
+        return not self.failures(paths=paths)
+
+    def failures(
+        self, paths: List[pathlib.PosixPath]
+    ) -> Dict[pathlib.PosixPath, Exception]:
+        """Waits for the download of some files, if they are being downloaded, and returns the errors of the failed ones
+
+        Args:
+            paths (List[pathlib.PosixPath]): paths of the files
+
+        Returns:
+            Dict[pathlib.PosixPath, Exception]: errors of the files which couldn't be downloaded
+        """
+        errors = {}
+        for path in paths:
+            future = self.futures.get(pathlib.Path(path))
+            if future is not None and future.exception() is not None:
+                errors[pathlib.Path(path)] = future.exception()
+        return errors
+
+    def join(self) -> Dict[pathlib.PosixPath, Exception]:
+        """Waits for all the downloads
+
+        Returns:
+            Dict[pathlib.PosixPath, Exception]: errors of the files which couldn't be downloaded
+        """
+        if self._thread is not None:
+            self._thread.join()
+        return self.errors
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Downloads the missing EXIOBASE tables (and capital consumption matrices) of a range of years"
+    )
+    parser.add_argument("start_year", type=int)
+    parser.add_argument("end_year", type=int)
+    parser.add_argument("--systems", nargs="+", default=["pxp"])
+    parser.add_argument("--capital", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--api-url", default=ZENODO_API_URL)
+    args = parser.parse_args(argv)
+
+    tasks = plan_downloads(
+        years=list(range(args.start_year, args.end_year + 1)),
+        systems=args.systems,
+        capital=args.capital,
+        api_url=args.api_url,
+    )
+    print(f"{len(tasks)} file(s) to download")
+    start = time.perf_counter()
+    errors = (
+        Prefetcher(tasks=tasks, max_concurrency=args.max_concurrency).start().join()
+    )
+    print(f"Done in {time.perf_counter() - start:.1f} s, {len(errors)} failure(s)")
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
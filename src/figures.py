@@ -247,8 +247,7 @@ def compare_scenarios(
 
     regions = model.agg_regions
 
-    situations = model.counterfactuals
-    situations["reference"] = model
+    situations = {**model.counterfactuals, "reference": model}
     situations_names = list(situations.keys())
 
     stressor_all_scen = pd.DataFrame(
@@ -0,0 +1,395 @@
+"""Batches of models and counterfactuals described by a job manifest, run by a pool of worker processes
+
+A manifest is a JSON file such as:
+    {
+        "name": "sweep_2000_2020",
+        "years": {"start": 2000, "end": 2020},
+        "systems": ["pxp"],
+        "aggregations": ["opti_S"],
+        "capital": [false, true],
+        "stressors": ["ghg"],
+        "scenarios": ["best", "worst"],
+        "reloc": [false],
+        "scenario_specs": "scenarios.yaml"
+    }
+Each combination of year, system, aggregation, capital and stressor is one job, which builds the model and its counterfactuals (scenarios x reloc).
+The scenarios are those of DICT_SCENARIOS and the declarative ones of scenario_specs (a YAML or JSON file, relative to the manifest, or a dictionnary, see src/scenario_specs.py).
+The completion of each job is recorded in data/jobs/<name>, so that a manifest run again skips the jobs already done.
+"""
+
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import pathlib
+import time
+import traceback
+import warnings
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List
+
+from src.downloads import Prefetcher, required_files
+from src.persistence import atomic_write
+from src.profiling import export_recorded
+from src.settings import DATA_DIR, create_dir
+from src.stressors import (
+    COPPER_PARAMS,
+    GHG_PARAMS,
+    LANDUSE_PARAMS,
+    MATERIAL_PARAMS,
+    stressor_shortname,
+)
+from src.threads import set_thread_budget, split_cores, thread_budget
+
+JOBS_DIR = DATA_DIR / "jobs"
+
+STRESSORS_PARAMS = {
+    stressor_shortname(params): params
+    for params in [GHG_PARAMS, MATERIAL_PARAMS, COPPER_PARAMS, LANDUSE_PARAMS]
+}
+
+MANIFEST_DEFAULTS = {
+    "systems": ["pxp"],
+    "aggregations": ["opti_S"],
+    "capital": [False],
+    "stressors": ["ghg"],
+    "scenarios": [],
+    "reloc": [False],
+    "precision": "float64",
+    "solver": "dense",
+    "scenario_specs": {},
+}
+
+
+### MANIFESTS ###
+
+
+def load_manifest(path: pathlib.PosixPath) -> Dict:
+    """Reads a job manifest and completes it with the default values
+
+    Args:
+        path (pathlib.PosixPath): JSON file of the manifest
+
+    Returns:
+        Dict: manifest, with the years as a list
+    """
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if "years" not in manifest:
+        raise ValueError(f"The manifest {path} doesn't give any year")
+    manifest = {**MANIFEST_DEFAULTS, **manifest}
+    manifest.setdefault("name", pathlib.Path(path).stem)
+    if isinstance(manifest["years"], dict):
+        manifest["years"] = list(
+            range(manifest["years"]["start"], manifest["years"]["end"] + 1)
+        )
+    if not isinstance(manifest["scenario_specs"], dict):
+        from src.scenario_specs import load_scenario_specs
+
+        manifest["scenario_specs"] = load_scenario_specs(
+            path=pathlib.Path(path).parent / manifest["scenario_specs"]
+        )
+    unknown = set(manifest["stressors"]) - set(STRESSORS_PARAMS.keys())
+    if unknown:
+        raise ValueError(
+            f"Unknown stressors {sorted(unknown)}, they must be among {list(STRESSORS_PARAMS.keys())}"
+        )
+    return manifest
+
+
+def counterfactual_name(scenario: str, reloc: bool) -> str:
+    """Formats the name of the counterfactual of a scenario
+
+    Args:
+        scenario (str): name of the scenario
+        reloc (bool): True if relocation is allowed
+
+    Returns:
+        str: name of the counterfactual
+    """
+    return scenario + reloc * "__with_reloc"
+
+
+def expand_manifest(manifest: Dict) -> List[Dict]:
+    """Lists the jobs of a manifest, one per model
+
+    Args:
+        manifest (Dict): manifest, see load_manifest
+
+    Returns:
+        List[Dict]: jobs with their id, the model settings, the counterfactuals to build and the specifications of their declarative scenarios
+    """
+    counterfactuals = [
+        {"scenario": scenario, "reloc": reloc}
+        for scenario, reloc in itertools.product(
+            manifest["scenarios"], manifest["reloc"]
+        )
+    ]
+    # declarative scenarios travel with the jobs, so that worker processes can compile them
+    scenario_specs = {
+        name: spec
+        for name, spec in manifest.get("scenario_specs", {}).items()
+        if name in manifest["scenarios"]
+    }
+    jobs = []
+    for year, system, aggregation_name, capital, stressor in itertools.product(
+        manifest["years"],
+        manifest["systems"],
+        manifest["aggregations"],
+        manifest["capital"],
+        manifest["stressors"],
+    ):
+        jobs.append(
+            {
+                "id": f"{year}__{system}__{aggregation_name}__{stressor}"
+                + capital * "__with_capital",
+                "base_year": year,
+                "system": system,
+                "aggregation_name": aggregation_name,
+                "capital": capital,
+                "stressor": stressor,
+                "precision": manifest["precision"],
+                "counterfactuals": counterfactuals,
+            }
+        )
+        # the jobs recorded before the matrix-free solvers stay done
+        if manifest["solver"] != "dense":
+            jobs[-1]["solver"] = manifest["solver"]
+        if scenario_specs:
+            jobs[-1]["scenario_specs"] = scenario_specs
+    return jobs
+
+
+### STATE ###
+
+
+def state_dir(manifest: Dict) -> pathlib.PosixPath:
+    """Directory where the completion of the manifest's jobs is recorded
+
+    Args:
+        manifest (Dict): manifest, see load_manifest
+
+    Returns:
+        pathlib.PosixPath: data/jobs/<manifest name>
+    """
+    return JOBS_DIR / manifest["name"]
+
+
+def read_job_state(directory: pathlib.PosixPath, job: Dict) -> Dict:
+    """Reads the record of a job
+
+    Args:
+        directory (pathlib.PosixPath): state directory of the manifest
+        job (Dict): job, see expand_manifest
+
+    Returns:
+        Dict: record of the job, None if it has never run
+    """
+    path = pathlib.Path(directory) / f"{job['id']}.json"
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def is_done(directory: pathlib.PosixPath, job: Dict) -> bool:
+    """Checks whether a job has already been completed with the same settings
+
+    Args:
+        directory (pathlib.PosixPath): state directory of the manifest
+        job (Dict): job, see expand_manifest
+
+    Returns:
+        bool: True if the job can be skipped
+    """
+    record = read_job_state(directory=directory, job=job)
+    return record is not None and record["status"] == "done" and record["job"] == job
+
+
+def execute_job(
+    job: Dict, run_job: Callable[[Dict], None], directory: pathlib.PosixPath
+) -> Dict:
+    """Runs one job and records its completion or its failure, with the runtime warnings it issued (e.g. an unconverged scenario)
+       If profiling is enabled, the job's spans are written at its end, see profiling.export_recorded
+
+    Args:
+        job (Dict): job, see expand_manifest
+        run_job (Callable[[Dict], None]): builds what the job describes
+        directory (pathlib.PosixPath): state directory of the manifest
+
+    Returns:
+        Dict: record of the job
+    """
+    start = time.perf_counter()
+    record = {"job": job, "pid": os.getpid()}
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", category=RuntimeWarning)
+        try:
+            run_job(job)
+            record["status"] = "done"
+        except Exception:
+            record["status"] = "failed"
+            record["error"] = traceback.format_exc()
+    for warning in caught:
+        warnings.showwarning(
+            warning.message, warning.category, warning.filename, warning.lineno
+        )
+    runtime_warnings = [
+        str(warning.message)
+        for warning in caught
+        if issubclass(warning.category, RuntimeWarning)
+    ]
+    if runtime_warnings:
+        record["warnings"] = runtime_warnings
+    record["wall_time_s"] = time.perf_counter() - start
+    # worker processes don't run the atexit hooks, where the spans are written otherwise
+    export_recorded(suffix=job["id"])
+    return write_job_state(directory=directory, record=record)
+
+
+def write_job_state(directory: pathlib.PosixPath, record: Dict) -> Dict:
+    """Dates and writes the record of a job
+
+    Args:
+        directory (pathlib.PosixPath): state directory of the manifest
+        record (Dict): record of the job, with the job, its status and its wall time
+
+    Returns:
+        Dict: the same record
+    """
+    record["finished"] = datetime.datetime.now().isoformat()
+    atomic_write(
+        path=pathlib.Path(directory) / f"{record['job']['id']}.json",
+        write=lambda f: json.dump(record, f, indent=2),
+        mode="w",
+    )
+    return record
+
+
+### RUNNER ###
+
+
+def run_manifest(
+    manifest: Dict,
+    run_job: Callable[[Dict], None],
+    workers: int = 1,
+    prefetcher: Prefetcher = None,
+    threads: int = None,
+    verbose: bool = True,
+) -> Dict[str, List[str]]:
+    """Runs the jobs of a manifest which aren't done yet
+
+    Args:
+        manifest (Dict): manifest, see load_manifest
+        run_job (Callable[[Dict], None]): builds what a job describes, must be picklable (defined at the top level of a module) if workers > 1
+        workers (int, optional): number of worker processes, the jobs run in the current process if 1. Defaults to 1.
+        prefetcher (Prefetcher, optional): started downloads of the missing files (see downloads.py), the jobs whose files are on disk run first and the other ones wait for their files. Defaults to None.
+        threads (int, optional): number of BLAS threads of each worker (see threads.py), the available cores split between the workers if None. Defaults to None.
+        verbose (bool, optional): True to print infos. Defaults to True.
+
+    Returns:
+        Dict[str, List[str]]: ids of the jobs 'skipped', 'done', 'failed' and 'not_run', the latter left over when a worker process died (e.g. killed for lack of memory) and broke the pool
+    """
+    directory = create_dir(state_dir(manifest=manifest))
+    jobs = expand_manifest(manifest=manifest)
+    summary = {"skipped": [], "done": [], "failed": [], "not_run": []}
+    pending = []
+    for job in jobs:
+        if is_done(directory=directory, job=job):
+            summary["skipped"].append(job["id"])
+        else:
+            pending.append(job)
+    if verbose:
+        print(f"{len(pending)} job(s) to run, {len(summary['skipped'])} already done")
+
+    def report(record: Dict) -> None:
+        summary[record["status"]].append(record["job"]["id"])
+        if verbose:
+            print(
+                f"[{sum(len(ids) for ids in summary.values())}/{len(jobs)}] {record['job']['id']}: {record['status']} ({record['wall_time_s']:.1f} s)"
+            )
+
+    def wait_for_files(job: Dict) -> bool:
+        # a job whose files couldn't be downloaded fails without running
+        if prefetcher is None:
+            return True
+        errors = prefetcher.failures(paths=required_files(**job))
+        if errors:
+            report(
+                write_job_state(
+                    directory=directory,
+                    record={
+                        "job": job,
+                        "status": "failed",
+                        "error": "\n".join(
+                            f"Download of {path} failed: {error!r}"
+                            for path, error in errors.items()
+                        ),
+                        "wall_time_s": 0.0,
+                    },
+                )
+            )
+        return not errors
+
+    if prefetcher is not None:
+        pending.sort(key=lambda job: not prefetcher.is_ready(required_files(**job)))
+
+    if threads is None:
+        threads = split_cores(workers=workers)
+    if verbose:
+        print(f"{workers} worker(s) with {threads} BLAS thread(s) each")
+
+    if workers == 1:
+        with thread_budget(threads=threads):
+            for job in pending:
+                if wait_for_files(job=job):
+                    report(execute_job(job=job, run_job=run_job, directory=directory))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=set_thread_budget, initargs=(threads,)
+        ) as executor:
+            # as many jobs as workers are submitted, so that if a worker dies (e.g. killed for lack of memory) and breaks the pool, the jobs it held are failed and the other ones not run
+            queue = list(pending)
+            running = {}
+            broken = False
+            while queue or running:
+                while queue and len(running) < workers and not broken:
+                    if not wait_for_files(job=queue[0]):
+                        queue.pop(0)
+                        continue
+                    try:
+                        future = executor.submit(
+                            execute_job, queue[0], run_job, directory
+                        )
+                    except BrokenProcessPool:
+                        broken = True
+                        break
+                    running[future] = (queue.pop(0), time.perf_counter())
+                if not running:
+                    break
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    job, start = running.pop(future)
+                    # the job's own failures are recorded by execute_job, not those of its worker
+                    try:
+                        record = future.result()
+                    except Exception as error:
+                        broken = broken or isinstance(error, BrokenProcessPool)
+                        record = write_job_state(
+                            directory=directory,
+                            record={
+                                "job": job,
+                                "status": "failed",
+                                "error": traceback.format_exc(),
+                                "wall_time_s": time.perf_counter() - start,
+                            },
+                        )
+                    report(record)
+            summary["not_run"] = [job["id"] for job in queue]
+            if verbose and queue:
+                print(f"A worker process died, {len(queue)} job(s) not run")
+
+    return summary
@@ -0,0 +1,268 @@
+"""Matrix-free Leontief solves, for the models too large for a dense Leontief inverse
+
+Without aggregation (49 regions x 200 products), L is a dense 9800 x 9800 matrix, and the accounts are computed from the dense product of L with the block-diagonalized final demand.
+The iterative solvers never form L: the productions x = L.y solve (I - A).x = y and the multipliers m = s.L solve (I - A)'.m' = s', with A stored as a sparse matrix.
+    - neumann: partial sums of the series L = I + A + A^2 + ..., for all the right-hand sides at once, stopped once the error bound is below the tolerance
+    - gmres, bicgstab: Krylov solvers of scipy, one right-hand side at a time, preconditioned with an incomplete LU factorization of I - A
+The accounts D_cba and D_imp only need the multipliers of each stressor and region of origin, and D_pba and D_exp the productions induced by each region's final demand (see calc_accounts).
+"""
+
+import inspect
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, bicgstab, gmres, spilu
+from typing import Callable, Dict
+
+# 'dense' inverts I - A, the other solvers are matrix-free
+LEONTIEF_SOLVERS = ["dense", "neumann", "gmres", "bicgstab"]
+KRYLOV_SOLVERS = {"gmres": gmres, "bicgstab": bicgstab}
+
+
+def check_solver(solver: str) -> str:
+    """Checks that a Leontief solver is available for the models
+
+    Args:
+        solver (str): name of the solver, see LEONTIEF_SOLVERS
+
+    Returns:
+        str: the same name
+    """
+    if solver not in LEONTIEF_SOLVERS:
+        raise ValueError(
+            f"the Leontief solver {solver} is unknown, it must be one of {LEONTIEF_SOLVERS}."
+        )
+    return solver
+
+
+### SOLVER ###
+
+
+class LeontiefSolver:
+    def __init__(
+        self,
+        A: pd.DataFrame,
+        method: str = "neumann",
+        tol: float = 1e-10,
+        max_iter: int = 1000,
+    ):
+        """Inits LeontiefSolver class, which solves systems with I - A without forming L
+
+        Args:
+            A (pd.DataFrame): technical coefficients matrix
+            method (str, optional): matrix-free solver, see LEONTIEF_SOLVERS. Defaults to 'neumann'.
+            tol (float, optional): relative accuracy of the solutions, bound of the error for 'neumann' and of the residual for the Krylov solvers. Defaults to 1e-10.
+            max_iter (int, optional): maximal number of iterations for each solve. Defaults to 1000.
+        """
+        if check_solver(method) == "dense":
+            raise ValueError("the dense solver inverts I - A, see utils.calc_leontief")
+        self.method = method
+        self.tol = tol
+        self.max_iter = max_iter
+        # the solves work in float64 whatever the precision of the model
+        self.A = sparse.csr_matrix(A.values, dtype="float64")
+        self.AT = self.A.T.tocsr()
+        # largest column sum, L's column sums are below 1 / (1 - norm) if it is below 1
+        self.norm = float(abs(self.A).sum(axis=0).max()) if self.A.nnz else 0.0
+        self._ilu = None
+
+    @property
+    def ilu(self):
+        """Incomplete LU factorization of I - A, preconditioner of the Krylov solvers"""
+        if self._ilu is None:
+            I_A = sparse.identity(self.A.shape[0], format="csc") - self.A.tocsc()
+            self._ilu = spilu(I_A, drop_tol=1e-5, fill_factor=10)
+        return self._ilu
+
+    def solve(self, b: np.ndarray, transpose: bool = False) -> np.ndarray:
+        """Solves (I - A).x = b, i.e. computes L.b, or (I - A)'.x = b, i.e. computes (b'.L)'
+
+        Args:
+            b (np.ndarray): right-hand side(s), a vector or a matrix whose columns are solved for
+            transpose (bool, optional): True to solve with the transposed matrix, for multipliers. Defaults to False.
+
+        Returns:
+            np.ndarray: solution(s), same shape as b
+        """
+        b = np.asarray(b, dtype="float64")
+        B = b.reshape(len(b), -1)
+        if self.method == "neumann":
+            X = self.neumann(B=B, transpose=transpose)
+        else:
+            X = (
+                np.column_stack(
+                    [
+                        self.krylov(b=B[:, j], transpose=transpose)
+                        for j in range(B.shape[1])
+                    ]
+                )
+                if B.shape[1]
+                else np.zeros_like(B)
+            )
+        return X.reshape(b.shape)
+
+    def neumann(self, B: np.ndarray, transpose: bool = False) -> np.ndarray:
+        """Sums the Neumann series of L applied to the columns of B, until the error bound is below the tolerance
+
+        The error of the partial sum up to A^k.B is L.A^(k+1).B, whose column norms are bounded by those of A^(k+1).B divided by 1 - norm (1-norm, or max-norm of the transposed system).
+
+        Args:
+            B (np.ndarray): right-hand sides, as columns
+            transpose (bool, optional): True to solve with the transposed matrix. Defaults to False.
+
+        Returns:
+            np.ndarray: solutions
+        """
+        if self.norm >= 1:
+            raise ValueError(
+                f"the Neumann series' error can't be bounded, the largest column sum of A is {self.norm:.4f} >= 1, use a Krylov solver"
+            )
+        A = self.AT if transpose else self.A
+        ord = np.inf if transpose else 1
+        bound = 1 / (1 - self.norm)
+        X = B.copy()
+        term = B
+        for _ in range(self.max_iter):
+            term = A @ term
+            X += term
+            # the error of the previous sum is bounded with the new term, hence of the new one too
+            if np.all(
+                bound * np.linalg.norm(term, ord=ord, axis=0)
+                <= self.tol * np.linalg.norm(X, ord=ord, axis=0)
+            ):
+                return X
+        raise RuntimeError(
+            f"The Neumann series didn't converge in {self.max_iter} iterations"
+        )
+
+    def krylov(self, b: np.ndarray, transpose: bool = False) -> np.ndarray:
+        """Solves one system with a preconditioned Krylov solver
+
+        Args:
+            b (np.ndarray): right-hand side
+            transpose (bool, optional): True to solve with the transposed matrix. Defaults to False.
+
+        Returns:
+            np.ndarray: solution
+        """
+        if not b.any():
+            return np.zeros_like(b)
+        n = len(b)
+        A = self.AT if transpose else self.A
+        trans = "T" if transpose else "N"
+        operator = LinearOperator((n, n), matvec=lambda v: v - A @ v, dtype="float64")
+        preconditioner = LinearOperator(
+            (n, n), matvec=lambda v: self.ilu.solve(v, trans=trans), dtype="float64"
+        )
+        function = KRYLOV_SOLVERS[self.method]
+        # the relative tolerance was renamed in scipy 1.12
+        tol_name = "rtol" if "rtol" in inspect.signature(function).parameters else "tol"
+        x, info = function(
+            operator,
+            b,
+            x0=preconditioner.matvec(b),
+            M=preconditioner,
+            atol=0.0,
+            maxiter=self.max_iter,
+            **{tol_name: self.tol},
+        )
+        if info != 0:
+            raise RuntimeError(
+                f"{self.method} didn't converge in {self.max_iter} iterations (info {info})"
+            )
+        return x
+
+
+def leontief_operator(iot, method: str = "neumann") -> Callable:
+    """Gets a function multiplying by the Leontief inverse of a model, L if it is there, matrix-free otherwise
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a model or a counterfactual
+        method (str, optional): matrix-free solver used if iot has no L, 'neumann' replaces 'dense'. Defaults to 'neumann'.
+
+    Returns:
+        Callable: function of an array B and of transpose (bool, optional), returning L.B, or L'.B if transpose
+    """
+    if iot.L is not None:
+        L = iot.L.values
+
+        def product(B: np.ndarray, transpose: bool = False) -> np.ndarray:
+            return (L.T if transpose else L) @ B
+
+        return product
+    if method == "dense":
+        method = "neumann"
+    return LeontiefSolver(A=iot.A, method=method).solve
+
+
+### ACCOUNTS ###
+
+
+def calc_accounts(
+    S: pd.DataFrame, Y: pd.DataFrame, solver: LeontiefSolver
+) -> Dict[str, pd.DataFrame]:
+    """Computes the multipliers M and the account matrices D_cba, D_pba, D_imp and D_exp without forming L
+       Same results as utils.recal_stressor_per_region, with one transposed solve by stressor and region of origin and one solve by region of final demand
+
+    Args:
+        S (pd.DataFrame): stressors by unit of production, columns (region, sector) with the regions as outer level
+        Y (pd.DataFrame): final demand, same rows as the columns of S
+        solver (LeontiefSolver): solver of the systems with I - A
+
+    Returns:
+        Dict[str, pd.DataFrame]: matrices 'M', 'D_cba', 'D_pba', 'D_imp' and 'D_exp'
+    """
+    regions = S.columns.get_level_values(0).unique()
+    n_regions, n_stressors = len(regions), len(S)
+    n_sectors = S.shape[1] // n_regions
+    s = S.values.astype("float64")
+    Y_vect = Y.groupby(axis=1, level=0).sum()[regions].values.astype("float64")
+    index = pd.MultiIndex.from_tuples(
+        [(reg, stressor) for reg in regions for stressor in S.index],
+        names=["region"] + list(S.index.names),
+    )
+
+    # multipliers of the stressors of each region of origin, (region, stressor) x (region, sector)
+    origin = np.repeat(np.arange(n_regions), n_sectors)
+    s_by_origin = (
+        (np.arange(n_regions)[:, None] == origin)[:, None, :] * s[None, :, :]
+    ).reshape(n_regions * n_stressors, -1)
+    M_by_origin = solver.solve(s_by_origin.T, transpose=True).T
+
+    # footprint of each region's final demand, by product: sum over the regions of origin
+    D_cba = np.matmul(
+        M_by_origin.reshape(-1, n_regions, n_sectors).transpose(2, 0, 1),
+        Y_vect.reshape(n_regions, n_sectors, n_regions).transpose(1, 0, 2),
+    ).transpose(1, 2, 0)
+    # the imports leave out the region's own final demand
+    D_imp = D_cba.copy()
+    D_imp.reshape(n_regions, n_stressors, n_regions, n_sectors)[
+        np.arange(n_regions), :, np.arange(n_regions)
+    ] = 0
+
+    # production induced by each region's final demand
+    x_tot = solver.solve(Y_vect)
+    D_pba = s[None, :, :] * x_tot.T[:, None, :]
+    # the exports leave out the region's own production
+    D_exp = D_pba * (np.arange(n_regions)[:, None] != origin)[:, None, :]
+
+    columns = S.columns
+    return {
+        "M": pd.DataFrame(
+            M_by_origin.reshape(n_regions, n_stressors, -1).sum(axis=0),
+            index=S.index,
+            columns=columns,
+        ),
+        "D_cba": pd.DataFrame(
+            D_cba.reshape(n_regions * n_stressors, -1), index=index, columns=columns
+        ),
+        "D_pba": pd.DataFrame(
+            D_pba.reshape(n_regions * n_stressors, -1), index=index, columns=columns
+        ),
+        "D_imp": pd.DataFrame(
+            D_imp.reshape(n_regions * n_stressors, -1), index=index, columns=columns
+        ),
+        "D_exp": pd.DataFrame(
+            D_exp.reshape(n_regions * n_stressors, -1), index=index, columns=columns
+        ),
+    }
@@ -1,17 +1,51 @@
+import copy
 import os
 import pandas as pd
-import pickle as pkl
+import pymrio
 from typing import Callable, Dict, List, Tuple
 
-import src.figures as figures
+from src.counterfactual_iot import CounterfactualIOSystem
+from src.leontief import check_solver
+from src.persistence import (
+    file_lock,
+    get_saved_counterfactuals_list,
+    load_counterfactual,
+    save_counterfactual,
+    save_reference,
+)
+from src.rankings import RankingIndex
 from src.settings import (
     CAPITAL_CONS_DIR,
     EXIOBASE_DIR,
     FIGURES_DIR,
     MODELS_DIR,
+    create_dir,
+)
+from src.stressors import GHG_PARAMS, stressor_shortname
+from src.utils import (
+    build_reference_data,
+    build_counterfactual_data,
+    calc_system,
+    cast_iot,
+    check_precision,
+    footprint_extractor,
+    recal_stressor_per_region,
+    reverse_mapper,
 )
-from src.stressors import GHG_PARAMS
-from src.utils import build_reference_data, build_counterfactual_data, reverse_mapper
+from src.validation import print_failed_checks, validate_iot
+
+MODEL_LOCK_FILE_NAME = ".lock"
+
+
+def _figures():
+    """Imports the figures module on first use, so that the compute path doesn't load the plotting libraries
+
+    Returns:
+        module: src.figures
+    """
+    import src.figures as figures
+
+    return figures
 
 
 class Model:
@@ -25,6 +59,8 @@ class Model:
         sectors_mapper: Dict = None,
         capital: bool = False,
         stressor_params: Dict = GHG_PARAMS,
+        precision: str = "float64",
+        solver: str = "dense",
     ):
         """Inits Model class
 
@@ -37,70 +73,187 @@ class Model:
             sectors_mapper (Dict, optional): sectors aggregation for figures editing, no aggregation if is None. Defaults to None.
             capital (bool, optional): True to endogenize investments and capital. Defaults to False.
             stressor_params (Dict, optional): dictionnary with the stressors' french name, english name, unit and a proxy as a dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight). Defaults to a dictionnary with the GHGs.
+            precision (str, optional): floating point type of the matrices, 'float32' halves the memory footprint (see check_precision). Defaults to 'float64'.
+            solver (str, optional): Leontief solver, 'dense' inverts I - A, the matrix-free ones ('neumann', 'gmres', 'bicgstab') never form L, for the models without aggregation (see leontief.py). Defaults to 'dense'.
         """
 
+        self._set_parameters(
+            base_year=base_year,
+            system=system,
+            aggregation_name=aggregation_name,
+            calib=calib,
+            capital=capital,
+            stressor_params=stressor_params,
+            precision=precision,
+            solver=solver,
+        )
+
+        # a process building the same model holds the lock, the others wait and load its result
+        create_dir(self.model_dir)
+        with file_lock(self.model_dir / MODEL_LOCK_FILE_NAME):
+            iot, rebuilt = build_reference_data(model=self)
+        self._set_iot(
+            iot=iot, regions_mapper=regions_mapper, sectors_mapper=sectors_mapper
+        )
+        # the counterfactuals saved so far were built against the former calibration
+        save_reference(model=self, reset_index=rebuilt)
+
+    def _set_parameters(
+        self,
+        base_year: int,
+        system: str,
+        aggregation_name: str,
+        calib: bool,
+        capital: bool,
+        stressor_params: Dict,
+        precision: str,
+        solver: str,
+    ) -> None:
+        """Sets the parameters of the model and the paths derived from them, see __init__ for the arguments"""
+
+        check_precision(precision)
+        check_solver(solver)
+
         self.base_year = base_year
         self.system = system
         self.aggregation_name = aggregation_name
         self.calib = calib
         self.capital = capital
+        self.precision = precision
+        self.solver = solver
         self.stressor_name = stressor_params["name_FR"]
-        self.stressor_shortname = "".join(
-            filter(str.isalnum, stressor_params["name_EN"].lower())
-        )  # format as file path
+        self.stressor_shortname = stressor_shortname(stressor_params)
         self.stressor_dict = stressor_params["proxy"]
         self.stressor_unit = stressor_params["unit"]
 
         self.summary_shortest = str(base_year) + "__" + system
         self.summary_short = self.summary_shortest + "__" + aggregation_name
+        # the calibrated matrices of each precision and solver are written apart
         self.summary_long = (
             self.summary_short
             + "__"
             + self.stressor_shortname
             + capital * "__with_capital"
+            + (precision != "float64") * f"__{precision}"
+            + (solver != "dense") * f"__{solver}"
         )
         self.exiobase_dir = EXIOBASE_DIR / self.summary_shortest
         self.model_dir = MODELS_DIR / self.summary_long
         self.raw_file_name = f"IOT_{base_year}_{system}.zip"
         self.exiobase_pickle_file_name = self.summary_shortest + ".pickle"
         self.figures_dir = FIGURES_DIR / self.summary_long
+        self.backup_dir = self.model_dir / "backup"
         if self.capital:
             self.capital_consumption_path = (
                 CAPITAL_CONS_DIR / f"Kbar_exio_v3_6_{self.base_year}{self.system}.mat"
             )
 
-        self.iot = build_reference_data(model=self)
+    def _set_iot(
+        self,
+        iot: pymrio.IOSystem,
+        regions_mapper: Dict = None,
+        sectors_mapper: Dict = None,
+    ) -> None:
+        """Sets the calibrated pymrio object, its validation report and the attributes read from it
+
+        Args:
+            iot (pymrio.IOSystem): calibrated pymrio object
+            regions_mapper (Dict, optional): regions aggregation for figures editing, no aggregation if is None. Defaults to None.
+            sectors_mapper (Dict, optional): sectors aggregation for figures editing, no aggregation if is None. Defaults to None.
+        """
+        self.iot = iot
+        self.validation = validate_iot(iot=self.iot, solver=self.solver)
+        print_failed_checks(report=self.validation, name=self.summary_long)
         self.regions = list(self.iot.get_regions())
         self.sectors = list(self.iot.get_sectors())
         self.y_categories = list(self.iot.get_Y_categories())
 
-        self._regions_mapper = regions_mapper
-        self._sectors_mapper = sectors_mapper
-        self.rev_regions_mapper = reverse_mapper(mapper=regions_mapper)
-        self.rev_sectors_mapper = reverse_mapper(mapper=sectors_mapper)
-        if regions_mapper is None:
-            self.new_regions_index = None
-            self.agg_regions = self.regions
-        else:
-            self.agg_regions = list(regions_mapper.keys())
-            self.new_regions_index = pd.Index(self.agg_regions)
-        if sectors_mapper is None:
-            self.new_sectors_index = None
-            self.agg_sectors = self.sectors
-        else:
-            self.agg_sectors = list(sectors_mapper.keys())
-            self.new_sectors_index = pd.Index(self.agg_sectors)
+        self.regions_mapper = regions_mapper
+        self.sectors_mapper = sectors_mapper
 
         self.counterfactuals = {}
         self.reloc = None
-        self.save()
+        self.ranking_indexes = {}
 
     ## save model
 
     def save(self) -> None:
-        """Saves the model as a pickle file"""
-        with open(self.model_dir / "backup.pickle", "wb") as f:
-            pkl.dump(self, f)
+        """Saves the reference and each counterfactual as separate pickle files listed in an index"""
+        save_reference(model=self)
+        for name in self.get_counterfactuals_list():
+            save_counterfactual(model=self, name=name)
+
+    def load_counterfactual(self, name: str) -> None:
+        """Loads a saved counterfactual in self.counterfactuals
+
+        Args:
+            name (str): name of the counterfactual
+        """
+        counterfactual = load_counterfactual(backup_dir=self.backup_dir, name=name)
+        if isinstance(counterfactual.iot, CounterfactualIOSystem):
+            counterfactual.iot.attach(parent=self.iot)
+        self.counterfactuals[name] = counterfactual
+
+    def get_saved_counterfactuals_list(self) -> List[str]:
+        """Returns the list of the names of the saved counterfactuals, loaded or not
+
+        Returns:
+            List[str]: names of the saved counterfactuals
+        """
+        return get_saved_counterfactuals_list(backup_dir=self.backup_dir)
+
+    ## numerical precision
+
+    def check_precision(
+        self,
+        counterfactual_name: str = None,
+        region: str = "FR",
+        verbose: bool = True,
+    ) -> pd.DataFrame:
+        """Compares the footprint computed in the model's precision with the footprint computed in float64 from the same flows
+
+        Args:
+            counterfactual_name (str, optional): name of the counterfactual to check, or None to check the reference (self). Defaults to None.
+            region (str, optional): region name. Defaults to "FR".
+            verbose (bool, optional): True to print infos. Defaults to True.
+
+        Returns:
+            pd.DataFrame: footprint components in the model's precision ('model') and in float64 ('float64') and their relative errors
+        """
+        if counterfactual_name is None:
+            situation = self
+        else:
+            situation = self.counterfactuals[counterfactual_name]
+
+        iot = cast_iot(iot=situation.iot.copy(), precision="float64")
+        iot.A = None
+        iot.x = None
+        iot.L = None
+        iot = calc_system(iot=iot, solver=self.solver)
+        if self.solver == "dense":
+            iot.stressor_extension = recal_stressor_per_region(iot=iot)
+
+        situation_float64 = copy.copy(situation)
+        situation_float64.iot = iot
+
+        comparison = pd.DataFrame(
+            {
+                "model": footprint_extractor(model=situation, region=region),
+                "float64": footprint_extractor(model=situation_float64, region=region),
+            },
+            dtype="float64",
+        )
+        comparison.loc["Total"] = comparison.sum()
+        comparison["relative_error"] = (
+            (comparison["model"] - comparison["float64"]) / comparison["float64"]
+        ).abs()
+
+        if verbose:
+            print(
+                f"Maximal relative error of the footprint of {region} in {self.precision}: {comparison['relative_error'].max():.2e}"
+            )
+
+        return comparison
 
     ## counterfactuals
 
@@ -118,6 +271,7 @@ class Model:
             reloc (bool, optional): True if relocation is allowed. Defaults to False.
         """
         self.counterfactuals[name] = Counterfactual(name, self, scenar_function, reloc)
+        save_counterfactual(model=self, name=name)
 
     def create_counterfactuals_from_dict(
         self,
@@ -146,6 +300,20 @@ class Model:
 
         print(f"Available counterfactuals : {self.get_counterfactuals_list()}")
 
+    def ranking_index(self, region: str = "FR") -> RankingIndex:
+        """Returns the orderings of the trade partners of a region, computed on first use
+
+        Args:
+            region (str, optional): importing region. Defaults to "FR".
+
+        Returns:
+            RankingIndex: orderings of the regions of every sector under every criterion (see rankings.py)
+        """
+        ranking_indexes = self.__dict__.setdefault("ranking_indexes", {})
+        if region not in ranking_indexes:
+            ranking_indexes[region] = RankingIndex(model=self, region=region)
+        return ranking_indexes[region]
+
     def get_counterfactuals_list(self) -> List[str]:
         """Returns the list of the names of the available counterfactuals
 
@@ -201,7 +369,7 @@ class Model:
             region (str, optional): region name. Defaults to "FR".
             title (str, optional): title of the figure. Defaults to None.
         """
-        figures.plot_footprint(
+        _figures().plot_footprint(
             model=self,
             region=region,
             counterfactual_name=counterfactual_name,
@@ -214,7 +382,7 @@ class Model:
         Args:
             counterfactual_name (str, optional): name of the counterfactual to plot, or None to plot the reference (self). Defaults to None.
         """
-        figures.plot_footprint_FR(
+        _figures().plot_footprint_FR(
             model=self,
             counterfactual_name=counterfactual_name,
         )
@@ -230,7 +398,7 @@ class Model:
             counterfactual_name (str, optional): name of the counterfactual to plot, or None to plot the reference (self). Defaults to None.
             prod (bool, optional): True to focus on production values, otherwise focus on consumption values. Defaults to False.
         """
-        figures.plot_stressor_content_heatmap(
+        _figures().plot_stressor_content_heatmap(
             model=self, counterfactual_name=counterfactual_name, prod=prod
         )
 
@@ -243,7 +411,7 @@ class Model:
         Args:
             counterfactual_name (str, optional): name of the counterfactual to plot, or None to plot the reference (self). Defaults to None.
         """
-        figures.plot_stressor_content_production(
+        _figures().plot_stressor_content_production(
             model=self, counterfactual_name=counterfactual_name
         )
 
@@ -255,7 +423,7 @@ class Model:
         Args:
             counterfactual_name (str): name of the counterfactual in model.counterfactuals
         """
-        figures.plot_trade_synthesis(
+        _figures().plot_trade_synthesis(
             model=self, counterfactual_name=counterfactual_name
         )
 
@@ -265,7 +433,7 @@ class Model:
         Args:
             counterfactual_name (str): name of the counterfactual in model.counterfactuals
         """
-        figures.plot_stressor_synthesis(
+        _figures().plot_stressor_synthesis(
             model=self, counterfactual_name=counterfactual_name
         )
 
@@ -275,7 +443,7 @@ class Model:
         Args:
             counterfactual_name (str): name of the counterfactual in model.counterfactuals
         """
-        figures.plot_substressor_synthesis(
+        _figures().plot_substressor_synthesis(
             model=self, counterfactual_name=counterfactual_name
         )
 
@@ -287,7 +455,7 @@ class Model:
         Args:
             verbose (bool, optional): True to print infos. Defaults to True.
         """
-        figures.compare_scenarios(model=self, verbose=verbose)
+        _figures().compare_scenarios(model=self, verbose=verbose)
 
     def plot_stressor_content_heatmap_all(self, prod: bool = False) -> None:
         """Plots the contents in stressors each sector for each region in a heatmap for each counterfactual
@@ -347,9 +515,15 @@ class Counterfactual:
 
         self.name = name
         self.reloc = reloc
+        self.solver = model.solver
         self.iot = build_counterfactual_data(
             model=model, scenar_function=scenar_function, reloc=reloc
         )
+        self.validation = validate_iot(
+            iot=self.iot, reference=model.iot, solver=model.solver
+        )
+        self.iot.release()
+        print_failed_checks(report=self.validation, name=name)
         self.figures_dir = model.figures_dir / name
         if not os.path.isdir(self.figures_dir):
             os.mkdir(self.figures_dir)
@@ -0,0 +1,261 @@
+"""Multi-year panel of the models' matrices, stored as memory-mapped arrays with a year axis
+
+Each matrix of the panel is a .npy file of shape (number of years, rows, columns), opened with np.load(mmap_mode=...) so that a range of years is a slice read from disk on demand.
+The indexes shared by all the years are pickled once and a small manifest lists the years, the matrices and the years already filled.
+"""
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import pathlib
+import pickle as pkl
+from typing import Dict, List
+
+from src.persistence import atomic_write
+from src.settings import MODELS_DIR, create_dir
+
+PANELS_DIR = MODELS_DIR / "panels"
+MANIFEST_FILE_NAME = "manifest.json"
+INDEXES_FILE_NAME = "indexes.pickle"
+
+# matrix name: (object holding it, attribute)
+PANEL_MATRICES = {
+    "x": ("iot", "x"),
+    "Y": ("iot", "Y"),
+    "S": ("stressor_extension", "S"),
+    "M": ("stressor_extension", "M"),
+    "D_cba": ("stressor_extension", "D_cba"),
+    "D_pba": ("stressor_extension", "D_pba"),
+    "D_imp": ("stressor_extension", "D_imp"),
+    "D_exp": ("stressor_extension", "D_exp"),
+    "F_Y": ("stressor_extension", "F_Y"),
+}
+
+
+def get_matrix(model, name: str) -> pd.DataFrame:
+    """Gets one of the panel matrices from a model
+
+    Args:
+        model (Union[Model, Counterfactual]): object Model or Counterfactual defined in model.py
+        name (str): name of the matrix, key of PANEL_MATRICES
+
+    Returns:
+        pd.DataFrame: the matrix
+    """
+    holder, attribute = PANEL_MATRICES[name]
+    if holder == "iot":
+        return getattr(model.iot, attribute)
+    return getattr(model.iot.stressor_extension, attribute)
+
+
+def panel_dir_name(
+    system: str, aggregation_name: str, stressor_name: str, capital: bool
+) -> str:
+    """Formats the name of a panel directory like the models' directories, without the year
+
+    Args:
+        system (str): product ('pxp') or industry ('ixi')
+        aggregation_name (str): name of the aggregation matrix used
+        stressor_name (str): stressors' type (in english, for file names)
+        capital (bool): True if investments and capital are endogenized
+
+    Returns:
+        str: name of the directory in data/models/panels
+    """
+    return (
+        system
+        + "__"
+        + aggregation_name
+        + "__"
+        + stressor_name
+        + capital * "__with_capital"
+    )
+
+
+class PanelStore:
+    def __init__(self, panel_dir: pathlib.PosixPath):
+        """Opens an existing panel
+
+        Args:
+            panel_dir (pathlib.PosixPath): directory of the panel
+        """
+        self.panel_dir = pathlib.Path(panel_dir)
+        with open(self.panel_dir / MANIFEST_FILE_NAME, "r") as f:
+            self.manifest = json.load(f)
+        with open(self.panel_dir / INDEXES_FILE_NAME, "rb") as f:
+            self.indexes = pkl.load(f)
+        self.years = self.manifest["years"]
+        self.matrices = list(self.manifest["matrices"].keys())
+        self._arrays = {}
+
+    @classmethod
+    def create(
+        cls,
+        panel_dir: pathlib.PosixPath,
+        years: List[int],
+        template,
+        matrices: List[str] = None,
+        dtype: str = None,
+    ) -> "PanelStore":
+        """Allocates an empty panel for the given years, shaped like the matrices of a template model
+
+        Args:
+            panel_dir (pathlib.PosixPath): directory of the panel, created if needed
+            years (List[int]): years of the panel (4 digits)
+            template (Union[Model, Counterfactual]): model of any year, giving the shapes and the indexes
+            matrices (List[str], optional): names of the matrices to store, all the keys of PANEL_MATRICES if None. Defaults to None.
+            dtype (str, optional): floating point type of the arrays, the template's precision if None. Defaults to None.
+
+        Returns:
+            PanelStore: the opened panel
+        """
+        panel_dir = create_dir(pathlib.Path(panel_dir))
+        if matrices is None:
+            matrices = list(PANEL_MATRICES.keys())
+        if dtype is None:
+            dtype = getattr(template, "precision", "float64")
+        years = sorted(years)
+
+        indexes = {}
+        manifest = {"years": years, "filled": [], "dtype": dtype, "matrices": {}}
+        for name in matrices:
+            matrix = get_matrix(model=template, name=name)
+            indexes[name] = (matrix.index, matrix.columns)
+            shape = (len(years),) + matrix.shape
+            np.lib.format.open_memmap(
+                panel_dir / f"{name}.npy", mode="w+", dtype=dtype, shape=shape
+            ).flush()
+            manifest["matrices"][name] = list(shape)
+
+        atomic_write(
+            path=panel_dir / INDEXES_FILE_NAME, write=lambda f: pkl.dump(indexes, f)
+        )
+        atomic_write(
+            path=panel_dir / MANIFEST_FILE_NAME,
+            write=lambda f: json.dump(manifest, f, indent=2),
+            mode="w",
+        )
+        return cls(panel_dir=panel_dir)
+
+    ## access to the arrays
+
+    def _array(self, name: str, writable: bool = False) -> np.memmap:
+        mode = "r+" if writable else "r"
+        if (name, mode) not in self._arrays:
+            self._arrays[(name, mode)] = np.load(
+                self.panel_dir / f"{name}.npy", mmap_mode=mode
+            )
+        return self._arrays[(name, mode)]
+
+    def year_position(self, year: int) -> int:
+        """Finds the position of a year on the year axis
+
+        Args:
+            year (int): year in 4 digits
+
+        Returns:
+            int: position of the year in self.years
+        """
+        if year not in self.years:
+            raise KeyError(f"{year} is not a year of the panel ({self.years})")
+        return self.years.index(year)
+
+    def write_year(self, year: int, model) -> None:
+        """Copies the matrices of one year's model into the panel
+
+        Args:
+            year (int): year in 4 digits
+            model (Union[Model, Counterfactual]): object Model or Counterfactual defined in model.py
+        """
+        position = self.year_position(year)
+        for name in self.matrices:
+            matrix = get_matrix(model=model, name=name)
+            index, columns = self.indexes[name]
+            if not (matrix.index.equals(index) and matrix.columns.equals(columns)):
+                raise ValueError(
+                    f"The indexes of {name} in {year} differ from the panel's ones"
+                )
+            array = self._array(name=name, writable=True)
+            array[position] = matrix.values
+            array.flush()
+
+        if year not in self.manifest["filled"]:
+            self.manifest["filled"] = sorted(self.manifest["filled"] + [year])
+        atomic_write(
+            path=self.panel_dir / MANIFEST_FILE_NAME,
+            write=lambda f: json.dump(self.manifest, f, indent=2),
+            mode="w",
+        )
+
+    def get(
+        self, name: str, start_year: int = None, end_year: int = None
+    ) -> np.ndarray:
+        """Reads a matrix for a range of years, as a slice of the memory-mapped array
+
+        Args:
+            name (str): name of the matrix
+            start_year (int, optional): first year of the range, the first year of the panel if None. Defaults to None.
+            end_year (int, optional): last year of the range (included), the last year of the panel if None. Defaults to None.
+
+        Returns:
+            np.ndarray: read-only array of shape (number of years, rows, columns)
+        """
+        start = 0 if start_year is None else self.year_position(start_year)
+        end = len(self.years) if end_year is None else self.year_position(end_year) + 1
+        missing = [
+            year
+            for year in self.years[start:end]
+            if year not in self.manifest["filled"]
+        ]
+        if missing:
+            raise ValueError(f"{name} hasn't been written yet for the years {missing}")
+        return self._array(name=name)[start:end]
+
+    def frame(self, name: str, year: int) -> pd.DataFrame:
+        """Reads a matrix of one year with its indexes
+
+        Args:
+            name (str): name of the matrix
+            year (int): year in 4 digits
+
+        Returns:
+            pd.DataFrame: the matrix, as in the model of that year
+        """
+        index, columns = self.indexes[name]
+        return pd.DataFrame(
+            self.get(name=name, start_year=year, end_year=year)[0],
+            index=index,
+            columns=columns,
+        )
+
+    def series(self, name: str, start_year: int = None, end_year: int = None) -> Dict:
+        """Sums a matrix over its rows and columns for a range of years
+
+        Args:
+            name (str): name of the matrix
+            start_year (int, optional): first year of the range, the first year of the panel if None. Defaults to None.
+            end_year (int, optional): last year of the range (included), the last year of the panel if None. Defaults to None.
+
+        Returns:
+            Dict: total of the matrix by year
+        """
+        array = self.get(name=name, start_year=start_year, end_year=end_year)
+        start = 0 if start_year is None else self.year_position(start_year)
+        return dict(
+            zip(self.years[start : start + len(array)], array.sum(axis=(1, 2)).tolist())
+        )
+
+
+def open_panel(panel_dir: pathlib.PosixPath) -> PanelStore:
+    """Opens an existing panel, if any
+
+    Args:
+        panel_dir (pathlib.PosixPath): directory of the panel
+
+    Returns:
+        PanelStore: the opened panel, None if there is no panel in panel_dir
+    """
+    if not os.path.isfile(pathlib.Path(panel_dir) / MANIFEST_FILE_NAME):
+        return None
+    return PanelStore(panel_dir=panel_dir)
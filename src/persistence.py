@@ -0,0 +1,241 @@
+"""Storage of the models as separate units: the reference and each counterfactual are pickled in their own file, listed in a small index file"""
+
+import datetime
+import json
+import os
+import pathlib
+import pickle as pkl
+import shutil
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the locks are disabled
+    fcntl = None
+
+from src.settings import create_dir
+
+INDEX_FILE_NAME = "index.json"
+INDEX_LOCK_FILE_NAME = ".index.lock"
+REFERENCE_FILE_NAME = "reference.pickle"
+
+
+### AUXILIARY FUNCTIONS ###
+
+
+def atomic_write(path: pathlib.PosixPath, write: callable, mode: str = "wb") -> None:
+    """Writes a file through a temporary file renamed into place, so that readers never see a half-written file
+
+    Args:
+        path (pathlib.PosixPath): destination of the file
+        write (callable): function writing the content in the opened file given as argument
+        mode (str, optional): opening mode of the temporary file. Defaults to "wb".
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def atomic_write_dir(directory: pathlib.PosixPath, write: Callable) -> None:
+    """Writes the files of a directory in a temporary directory and then renames them into place one by one, so that readers never see a half-written file
+
+    Args:
+        directory (pathlib.PosixPath): destination directory, its other files are kept
+        write (Callable): function writing the files in the directory given as argument
+    """
+    directory = pathlib.Path(directory)
+    # no file extension, pymrio would take the directory for a file
+    tmp_dir = directory.with_name(f".{directory.name}__tmp{os.getpid()}")
+    try:
+        write(tmp_dir)
+        for root, _, files in os.walk(tmp_dir):
+            target_dir = create_dir(directory / pathlib.Path(root).relative_to(tmp_dir))
+            for name in files:
+                os.replace(pathlib.Path(root) / name, target_dir / name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+@contextmanager
+def file_lock(path: pathlib.PosixPath) -> Iterator[None]:
+    """Holds an exclusive lock on a lock file, waiting while another process holds it (no-op where fcntl is unavailable)
+
+    Args:
+        path (pathlib.PosixPath): lock file, created if needed
+    """
+    path = pathlib.Path(path)
+    create_dir(path.parent)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def counterfactual_file_name(name: str) -> str:
+    """Formats a counterfactual name as a file name
+
+    Args:
+        name (str): name of the counterfactual
+
+    Returns:
+        str: file name of the counterfactual unit
+    """
+    return (
+        "counterfactual__"
+        + "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+        + ".pickle"
+    )
+
+
+### INDEX ###
+
+
+def read_index(backup_dir: pathlib.PosixPath) -> Dict:
+    """Reads the index of the saved units
+
+    Args:
+        backup_dir (pathlib.PosixPath): directory of the saved units
+
+    Returns:
+        Dict: index with the reference file and the counterfactual files, None if nothing is saved
+    """
+    if not os.path.isfile(backup_dir / INDEX_FILE_NAME):
+        return None
+    with open(backup_dir / INDEX_FILE_NAME, "r") as f:
+        return json.load(f)
+
+
+def write_index(backup_dir: pathlib.PosixPath, index: Dict) -> None:
+    """Writes the index of the saved units
+
+    Args:
+        backup_dir (pathlib.PosixPath): directory of the saved units
+        index (Dict): index with the reference file and the counterfactual files
+    """
+    atomic_write(
+        path=backup_dir / INDEX_FILE_NAME,
+        write=lambda f: json.dump(index, f, indent=2),
+        mode="w",
+    )
+
+
+def get_saved_counterfactuals_list(backup_dir: pathlib.PosixPath) -> List[str]:
+    """Returns the names of the counterfactuals saved in backup_dir
+
+    Args:
+        backup_dir (pathlib.PosixPath): directory of the saved units
+
+    Returns:
+        List[str]: names of the saved counterfactuals
+    """
+    index = read_index(backup_dir=backup_dir)
+    if index is None:
+        return []
+    return list(index["counterfactuals"].keys())
+
+
+### SAVERS ###
+
+
+def save_reference(model, reset_index: bool = False) -> None:
+    """Saves the reference (the model without its counterfactuals)
+
+    Args:
+        model (Model): object Model defined in model.py
+        reset_index (bool, optional): True to forget the counterfactuals saved so far, e.g. after a new calibration. Defaults to False.
+    """
+    backup_dir = model.backup_dir
+    create_dir(backup_dir)
+
+    state = model.__dict__.copy()
+    state["counterfactuals"] = {}
+    atomic_write(
+        path=backup_dir / REFERENCE_FILE_NAME,
+        write=lambda f: pkl.dump((type(model), state), f),
+    )
+
+    with file_lock(backup_dir / INDEX_LOCK_FILE_NAME):
+        index = read_index(backup_dir=backup_dir)
+        if index is None or reset_index:
+            index = {"counterfactuals": {}}
+        index["reference"] = {
+            "file": REFERENCE_FILE_NAME,
+            "saved": datetime.datetime.now().isoformat(),
+        }
+        write_index(backup_dir=backup_dir, index=index)
+
+
+def save_counterfactual(model, name: str) -> None:
+    """Saves one counterfactual and appends it to the index
+
+    Args:
+        model (Model): object Model defined in model.py
+        name (str): name of the counterfactual in model.counterfactuals
+    """
+    backup_dir = model.backup_dir
+    create_dir(backup_dir)
+    counterfactual = model.counterfactuals[name]
+    file_name = counterfactual_file_name(name=name)
+    atomic_write(
+        path=backup_dir / file_name,
+        write=lambda f: pkl.dump(counterfactual, f),
+    )
+
+    with file_lock(backup_dir / INDEX_LOCK_FILE_NAME):
+        index = read_index(backup_dir=backup_dir)
+        if index is None:
+            index = {"counterfactuals": {}}
+        index["counterfactuals"][name] = {
+            "file": file_name,
+            "reloc": counterfactual.reloc,
+            "saved": datetime.datetime.now().isoformat(),
+        }
+        write_index(backup_dir=backup_dir, index=index)
+
+
+### LOADERS ###
+
+
+def load_reference(backup_dir: pathlib.PosixPath):
+    """Loads the reference saved in backup_dir, without any counterfactual
+
+    Args:
+        backup_dir (pathlib.PosixPath): directory of the saved units
+
+    Returns:
+        Model: object Model defined in model.py
+    """
+    index = read_index(backup_dir=backup_dir)
+    with open(backup_dir / index["reference"]["file"], "rb") as f:
+        model_class, state = pkl.load(f)
+    model = model_class.__new__(model_class)
+    model.__dict__.update(state)
+    return model
+
+
+def load_counterfactual(backup_dir: pathlib.PosixPath, name: str):
+    """Loads one counterfactual saved in backup_dir
+
+    Args:
+        backup_dir (pathlib.PosixPath): directory of the saved units
+        name (str): name of the counterfactual
+
+    Returns:
+        Counterfactual: object Counterfactual defined in model.py
+    """
+    index = read_index(backup_dir=backup_dir)
+    with open(backup_dir / index["counterfactuals"][name]["file"], "rb") as f:
+        return pkl.load(f)
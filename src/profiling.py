@@ -0,0 +1,333 @@
+"""Named spans recording the wall time and the memory of the pipeline stages
+
+Profiling is disabled unless the environment variable MATMAT_PROFILE is set:
+    - MATMAT_PROFILE=1 writes the spans in data/profiles when the process exits
+    - MATMAT_PROFILE=<path prefix> writes them in <path prefix>.json and <path prefix>.trace.json
+The .trace.json file follows the Trace Event Format (chrome://tracing, Perfetto).
+Each span records the RSS at its start and end, its own peak RSS (peak_rss_mb, Linux only, from the high water mark reset at the start of each span) and the peak RSS of the process since it started (process_peak_rss_mb, cumulative).
+The jobs of src/jobs.py write their spans at their end, suffixed with the job id (see export_recorded), because the worker processes exit without running the atexit hooks.
+"""
+
+import atexit
+import datetime
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from src.settings import DATA_DIR, create_dir
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILE_ENV_VAR = "MATMAT_PROFILE"
+PROFILES_DIR = DATA_DIR / "profiles"
+
+_spans = []
+_stack = threading.local()
+_origin = time.perf_counter()
+
+# peaks of the open spans, the high water mark being reset at the start of each span
+_span_peaks = []
+_span_peaks_lock = threading.Lock()
+_peak_before_reset = 0.0
+
+
+### MEMORY ###
+
+
+def max_rss_mb() -> float:
+    """Returns the peak resident set size of the current process since it started (Unix only)
+
+    Returns:
+        float: peak RSS in MB, None if unavailable
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on macOS, kilobytes elsewhere
+        max_rss /= 2**20
+    else:
+        max_rss /= 2**10
+    # the resets of the high water mark by the spans lower ru_maxrss on Linux
+    return max(max_rss, _peak_before_reset)
+
+
+def current_rss_mb() -> float:
+    """Returns the current resident set size of the current process (Linux only)
+
+    Returns:
+        float: current RSS in MB, None if unavailable
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def high_water_mark_mb() -> float:
+    """Returns the peak resident set size of the current process since its last reset (Linux only)
+
+    Returns:
+        float: peak RSS in MB, None if unavailable
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def reset_high_water_mark() -> bool:
+    """Resets the peak resident set size of the current process to its current RSS (Linux only)
+
+    Returns:
+        bool: True if it was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _start_peak() -> List[float]:
+    """Starts measuring the peak RSS of a span, after passing the high water mark so far to the spans already open
+
+    Returns:
+        List[float]: peak of the span so far, None if the high water mark can't be reset
+    """
+    global _peak_before_reset
+    with _span_peaks_lock:
+        high_water_mark = high_water_mark_mb()
+        if high_water_mark is None or not reset_high_water_mark():
+            return None
+        _peak_before_reset = max(_peak_before_reset, high_water_mark)
+        for peak in _span_peaks:
+            peak[0] = max(peak[0], high_water_mark)
+        peak = [0.0]
+        _span_peaks.append(peak)
+        return peak
+
+
+def _end_peak(peak: List[float]) -> float:
+    """Ends measuring the peak RSS of a span
+
+    Args:
+        peak (List[float]): peak returned by _start_peak
+
+    Returns:
+        float: peak RSS of the span in MB, None if unavailable
+    """
+    if peak is None:
+        return None
+    with _span_peaks_lock:
+        _span_peaks[:] = [other for other in _span_peaks if other is not peak]
+        return max(peak[0], high_water_mark_mb() or 0.0)
+
+
+### SPANS ###
+
+
+def is_enabled() -> bool:
+    """Checks whether profiling is toggled on by the environment variable
+
+    Returns:
+        bool: True if spans are recorded
+    """
+    return os.environ.get(PROFILE_ENV_VAR, "0") not in ["", "0"]
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """Records the wall time and the memory of the enclosed code under a name
+
+    Args:
+        name (str): name of the stage
+        **attributes: additional information on the stage (year, aggregation, scenario...)
+    """
+    if not is_enabled():
+        yield
+        return
+
+    if not hasattr(_stack, "names"):
+        _stack.names = []
+    parent = _stack.names[-1] if _stack.names else None
+    _stack.names.append(name)
+    rss_start = current_rss_mb()
+    peak = _start_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        peak_rss = _end_peak(peak)
+        _stack.names.pop()
+        _spans.append(
+            {
+                "name": name,
+                "parent": parent,
+                "depth": len(_stack.names),
+                "attributes": {key: str(value) for key, value in attributes.items()},
+                "start_s": start - _origin,
+                "wall_time_s": end - start,
+                "rss_start_mb": rss_start,
+                "rss_end_mb": current_rss_mb(),
+                "peak_rss_mb": peak_rss,
+                "process_peak_rss_mb": max_rss_mb(),
+                "pid": os.getpid(),
+                "thread": threading.get_ident(),
+            }
+        )
+
+
+def get_spans() -> List[Dict]:
+    """Returns the spans recorded so far, in order of completion
+
+    Returns:
+        List[Dict]: span records
+    """
+    return list(_spans)
+
+
+def reset() -> None:
+    """Forgets the spans recorded so far"""
+    _spans.clear()
+
+
+def summarize(spans: List[Dict] = None) -> Dict[str, Dict]:
+    """Sums the wall times of the spans sharing the same name
+
+    Args:
+        spans (List[Dict], optional): span records, all the recorded spans if None. Defaults to None.
+
+    Returns:
+        Dict[str, Dict]: number of calls, total wall time and highest peak RSS within a call (None if unavailable) for each span name
+    """
+    if spans is None:
+        spans = get_spans()
+    summary = {}
+    for record in spans:
+        name = (
+            record["name"]
+            if record["parent"] is None
+            else f"{record['parent']}/{record['name']}"
+        )
+        if name not in summary:
+            summary[name] = {"calls": 0, "wall_time_s": 0.0, "peak_rss_mb": None}
+        summary[name]["calls"] += 1
+        summary[name]["wall_time_s"] += record["wall_time_s"]
+        if record["peak_rss_mb"] is not None:
+            summary[name]["peak_rss_mb"] = max(
+                summary[name]["peak_rss_mb"] or 0.0, record["peak_rss_mb"]
+            )
+    return summary
+
+
+### EXPORTS ###
+
+
+def to_trace_events(spans: List[Dict] = None) -> Dict:
+    """Converts span records into the Trace Event Format
+
+    Args:
+        spans (List[Dict], optional): span records, all the recorded spans if None. Defaults to None.
+
+    Returns:
+        Dict: trace with complete events ("ph": "X")
+    """
+    if spans is None:
+        spans = get_spans()
+    return {
+        "traceEvents": [
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": 1e6 * record["start_s"],
+                "dur": 1e6 * record["wall_time_s"],
+                "pid": record["pid"],
+                "tid": record["thread"],
+                "args": {
+                    **record["attributes"],
+                    "rss_start_mb": record["rss_start_mb"],
+                    "rss_end_mb": record["rss_end_mb"],
+                    "peak_rss_mb": record["peak_rss_mb"],
+                    "process_peak_rss_mb": record["process_peak_rss_mb"],
+                },
+            }
+            for record in spans
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def default_path_prefix() -> pathlib.PosixPath:
+    """Formats a path prefix in data/profiles unique to the current process
+
+    Returns:
+        pathlib.PosixPath: path prefix of the profile files
+    """
+    return create_dir(PROFILES_DIR) / (
+        "profile__"
+        + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        + f"__{os.getpid()}"
+    )
+
+
+def export(path_prefix: pathlib.PosixPath = None) -> pathlib.PosixPath:
+    """Writes the recorded spans as JSON and as trace events
+
+    Args:
+        path_prefix (pathlib.PosixPath, optional): files are written in path_prefix.json and path_prefix.trace.json, in data/profiles if None. Defaults to None.
+
+    Returns:
+        pathlib.PosixPath: path of the JSON file
+    """
+    if path_prefix is None:
+        path_prefix = default_path_prefix()
+    path_prefix = pathlib.Path(path_prefix)
+    spans = get_spans()
+    with open(path_prefix.with_name(path_prefix.name + ".json"), "w") as f:
+        json.dump(spans, f, indent=2)
+    with open(path_prefix.with_name(path_prefix.name + ".trace.json"), "w") as f:
+        json.dump(to_trace_events(spans), f)
+    return path_prefix.with_name(path_prefix.name + ".json")
+
+
+def export_recorded(suffix: str = None) -> pathlib.PosixPath:
+    """Writes the spans recorded so far where MATMAT_PROFILE says, and forgets them
+
+    Args:
+        suffix (str, optional): appended to the path prefix, e.g. a job id, so that several processes don't write the same files. Defaults to None.
+
+    Returns:
+        pathlib.PosixPath: path of the JSON file, None if profiling is disabled or no span was recorded
+    """
+    if not is_enabled() or not _spans:
+        return None
+    value = os.environ[PROFILE_ENV_VAR]
+    path_prefix = default_path_prefix() if value == "1" else pathlib.Path(value)
+    if suffix is not None:
+        path_prefix = path_prefix.with_name(f"{path_prefix.name}__{suffix}")
+    path = export(path_prefix=path_prefix)
+    reset()
+    return path
+
+
+def _export_at_exit() -> None:
+    export_recorded()
+
+
+atexit.register(_export_at_exit)
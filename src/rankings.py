@@ -0,0 +1,153 @@
+"""Precomputed orderings of the trade partners used by the sorting scenarios
+
+A criterion scores each region (rows) for each sector (columns), the lower the score the earlier the region is chosen as a supplier.
+RankingIndex sorts the regions of every sector under every criterion once, for one importing region, and keeps the orderings as small integer arrays.
+Criteria are registered in RANKING_CRITERIA, and a user-supplied cost (or any other score) can be added to an index with add_criterion.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List
+
+### CRITERIA ###
+
+
+def content_scores(model, region: str = "FR") -> Dict[str, pd.DataFrame]:
+    """Scores the regions by stressor content of their products, in total and for each stressor if there are several
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Dict[str, pd.DataFrame]: scores by criterion name ('content' and 'content:<stressor>')
+    """
+    M = model.iot.stressor_extension.M
+    scores = {"content": M.sum(axis=0).unstack()}
+    if len(M) > 1:
+        for stressor in M.index:
+            scores[f"content:{stressor}"] = M.loc[stressor].unstack()
+    return scores
+
+
+def export_capacity_scores(model, region: str = "FR") -> Dict[str, pd.DataFrame]:
+    """Scores the regions by decreasing export capacity (exports to all the other regions) of their products
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Dict[str, pd.DataFrame]: scores of the criterion 'export_capacity'
+    """
+    Z, Y = model.iot.Z, model.iot.Y
+    uses_by_region = Z.groupby(axis=1, level=0).sum() + Y.groupby(axis=1, level=0).sum()
+    uses_by_region = uses_by_region[model.regions]
+    domestic_uses = uses_by_region.values[
+        np.arange(len(uses_by_region)),
+        np.repeat(np.arange(len(model.regions)), len(model.sectors)),
+    ]
+    capacities = pd.Series(
+        uses_by_region.values.sum(axis=1) - domestic_uses, index=uses_by_region.index
+    )
+    return {"export_capacity": -capacities.unstack()}
+
+
+def import_share_scores(model, region: str = "FR") -> Dict[str, pd.DataFrame]:
+    """Scores the regions by decreasing share in the importing region's current uses of each product
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Dict[str, pd.DataFrame]: scores of the criterion 'import_share'
+    """
+    uses = (model.iot.Z[region].sum(axis=1) + model.iot.Y[region].sum(axis=1)).unstack()
+    totals = uses.sum(axis=0)
+    return {"import_share": -uses.div(totals.where(totals != 0, 1), axis=1)}
+
+
+def cost_criterion(costs: pd.DataFrame, name: str = "cost") -> Callable:
+    """Makes a criterion from user-supplied costs, e.g. to add it to RANKING_CRITERIA
+
+    Args:
+        costs (pd.DataFrame): cost of each product (columns) from each region (rows), the cheapest first
+        name (str, optional): name of the criterion. Defaults to "cost".
+
+    Returns:
+        Callable: criterion, see RANKING_CRITERIA
+    """
+    return lambda model, region="FR": {name: costs}
+
+
+# criteria computed by RankingIndex, each returns scores (regions x sectors) by criterion name
+RANKING_CRITERIA = {
+    "content": content_scores,
+    "export_capacity": export_capacity_scores,
+    "import_share": import_share_scores,
+}
+
+
+### INDEX ###
+
+
+class RankingIndex:
+    def __init__(self, model, region: str = "FR", criteria: Dict = None):
+        """Inits RankingIndex class, sorting the regions of every sector under every criterion
+
+        Args:
+            model (Model): object Model defined in model.py
+            region (str, optional): importing region. Defaults to "FR".
+            criteria (Dict, optional): criteria to compute, see RANKING_CRITERIA, all the registered ones if None. Defaults to None.
+        """
+        self.region = region
+        self.regions = list(model.regions)
+        self.sectors = list(model.sectors)
+        self.sector_positions = {sector: i for i, sector in enumerate(self.sectors)}
+        self.region_position = self.regions.index(region)
+        self.dtype = np.min_scalar_type(len(self.regions))
+        self.orders = {}
+        if criteria is None:
+            criteria = RANKING_CRITERIA
+        for criterion in criteria.values():
+            for name, scores in criterion(model, region).items():
+                self.add_criterion(name=name, scores=scores)
+
+    def add_criterion(self, name: str, scores: pd.DataFrame) -> None:
+        """Sorts the regions of every sector by their scores
+
+        Args:
+            name (str): name of the criterion
+            scores (pd.DataFrame): score of each region (rows) for each sector (columns), the lowest first
+        """
+        values = scores.loc[self.regions, self.sectors].values
+        # stable sort, so that ties keep the regions' order
+        self.orders[name] = np.ascontiguousarray(
+            np.argsort(values, axis=0, kind="stable").T, dtype=self.dtype
+        )
+
+    @property
+    def criteria(self) -> List[str]:
+        return list(self.orders.keys())
+
+    def order(self, criterion: str, sector: str, reloc: bool = False) -> np.ndarray:
+        """Gets the ordering of the trade partners for a sector
+
+        Args:
+            criterion (str): name of the criterion
+            sector (str): name of a product (or industry)
+            reloc (bool, optional): True if relocation is allowed, the importing region is left out otherwise. Defaults to False.
+
+        Returns:
+            np.ndarray: sorted indices of the trade partners in model.regions, or in model.regions without the importing region if reloc is False
+        """
+        if criterion not in self.orders:
+            raise KeyError(
+                f"Unknown criterion {criterion}, available ones: {self.criteria}"
+            )
+        order = self.orders[criterion][self.sector_positions[sector]]
+        if reloc:
+            return order
+        order = order[order != self.region_position]
+        return order - (order > self.region_position).astype(self.dtype)
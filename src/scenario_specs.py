@@ -0,0 +1,352 @@
+"""Declarative scenarios, compiled into array operations on region's import blocks of Z and Y
+
+A scenario is a dictionnary (or an entry of a YAML or JSON file) such as:
+    pref_eu_half:
+        rule: pref                  # 'pref', 'sort' or 'lp'
+        allies: [EU]                # pref: partners favoured, or 'opponents' to favour all the other ones
+        sectors: [Sector 03]        # optional: sectors reallocated, all if absent
+        share: 0.5                  # optional: share of the importations reallocated. Defaults to 1.
+        reloc: false                # optional: overrides the reloc value of the counterfactual
+        description: Half of the importations from outside the EU move to the EU
+The rules are:
+    - pref: the importations from the other partners move to the allies, in proportion to the allies' export capacities, as in scenar_pref
+    - sort: the importations are allocated to the partners sorted by a criterion of the model's ranking index ('criterion', see rankings.py), each partner supplying up to its export capacity, as in moves_from_sort_rule
+    - lp: the importations are allocated by moves_from_lp ('maximize', 'partner_caps', 'reloc_limit')
+The import blocks of all the sectors are reallocated at once, as arrays of shape (regions, sectors, region's columns of Z and Y).
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import pathlib
+from typing import Callable, Dict, List, Tuple
+
+from src.model import Model
+from src.scenarios import DICT_SCENARIOS, moves_from_lp
+from src.threads import respect_thread_budget
+
+SCENARIO_RULES = ["pref", "sort", "lp"]
+SCENARIO_KEYS = {
+    "pref": {"allies", "opponents", "sectors", "share", "reloc", "description"},
+    "sort": {"criterion", "sectors", "share", "reloc", "description"},
+    "lp": {"maximize", "partner_caps", "reloc_limit", "reloc", "description"},
+}
+
+
+### SPECIFICATIONS ###
+
+
+def load_scenario_specs(path: pathlib.PosixPath) -> Dict[str, Dict]:
+    """Reads scenario specifications from a YAML (requires pyyaml) or JSON file
+
+    Args:
+        path (pathlib.PosixPath): file with the specifications by scenario name
+
+    Returns:
+        Dict[str, Dict]: specifications by scenario name
+    """
+    path = pathlib.Path(path)
+    with open(path, "r") as f:
+        if path.suffix in [".yaml", ".yml"]:
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(
+                    "Reading YAML scenarios requires pyyaml (pip install pyyaml), JSON files can be used instead"
+                )
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    if not isinstance(specs, dict):
+        raise ValueError(f"{path} must map scenario names to specifications")
+    return specs
+
+
+def check_scenario_spec(name: str, spec: Dict) -> Dict:
+    """Checks a scenario specification and fills its default values
+
+    Args:
+        name (str): name of the scenario
+        spec (Dict): specification, see the module docstring
+
+    Returns:
+        Dict: completed specification
+    """
+    rule = spec.get("rule")
+    if rule not in SCENARIO_RULES:
+        raise ValueError(
+            f"Scenario {name}: the rule must be among {SCENARIO_RULES}, not {rule}"
+        )
+    unknown = set(spec.keys()) - SCENARIO_KEYS[rule] - {"rule"}
+    if unknown:
+        raise ValueError(
+            f"Scenario {name}: unknown keys {sorted(unknown)} for the rule {rule}"
+        )
+    if rule == "pref" and ("allies" in spec) == ("opponents" in spec):
+        raise ValueError(f"Scenario {name}: give either allies or opponents")
+    spec = {"share": 1.0, "sectors": None, "reloc": None, **spec}
+    if rule == "sort":
+        spec.setdefault("criterion", "content")
+    if not 0 <= spec["share"] <= 1:
+        raise ValueError(f"Scenario {name}: the share must be between 0 and 1")
+    return spec
+
+
+### ARRAY OPERATIONS ###
+
+
+def import_blocks(model: Model, region: str) -> np.ndarray:
+    """Gathers the uses of each product from each region by region's columns of Z and Y
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str): importing region
+
+    Returns:
+        np.ndarray: array of shape (regions, sectors, region's columns of Z then Y)
+    """
+    Z, Y = model.iot.Z, model.iot.Y
+    return np.concatenate(
+        [Z[region].values, Y[region].values], axis=1, dtype="float64"
+    ).reshape(len(model.regions), len(model.sectors), -1)
+
+
+def exports_by_destination(model: Model) -> np.ndarray:
+    """Sums the uses of each product from each region by using region
+
+    Args:
+        model (Model): object Model defined in model.py
+
+    Returns:
+        np.ndarray: array of shape (regions, sectors, using regions)
+    """
+    Z, Y = model.iot.Z, model.iot.Y
+    uses = Z.groupby(axis=1, level=0).sum() + Y.groupby(axis=1, level=0).sum()
+    return (
+        uses[model.regions]
+        .values.astype("float64")
+        .reshape(len(model.regions), len(model.sectors), -1)
+    )
+
+
+def region_masks(
+    model: Model, region: str, reloc: bool, partners: List[str] = None
+) -> Tuple[np.ndarray]:
+    """Lists the candidate trade partners and the given partners as boolean masks on model.regions
+
+    Args:
+        model (Model): object Model defined in model.py
+        region (str): importing region
+        reloc (bool): True if relocation is allowed, region is a candidate then
+        partners (List[str], optional): names of regions. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray]: masks of the candidates and of the partners among them
+    """
+    unknown = set(partners or []) - set(model.regions)
+    if unknown:
+        raise ValueError(f"Unknown regions {sorted(unknown)}")
+    candidates = np.ones(len(model.regions), dtype=bool)
+    candidates[model.regions.index(region)] = reloc
+    return candidates, candidates & np.isin(model.regions, partners or [])
+
+
+def sectors_mask(model: Model, sectors: List[str] = None) -> np.ndarray:
+    """Lists the reallocated sectors as a boolean mask on model.sectors
+
+    Args:
+        model (Model): object Model defined in model.py
+        sectors (List[str], optional): names of the sectors, all of them if None. Defaults to None.
+
+    Returns:
+        np.ndarray: mask of the reallocated sectors
+    """
+    if sectors is None:
+        return np.ones(len(model.sectors), dtype=bool)
+    unknown = set(sectors) - set(model.sectors)
+    if unknown:
+        raise ValueError(f"Unknown sectors {sorted(unknown)}")
+    return np.isin(model.sectors, sectors)
+
+
+def safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Divides two broadcastable arrays, with 0 where the denominator is 0
+
+    Args:
+        numerator (np.ndarray): numerator
+        denominator (np.ndarray): denominator
+
+    Returns:
+        np.ndarray: quotient
+    """
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape),
+        where=denominator != 0,
+    )
+
+
+def reallocate_pref(model: Model, spec: Dict, reloc: bool, region: str) -> np.ndarray:
+    """Moves region's importations from the other partners to the allies, in proportion to the allies' export capacities to the third regions
+
+    Args:
+        model (Model): object Model defined in model.py
+        spec (Dict): specification of the scenario, see check_scenario_spec
+        reloc (bool): True if relocation is allowed, region is an ally then
+        region (str): importing region
+
+    Returns:
+        np.ndarray: new import blocks, see import_blocks
+    """
+    blocks = import_blocks(model=model, region=region)
+    if "allies" in spec:
+        allies = list(spec["allies"])
+    else:
+        region_masks(
+            model=model, region=region, reloc=reloc, partners=spec["opponents"]
+        )
+        allies = list(set(model.regions) - set(spec["opponents"]))
+    candidates, allies = region_masks(
+        model=model, region=region, reloc=reloc, partners=allies + [region]
+    )
+    others = candidates & ~allies
+
+    # export capacities to the regions other than the exporter and region
+    exports = exports_by_destination(model=model)
+    position = model.regions.index(region)
+    capacities = (
+        exports.sum(axis=2)
+        - np.einsum("ksk->ks", exports)
+        - exports[:, :, position] * (np.arange(len(model.regions)) != position)[:, None]
+    )
+    capacities[~allies] = 0
+    total_capacities = capacities.sum(axis=0)
+
+    # volumes moved, by sector and by region's column
+    others_uses = blocks[others].sum(axis=0)
+    others_totals = others_uses.sum(axis=1)
+    moved = np.minimum(total_capacities, spec["share"] * others_totals)
+    moved[~sectors_mask(model=model, sectors=spec["sectors"])] = 0
+    moved_share = safe_divide(moved, others_totals)
+
+    new_blocks = blocks.copy()
+    new_blocks[others] *= (1 - moved_share)[None, :, None]
+    new_blocks[allies] += (
+        safe_divide(capacities[allies], total_capacities[None, :])[:, :, None]
+        * (moved_share[:, None] * others_uses)[None, :, :]
+    )
+    return new_blocks
+
+
+def reallocate_sort(model: Model, spec: Dict, reloc: bool, region: str) -> np.ndarray:
+    """Allocates region's importations to the partners sorted by a criterion, each one up to its export capacity
+
+    Args:
+        model (Model): object Model defined in model.py
+        spec (Dict): specification of the scenario, see check_scenario_spec
+        reloc (bool): True if relocation is allowed, region is a candidate then
+        region (str): importing region
+
+    Returns:
+        np.ndarray: new import blocks, see import_blocks
+    """
+    blocks = import_blocks(model=model, region=region)
+    candidates, _ = region_masks(model=model, region=region, reloc=reloc)
+    position = model.regions.index(region)
+    foreign = np.arange(len(model.regions)) != position
+
+    # importations, with their split between region's columns
+    imports = blocks[foreign].sum(axis=0)
+    total_imports = imports.sum(axis=1)
+    column_shares = safe_divide(imports, total_imports[:, None])
+
+    # export capacities to all the other regions, in the order of the criterion
+    exports = exports_by_destination(model=model)
+    capacities = exports.sum(axis=2) - np.einsum("ksk->ks", exports)
+    capacities[~candidates] = 0
+    order = model.ranking_index(region=region).orders[spec["criterion"]]
+    sorted_capacities = np.take_along_axis(capacities.T, order.astype(int), axis=1)
+    before = np.cumsum(sorted_capacities, axis=1) - sorted_capacities
+    allocated = np.zeros_like(sorted_capacities)
+    np.put_along_axis(
+        allocated,
+        order.astype(int),
+        np.clip(spec["share"] * total_imports[:, None] - before, 0, sorted_capacities),
+        axis=1,
+    )
+
+    new_blocks = blocks.copy()
+    new_blocks[foreign] *= 1 - spec["share"]
+    new_blocks += allocated.T[:, :, None] * column_shares[None, :, :]
+    unchanged = ~sectors_mask(model=model, sectors=spec["sectors"])
+    new_blocks[:, unchanged] = blocks[:, unchanged]
+    return new_blocks
+
+
+REALLOCATIONS = {"pref": reallocate_pref, "sort": reallocate_sort}
+
+
+### COMPILATION ###
+
+
+def compile_scenario(name: str, spec: Dict) -> Callable:
+    """Turns a scenario specification into a scenario function
+
+    Args:
+        name (str): name of the scenario
+        spec (Dict): specification, see the module docstring
+
+    Returns:
+        Callable[[Model, bool, str], Tuple[pd.DataFrame]]: builds the new Z and Y matrices given the model, reloc and the importing region, like the functions of scenarios.py
+    """
+    spec = check_scenario_spec(name=name, spec=spec)
+
+    @respect_thread_budget
+    def scenario(
+        model: Model, reloc: bool = False, region: str = "FR"
+    ) -> Tuple[pd.DataFrame]:
+        if spec["reloc"] is not None:
+            reloc = spec["reloc"]
+        if spec["rule"] == "lp":
+            return moves_from_lp(
+                model=model,
+                maximize=spec.get("maximize", False),
+                reloc=reloc,
+                partner_caps=spec.get("partner_caps"),
+                reloc_limit=spec.get("reloc_limit"),
+                region=region,
+            )
+
+        new_blocks = REALLOCATIONS[spec["rule"]](
+            model=model, spec=spec, reloc=reloc, region=region
+        ).reshape(len(model.regions) * len(model.sectors), -1)
+        new_Z = model.iot.Z.copy()
+        new_Y = model.iot.Y.copy()
+        n_columns = new_Z[region].shape[1]
+        new_Z.loc[:, (region, slice(None))] = new_blocks[:, :n_columns]
+        new_Y.loc[:, (region, slice(None))] = new_blocks[:, n_columns:]
+        return new_Z, new_Y
+
+    scenario.__name__ = f"scenar_{name}"
+    scenario.__doc__ = spec.get("description")
+    return scenario
+
+
+def register_scenarios(specs: Dict[str, Dict], registry: Dict = None) -> List[str]:
+    """Compiles scenario specifications and adds them to the available scenarios
+
+    Args:
+        specs (Dict[str, Dict]): specifications by scenario name
+        registry (Dict, optional): scenario functions by name, DICT_SCENARIOS if None. Defaults to None.
+
+    Returns:
+        List[str]: names of the registered scenarios
+    """
+    if registry is None:
+        registry = DICT_SCENARIOS
+    compiled = {
+        name: compile_scenario(name=name, spec=spec) for name, spec in specs.items()
+    }
+    registry.update(compiled)
+    return list(compiled.keys())
@@ -1,46 +1,55 @@
 import numpy as np
 import pandas as pd
-from typing import Callable, Dict, List, Tuple
+import warnings
+from scipy import sparse
+from scipy.optimize import linprog
+from typing import Callable, Dict, List, Tuple, Union
 
+from src.leontief import LeontiefSolver, leontief_operator
 from src.model import Model
-
+from src.threads import respect_thread_budget
 
 ### AUXILIARY FUNCTIONS FOR SCENARIOS ###
 
 
 def moves_from_sorted_index_by_sector(
-    model: Model, sector: str, regions_index: List[int], reloc: bool = None
+    model: Model,
+    sector: str,
+    regions_index: List[int],
+    reloc: bool = None,
+    region: str = "FR",
 ) -> Tuple[pd.DataFrame]:
-    """Allocates french importations for a sector in the order given by region_index
+    """Allocates region's importations for a sector in the order given by region_index
 
     Args:
         model (Model): object Model defined in model.py
         sector (str): name of a product (or industry)
         regions_index (List[int]): list of ordered region indices
         reloc (bool): True if relocation is allowed. Defaults to None.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
-            - DataFrame with the imports of 'sector' from regions (rows) for french intermediary sectors (columns)
-            - DataFrame with the imports of 'sector' from regions (rows) for french final demands (columns)
+            - DataFrame with the imports of 'sector' from regions (rows) for region's intermediary sectors (columns)
+            - DataFrame with the imports of 'sector' from regions (rows) for region's final demands (columns)
     """
 
     if reloc:
         regions = model.regions
     else:
-        regions = model.regions[1:]  # remove FR
+        regions = [reg for reg in model.regions if reg != region]
     Z = model.iot.Z
     Y = model.iot.Y
 
-    # french total importations demand for each sector / final demand
-    inter_imports = Z["FR"].drop("FR", level=0).groupby(level=1).sum().loc[sector]
-    final_imports = Y["FR"].drop("FR", level=0).groupby(level=1).sum().loc[sector]
+    # region's total importations demand for each sector / final demand
+    inter_imports = Z[region].drop(region, level=0).groupby(level=1).sum().loc[sector]
+    final_imports = Y[region].drop(region, level=0).groupby(level=1).sum().loc[sector]
     total_imports = inter_imports.sum() + final_imports.sum()
-    inter_autoconso_FR = (
-        Z.loc[("FR", sector), ("FR", slice(None))].groupby(level=1).sum()
+    inter_autoconso = (
+        Z.loc[(region, sector), (region, slice(None))].groupby(level=1).sum()
     )
-    final_autoconso_FR = (
-        Y.loc[("FR", sector), ("FR", slice(None))].groupby(level=1).sum()
+    final_autoconso = (
+        Y.loc[(region, sector), (region, slice(None))].groupby(level=1).sum()
     )
 
     # export capacities of each regions
@@ -66,28 +75,30 @@ def moves_from_sorted_index_by_sector(
     new_inter_imports = imports_from_regions.to_frame("").dot(
         (inter_imports / total_imports).to_frame("").T
     )
-    new_inter_imports.loc["FR"] += inter_autoconso_FR
+    new_inter_imports.loc[region] += inter_autoconso
 
     # allocations for final imports
     new_final_imports = imports_from_regions.to_frame("").dot(
         (final_imports / total_imports).to_frame("").T
     )
-    new_final_imports.loc["FR"] += final_autoconso_FR
+    new_final_imports.loc[region] += final_autoconso
 
     return new_inter_imports, new_final_imports
 
 
 def moves_from_sort_rule(
     model: Model,
-    sorting_rule_by_sector: Callable[[str, bool], List[int]],
+    sorting_rule_by_sector: Union[str, Callable[[Model, str, bool, str], List[int]]],
     reloc: bool = False,
+    region: str = "FR",
 ) -> Tuple[pd.DataFrame]:
-    """Allocates french importations for all sectors, sorting the regions with a given rule for each sector
+    """Allocates region's importations for all sectors, sorting the regions with a given rule for each sector
 
     Args:
         model (Model): object Model defined in model.py
-        sorting_rule_by_sector (Callable[[str, bool], List[int]]): given a sector name and the reloc value, returns a sorted list of regions' indices
+        sorting_rule_by_sector (Union[str, Callable[[Model, str, bool, str], List[int]]]): name of a criterion of the model's ranking index (see rankings.py), or function which, given the model, a sector name, the reloc value and the importing region, returns a sorted list of regions' indices
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -95,49 +106,341 @@ def moves_from_sort_rule(
             - reallocated Y matrix
     """
 
+    if isinstance(sorting_rule_by_sector, str):
+        sorting_rule_by_sector = sort_by_criterion(criterion=sorting_rule_by_sector)
     sectors_list = model.sectors
     new_Z = model.iot.Z.copy()
     new_Y = model.iot.Y.copy()
-    new_Z["FR"] = new_Z["FR"] * 0
-    new_Y["FR"] = new_Y["FR"] * 0
+    new_Z[region] = new_Z[region] * 0
+    new_Y[region] = new_Y[region] * 0
     for sector in sectors_list:
-        regions_index = sorting_rule_by_sector(model, sector, reloc)
+        regions_index = sorting_rule_by_sector(model, sector, reloc, region)
         new_inter_imports, new_final_imports = moves_from_sorted_index_by_sector(
-            model=model, sector=sector, regions_index=regions_index, reloc=reloc
+            model=model,
+            sector=sector,
+            regions_index=regions_index,
+            reloc=reloc,
+            region=region,
+        )
+        new_Z.loc[(slice(None), sector), (region, slice(None))] = (
+            new_inter_imports.values
+        )
+        new_Y.loc[(slice(None), sector), (region, slice(None))] = (
+            new_final_imports.values
         )
-        new_Z.loc[(slice(None), sector), ("FR", slice(None))] = new_inter_imports.values
-        new_Y.loc[(slice(None), sector), ("FR", slice(None))] = new_final_imports.values
     return new_Z, new_Y
 
 
-def sort_by_content(model: Model, sector: str, reloc: bool = False) -> np.array:
+def sort_by_criterion(criterion: str) -> Callable[[Model, str, bool, str], np.array]:
+    """Makes a sorting rule from a criterion of the model's ranking index
+
+    Args:
+        criterion (str): name of the criterion, see rankings.py
+
+    Returns:
+        Callable[[Model, str, bool, str], np.array]: sorting rule for moves_from_sort_rule
+    """
+
+    def sort_by_sector(
+        model: Model, sector: str, reloc: bool = False, region: str = "FR"
+    ) -> np.array:
+        return model.ranking_index(region=region).order(
+            criterion=criterion, sector=sector, reloc=reloc
+        )
+
+    return sort_by_sector
+
+
+def sort_by_content(
+    model: Model, sector: str, reloc: bool = False, region: str = "FR"
+) -> np.array:
     """Ascendantly sorts all regions by stressor content of a sector
 
     Args:
         model (Model): object Model defined in model.py
         sector (str): name of a product (or industry)
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
-
+        region (str, optional): importing region, left out if reloc is False. Defaults to "FR".
 
     Returns:
         np.array: array of indices of regions sorted by stressor content
     """
 
+    return model.ranking_index(region=region).order(
+        criterion="content", sector=sector, reloc=reloc
+    )
+
+
+### LINEAR PROGRAMMING REALLOCATION ###
+
+
+def imports_accounts(model: Model, reloc: bool = False, region: str = "FR") -> Dict:
+    """Computes region's importations and the export capacities of the trade partners for all sectors at once
+
+    Args:
+        model (Model): object Model defined in model.py
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Dict: with keys
+            - 'regions': possible trade partners
+            - 'inter_imports' and 'final_imports': region's importations by sector (rows) for region's intermediary sectors and final demands (columns)
+            - 'total_imports': region's importations by sector
+            - 'export_capacities': exports of each sector (columns) by each partner (rows) to the other regions
+    """
+
+    if reloc:
+        regions = model.regions
+    else:
+        regions = [reg for reg in model.regions if reg != region]
+    Z = model.iot.Z
+    Y = model.iot.Y
+
+    inter_imports = Z[region].drop(region, level=0).groupby(level=1).sum()
+    final_imports = Y[region].drop(region, level=0).groupby(level=1).sum()
+
+    # exports to all the regions minus the domestic uses
+    uses_by_region = Z.groupby(axis=1, level=0).sum() + Y.groupby(axis=1, level=0).sum()
+    uses_by_region = uses_by_region[model.regions]
+    domestic_uses = pd.Series(
+        uses_by_region.values[
+            np.arange(len(uses_by_region)),
+            np.repeat(np.arange(len(model.regions)), len(model.sectors)),
+        ],
+        index=uses_by_region.index,
+    )
+    export_capacities = (uses_by_region.sum(axis=1) - domestic_uses).unstack()
+
+    return {
+        "regions": regions,
+        "inter_imports": inter_imports.loc[model.sectors],
+        "final_imports": final_imports.loc[model.sectors],
+        "total_imports": (inter_imports.sum(axis=1) + final_imports.sum(axis=1)).loc[
+            model.sectors
+        ],
+        "export_capacities": export_capacities.loc[regions, model.sectors],
+    }
+
+
+@respect_thread_budget
+def moves_from_lp(
+    model: Model,
+    maximize: bool = False,
+    reloc: bool = False,
+    partner_caps: Dict[str, float] = None,
+    reloc_limit: float = None,
+    region: str = "FR",
+    accounts: Dict = None,
+) -> Tuple[pd.DataFrame]:
+    """Allocates region's importations for all sectors with one linear program minimizing (or maximizing) their stressor content
+
+    The imports of each product from each partner are bounded by the partner's export capacity, and their sum equals region's importations of the product (or the partners' total capacity if smaller), as in moves_from_sorted_index_by_sector.
+    Without partner_caps, the solution is the one of sort_by_content (up to ties).
+
+    Args:
+        model (Model): object Model defined in model.py
+        maximize (bool, optional): True to find the most stressor-intense allocation. Defaults to False.
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        partner_caps (Dict[str, float], optional): maximal share of region's importations (all sectors) coming from a partner, for each capped partner. Defaults to None.
+        reloc_limit (float, optional): maximal share of the importations of each sector relocated in region, if reloc. Defaults to None.
+        region (str, optional): importing region. Defaults to "FR".
+        accounts (Dict, optional): importations and export capacities, as returned by imports_accounts, computed from the model if None. Defaults to None.
+
+    Returns:
+        Tuple[pd.DataFrame]: tuple with 2 elements :
+            - reallocated Z matrix
+            - reallocated Y matrix
+    """
+
+    if accounts is None:
+        accounts = imports_accounts(model=model, reloc=reloc, region=region)
+    regions = accounts["regions"]
+    n_regions, n_sectors = len(regions), len(model.sectors)
+    capacities = accounts["export_capacities"].values.clip(min=0)
+    targets = np.minimum(accounts["total_imports"].values, capacities.sum(axis=0))
+
+    # variables: imports of each sector from each partner, flattened region-major
     M = model.iot.stressor_extension.M.sum(axis=0)
-    regions_index = np.argsort(M[:, sector].values[1 - reloc :])
-    return regions_index
+    costs = M.loc[regions].values.astype("float64") * (-1 if maximize else 1)
+    upper_bounds = capacities.copy()
+    if reloc and reloc_limit is not None:
+        upper_bounds[regions.index(region)] = np.minimum(
+            upper_bounds[regions.index(region)],
+            reloc_limit * accounts["total_imports"].values,
+        )
+
+    A_eq = sparse.kron(np.ones((1, n_regions)), sparse.identity(n_sectors))
+    A_ub, b_ub = None, None
+    if partner_caps:
+        rows = [regions.index(reg) for reg in partner_caps.keys()]
+        A_ub = sparse.kron(
+            sparse.identity(n_regions, format="csr")[rows], np.ones((1, n_sectors))
+        )
+        b_ub = np.array(list(partner_caps.values())) * targets.sum()
+
+    solution = linprog(
+        c=costs.ravel(),
+        A_ub=A_ub,
+        b_ub=b_ub,
+        A_eq=A_eq,
+        b_eq=targets,
+        bounds=np.stack([np.zeros(upper_bounds.size), upper_bounds.ravel()], axis=1),
+        method="highs",
+    )
+    if not solution.success:
+        raise ValueError(
+            f"No reallocation satisfies the constraints: {solution.message}"
+        )
+    imports_from_regions = pd.DataFrame(
+        solution.x.reshape(n_regions, n_sectors).clip(min=0),
+        index=regions,
+        columns=model.sectors,
+    ).reindex(model.regions, fill_value=0)
+
+    # the importations of each sector are split between region's uses as before
+    total_imports = accounts["total_imports"].values
+    shares = {
+        name: np.divide(
+            uses.values,
+            total_imports[:, None],
+            out=np.zeros(uses.shape),
+            where=total_imports[:, None] != 0,
+        )
+        for name, uses in [
+            ("Z", accounts["inter_imports"]),
+            ("Y", accounts["final_imports"]),
+        ]
+    }
+
+    new_Z = model.iot.Z.copy()
+    new_Y = model.iot.Y.copy()
+    for name, new_matrix in [("Z", new_Z), ("Y", new_Y)]:
+        new_uses = imports_from_regions.values[:, :, None] * shares[name][None, :, :]
+        new_matrix.loc[:, (region, slice(None))] = new_uses.reshape(
+            -1, shares[name].shape[1]
+        )
+        new_matrix.loc[(region, slice(None)), (region, slice(None))] += (
+            getattr(model.iot, name)
+            .loc[(region, slice(None)), (region, slice(None))]
+            .values
+        )
+    return new_Z, new_Y
+
+
+### CAPACITY-CONSISTENT SCENARIOS ###
+
+
+@respect_thread_budget
+def moves_capacity_consistent(
+    model: Model,
+    maximize: bool = False,
+    reloc: bool = False,
+    partner_caps: Dict[str, float] = None,
+    reloc_limit: float = None,
+    region: str = "FR",
+    tol: float = 1e-6,
+    max_iter: int = 50,
+    strict: bool = False,
+    verbose: bool = False,
+) -> Tuple[pd.DataFrame]:
+    """Allocates region's importations with moves_from_lp until the export capacities are consistent with the new productions
+
+    Export capacities are proportional to production. Each iteration reallocates the importations with the capacities of the previous production, then computes the new production with the reference technical coefficients, except region's ones which follow the reallocation.
+    The new production is obtained from the reference Leontief inverse through the Woodbury formula, the change of A being restricted to region's columns (matrix-free if the model has no L, see leontief.py).
+
+    Args:
+        model (Model): object Model defined in model.py
+        maximize (bool, optional): True to find the most stressor-intense allocation. Defaults to False.
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        partner_caps (Dict[str, float], optional): maximal share of region's importations coming from a partner, for each capped partner. Defaults to None.
+        reloc_limit (float, optional): maximal share of the importations of each sector relocated in region, if reloc. Defaults to None.
+        region (str, optional): importing region. Defaults to "FR".
+        tol (float, optional): maximal relative change of production between two iterations at convergence. Defaults to 1e-6.
+        max_iter (int, optional): maximal number of iterations. Defaults to 50.
+        strict (bool, optional): True to raise a RuntimeError if the iterations don't converge, a RuntimeWarning is issued otherwise. Defaults to False.
+        verbose (bool, optional): True to print infos. Defaults to False.
+
+    Returns:
+        Tuple[pd.DataFrame]: tuple with 2 elements :
+            - reallocated Z matrix, consistent with the new production
+            - reallocated Y matrix
+    """
+
+    iot = model.iot
+    accounts = imports_accounts(model=model, reloc=reloc, region=region)
+    reference_capacities = accounts["export_capacities"]
+    leontief = leontief_operator(iot=iot, method=model.solver)
+    A = iot.A.values
+    x_ref = iot.x["indout"].values
+    region_cols = iot.Z.columns.get_locs([region])
+    inv_x_ref = np.divide(1, x_ref, out=np.zeros_like(x_ref), where=x_ref != 0)
+    growth_ref = pd.Series(1.0, index=iot.x.index)
+
+    x = x_ref
+    change = np.inf
+    for iteration in range(max_iter):
+
+        # capacities of the previous production, warm-starting from the last iteration
+        growth = pd.Series(x * inv_x_ref, index=iot.x.index).where(
+            x_ref != 0, growth_ref
+        )
+        accounts["export_capacities"] = (
+            reference_capacities
+            * growth.unstack().loc[
+                reference_capacities.index, reference_capacities.columns
+            ]
+        )
+        new_Z, new_Y = moves_from_lp(
+            model=model,
+            maximize=maximize,
+            reloc=reloc,
+            partner_caps=partner_caps,
+            reloc_limit=reloc_limit,
+            region=region,
+            accounts=accounts,
+        )
+
+        # x = (I - A - U V')^-1 y with U the change of region's columns of A
+        U = new_Z.values[:, region_cols] * inv_x_ref[region_cols] - A[:, region_cols]
+        w = leontief(new_Y.values.sum(axis=1))
+        LU = leontief(U)
+        new_x = w + LU @ np.linalg.solve(
+            np.eye(len(region_cols)) - LU[region_cols], w[region_cols]
+        )
+
+        change = np.abs(new_x - x).max() / np.abs(x).max()
+        x = new_x
+        if verbose:
+            print(
+                f"Iteration {iteration + 1}: relative change of production {change:.2e}"
+            )
+        if change <= tol:
+            break
+    else:
+        message = f"Capacity-consistent reallocation did not converge in {max_iter} iterations (relative change of production {change:.2e})"
+        if strict:
+            raise RuntimeError(message)
+        warnings.warn(message, RuntimeWarning)
+
+    # flows consistent with the new production
+    new_A = A.copy()
+    new_A[:, region_cols] += U
+    new_Z = pd.DataFrame(new_A * x, index=iot.Z.index, columns=iot.Z.columns)
+    return new_Z, new_Y
 
 
 ### BEST AND WORST SCENARIOS ###
 
 
-def scenar_best(model: Model, reloc: bool = False) -> Dict:
+def scenar_best(model: Model, reloc: bool = False, region: str = "FR") -> Dict:
     """Finds the least stressor-intense imports reallocation for all sectors
 
 
     Args:
         model (Model): object Model defined in model.py
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -145,18 +448,17 @@ def scenar_best(model: Model, reloc: bool = False) -> Dict:
             - reallocated Y matrix
     """
 
-    return moves_from_sort_rule(
-        model=model, sorting_rule_by_sector=sort_by_content, reloc=reloc
-    )
+    return moves_from_lp(model=model, reloc=reloc, region=region)
 
 
-def scenar_worst(model: Model, reloc: bool = False) -> Dict:
+def scenar_worst(model: Model, reloc: bool = False, region: str = "FR") -> Dict:
     """Finds the most stressor-intense imports reallocation for all sectors
 
 
     Args:
         model (Model): object Model defined in model.py
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -164,23 +466,62 @@ def scenar_worst(model: Model, reloc: bool = False) -> Dict:
             - reallocated Y matrix
     """
 
-    return moves_from_sort_rule(
-        model=model,
-        sorting_rule_by_sector=lambda *args: sort_by_content(*args)[::-1],
-        reloc=reloc,
+    return moves_from_lp(model=model, maximize=True, reloc=reloc, region=region)
+
+
+def scenar_best_capacity_consistent(
+    model: Model, reloc: bool = False, region: str = "FR"
+) -> Dict:
+    """Finds the least stressor-intense imports reallocation for all sectors, with export capacities consistent with the new productions
+
+    Args:
+        model (Model): object Model defined in model.py
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Tuple[pd.DataFrame]: tuple with 2 elements :
+            - reallocated Z matrix
+            - reallocated Y matrix
+    """
+
+    return moves_capacity_consistent(model=model, reloc=reloc, region=region)
+
+
+def scenar_worst_capacity_consistent(
+    model: Model, reloc: bool = False, region: str = "FR"
+) -> Dict:
+    """Finds the most stressor-intense imports reallocation for all sectors, with export capacities consistent with the new productions
+
+    Args:
+        model (Model): object Model defined in model.py
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
+
+    Returns:
+        Tuple[pd.DataFrame]: tuple with 2 elements :
+            - reallocated Z matrix
+            - reallocated Y matrix
+    """
+
+    return moves_capacity_consistent(
+        model=model, maximize=True, reloc=reloc, region=region
     )
 
 
 ### PREFERENCE SCENARIOS ###
 
 
-def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
+def scenar_pref(
+    model, allies: List[str], reloc: bool = False, region: str = "FR"
+) -> Dict:
     """Finds imports reallocation in order to trade as much as possible with the allies
 
     Args:
         model (Model): object Model defined in model.py
         allies (List[str]): list of regions' names
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -190,15 +531,16 @@ def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
 
     if reloc:
         regions = model.regions
-        if not "FR" in allies:
-            allies += ["FR"]
+        if not region in allies:
+            allies = allies + [region]
     else:
-        regions = model.regions[1:]  # remove FR
+        regions = [reg for reg in model.regions if reg != region]
+        allies = [reg for reg in allies if reg != region]
 
     new_Z = model.iot.Z.copy()
     new_Y = model.iot.Y.copy()
-    new_Z["FR"] = new_Z["FR"] * 0
-    new_Y["FR"] = new_Y["FR"] * 0
+    new_Z[region] = new_Z[region] * 0
+    new_Y[region] = new_Y[region] * 0
 
     sectors = model.sectors
 
@@ -211,9 +553,9 @@ def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
             axis=1, level=0
         ) + sector_exports_Y.sum(axis=1, level=0)
 
-        ## french importations
-        sector_imports_FR_Z = sector_exports_Z["FR"]
-        sector_imports_FR_Y = sector_exports_Y["FR"]
+        ## region's importations
+        sector_imports_FR_Z = sector_exports_Z[region]
+        sector_imports_FR_Y = sector_exports_Y[region]
         sector_imports_FR_nonallies_Z = sector_imports_FR_Z.drop(allies).sum()
         sector_imports_FR_nonallies_Y = sector_imports_FR_Y.drop(allies).sum()
         total_imports_FR_nonallies = (
@@ -222,26 +564,26 @@ def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
 
         ## allies' exportation capacities
         allies_export_except_FR = (
-            sector_exports_by_region.loc[allies].drop(columns=["FR"]).sum(axis=1)
+            sector_exports_by_region.loc[allies].drop(columns=[region]).sum(axis=1)
         )
         allies_autoexport = pd.Series(
             np.diagonal(sector_exports_by_region.loc[allies, allies]),
             index=allies,
         )
         allies_export_capacity = allies_export_except_FR.add(
-            -allies_autoexport.drop("FR", errors="ignore"), fill_value=0
+            -allies_autoexport.drop(region, errors="ignore"), fill_value=0
         )  # .add() handles the possible values of reloc
         allies_total_export_capacity = allies_export_capacity.sum()
 
         ## specific case leading to a division by 0
         if total_imports_FR_nonallies == 0 and allies_total_export_capacity == 0:
             for reg in regions:
-                new_Z.loc[(reg, sector), ("FR", slice(None))] = sector_imports_FR_Z.loc[
-                    reg
-                ].values
-                new_Y.loc[(reg, sector), ("FR", slice(None))] = sector_imports_FR_Y.loc[
-                    reg
-                ].values
+                new_Z.loc[(reg, sector), (region, slice(None))] = (
+                    sector_imports_FR_Z.loc[reg].values
+                )
+                new_Y.loc[(reg, sector), (region, slice(None))] = (
+                    sector_imports_FR_Y.loc[reg].values
+                )
             continue
 
         ## reallocations
@@ -256,11 +598,11 @@ def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
 
             for reg in regions:
                 if reg in allies:
-                    new_Z.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Z.loc[(reg, sector), (region, slice(None))] = (
                         sector_imports_FR_Z.loc[reg]
                         + coef_Z * allies_export_capacity[reg]
                     ).values
-                    new_Y.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Y.loc[(reg, sector), (region, slice(None))] = (
                         sector_imports_FR_Y.loc[reg]
                         + coef_Y * allies_export_capacity[reg]
                     ).values
@@ -289,37 +631,38 @@ def scenar_pref(model, allies: List[str], reloc: bool = False) -> Dict:
 
             for reg in regions:
                 if reg not in allies:
-                    new_Z.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Z.loc[(reg, sector), (region, slice(None))] = (
                         coef_nonallies * sector_imports_FR_Z.loc[reg]
                     ).values
-                    new_Y.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Y.loc[(reg, sector), (region, slice(None))] = (
                         coef_nonallies * sector_imports_FR_Y.loc[reg]
                     ).values
                 else:
-                    new_Z.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Z.loc[(reg, sector), (region, slice(None))] = (
                         coef_allies_Z.loc[reg] * sector_imports_FR_Z.loc[reg]
                     ).values
-                    new_Y.loc[(reg, sector), ("FR", slice(None))] = (
+                    new_Y.loc[(reg, sector), (region, slice(None))] = (
                         coef_allies_Y.loc[reg] * sector_imports_FR_Y.loc[reg]
                     ).values
 
     ## process autoproduction
-    new_Z.loc[("FR", slice(None)), ("FR", slice(None))] += model.iot.Z.loc[
-        ("FR", slice(None)), ("FR", slice(None))
+    new_Z.loc[(region, slice(None)), (region, slice(None))] += model.iot.Z.loc[
+        (region, slice(None)), (region, slice(None))
     ].values
-    new_Y.loc[("FR", slice(None)), ("FR", slice(None))] += model.iot.Y.loc[
-        ("FR", slice(None)), ("FR", slice(None))
+    new_Y.loc[(region, slice(None)), (region, slice(None))] += model.iot.Y.loc[
+        (region, slice(None)), (region, slice(None))
     ].values
 
     return new_Z, new_Y
 
 
-def scenar_pref_eu(model: Model, reloc: bool = False) -> Dict:
+def scenar_pref_eu(model: Model, reloc: bool = False, region: str = "FR") -> Dict:
     """Finds imports reallocation that prioritize trade with European Union
 
     Args:
         model (Model): object Model defined in model.py
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -327,19 +670,22 @@ def scenar_pref_eu(model: Model, reloc: bool = False) -> Dict:
             - reallocated Y matrix
     """
 
-    return scenar_pref(model=model, allies=["EU"], reloc=reloc)
+    return scenar_pref(model=model, allies=["EU"], reloc=reloc, region=region)
 
 
 ### TRADE WAR SCENARIOS ###
 
 
-def scenar_tradewar(model: Model, opponents: List[str], reloc: bool = False) -> Dict:
+def scenar_tradewar(
+    model: Model, opponents: List[str], reloc: bool = False, region: str = "FR"
+) -> Dict:
     """Finds imports reallocation in order to exclude a list of opponents as much as possible
 
     Args:
         model (Model): object Model defined in model.py
         opponents (List[str]): list of regions' names
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -347,19 +693,22 @@ def scenar_tradewar(model: Model, opponents: List[str], reloc: bool = False) ->
             - reallocated Y matrix
     """
 
-    allies = list(set(model.regions) - set(opponents))
-    if not reloc:
-        allies.remove("FR")
-    return scenar_pref(model=model, allies=allies, reloc=reloc)
+    allies = list(
+        set(model.regions) - set(opponents)
+    )  # region removed by scenar_pref if not reloc
+    return scenar_pref(model=model, allies=allies, reloc=reloc, region=region)
 
 
-def scenar_tradewar_china(model: Model, reloc: bool = False) -> Dict:
+def scenar_tradewar_china(
+    model: Model, reloc: bool = False, region: str = "FR"
+) -> Dict:
     """Finds imports reallocation that prevents trade with China as much as possible
 
 
     Args:
         model (Model): object Model defined in model.py
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        region (str, optional): importing region. Defaults to "FR".
 
     Returns:
         Tuple[pd.DataFrame]: tuple with 2 elements :
@@ -368,10 +717,80 @@ def scenar_tradewar_china(model: Model, reloc: bool = False) -> Dict:
     """
 
     return scenar_tradewar(
-        model=model, opponents=["China, RoW Asia and Pacific"], reloc=reloc
+        model=model,
+        opponents=["China, RoW Asia and Pacific"],
+        reloc=reloc,
+        region=region,
     )
 
 
+### ALL-REGIONS BATCH ###
+
+
+@respect_thread_budget
+def footprints_all_regions(
+    model: Model,
+    scenar_function: Callable[[Model, bool, str], Tuple[pd.DataFrame]],
+    regions: List[str] = None,
+    reloc: bool = False,
+    verbose: bool = False,
+) -> pd.DataFrame:
+    """Computes each region's footprint when it applies a scenario to its own importations, without building one counterfactual per region
+
+    The counterfactual of each region is the one of build_counterfactual_data: the productions are the sums of the new flows and all the technical coefficients are computed again from them, so that the footprints are those of footprint_extractor on the counterfactuals.
+    Only the production induced by the region's final demand is solved for, once per region, instead of the Leontief inverse and the account matrices of every counterfactual.
+    Without L (matrix-free solvers, see leontief.py), the solves are matrix-free too.
+
+    Args:
+        model (Model): object Model defined in model.py
+        scenar_function (Callable[[Model, bool, str], Tuple[pd.DataFrame]]): builds the new Z and Y matrices given the model, reloc and the importing region
+        regions (List[str], optional): regions applying the scenario, all of them if None. Defaults to None.
+        reloc (bool, optional): True if relocation is allowed. Defaults to False.
+        verbose (bool, optional): True to print infos. Defaults to False.
+
+    Returns:
+        pd.DataFrame: values of -D_exp, D_pba, D_imp and F_Y (columns) for each region (rows), as in footprint_extractor
+    """
+
+    if regions is None:
+        regions = model.regions
+    iot = model.iot
+    s = iot.stressor_extension.S.values.sum(axis=0).astype("float64")
+
+    footprints = {}
+    for region in regions:
+        if verbose:
+            print(f"Scenario for {region}")
+        new_Z, new_Y = scenar_function(model=model, reloc=reloc, region=region)
+        Z = new_Z.values.astype("float64")
+        y_region = new_Y[region].values.sum(axis=1).astype("float64")
+
+        # productions and coefficients of the counterfactual, as pymrio computes them from Z and Y
+        x = Z.sum(axis=1) + new_Y.values.sum(axis=1)
+        inv_x = np.divide(1, x, out=np.zeros_like(x), where=x != 0)
+        A = Z * inv_x
+        if iot.L is None:
+            x_region = LeontiefSolver(A=pd.DataFrame(A), method=model.solver).solve(
+                y_region
+            )
+        else:
+            x_region = np.linalg.solve(np.eye(len(A)) - A, y_region)
+
+        # production of region's sectors for the whole final demand, and the part for its own
+        cols = iot.Z.columns.get_locs([region])
+        production = s[cols] @ x[cols]
+        domestic = s[cols] @ x_region[cols]
+
+        footprints[region] = {
+            "Exportations": -(production - domestic),
+            "Production": production,
+            "Importations": s @ x_region - domestic,
+            "Consommation": iot.stressor_extension.F_Y[region].values.sum(),
+        }
+
+    return pd.DataFrame.from_dict(footprints, orient="index")
+
+
 ### AVAILABLE SCENARIOS ###
 
 DICT_SCENARIOS = {
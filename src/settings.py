@@ -1,10 +1,7 @@
-import matplotlib.pyplot as plt
-import numpy as np
 import os
 import pathlib
 import sys
 
-
 ### LOCAL PATHS ###
 
 
@@ -19,20 +16,43 @@ MODELS_DIR = DATA_DIR / "models"
 FIGURES_DIR = BASE_DIR / "figures"
 FIGURES_MULTIMODEL_DIR = FIGURES_DIR / "multimodel"
 
-for path in [
-    DATA_DIR,
-    CAPITAL_CONS_DIR,
-    EXIOBASE_DIR,
-    MODELS_DIR,
-    FIGURES_DIR,
-    FIGURES_MULTIMODEL_DIR,
-]:
-    if not os.path.isdir(path):
-        os.mkdir(path)
+# directories are created when first needed, see create_dir
+
+
+def create_dir(path: pathlib.PosixPath) -> pathlib.PosixPath:
+    """Creates a directory and its parents if they don't exist yet
+
+    Args:
+        path (pathlib.PosixPath): directory to create
+
+    Returns:
+        pathlib.PosixPath: the same directory
+    """
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+### NUMERICAL PRECISION ###
+# floating point types available for the matrices of the models, float32 halves the memory footprint
+
+PRECISIONS = ["float64", "float32"]
 
 
 ### COLORS ###
-COLORS = list(plt.cm.tab10(np.arange(10))) + ["gold"]
+# matplotlib's tab10 palette, written out so that the compute path doesn't import matplotlib
+COLORS = [
+    "#1f77b4",
+    "#ff7f0e",
+    "#2ca02c",
+    "#d62728",
+    "#9467bd",
+    "#8c564b",
+    "#e377c2",
+    "#7f7f7f",
+    "#bcbd22",
+    "#17becf",
+    "gold",
+]
 COLORS_NO_FR = COLORS[1:]
 
 
@@ -0,0 +1,200 @@
+"""Cache of the calibration stages, keyed by content hashes of their inputs
+
+Each stage's key hashes its own inputs (file contents, parameters) with the key of the stage it starts from, so that changing an input only invalidates the stages downstream of it.
+The outputs are checkpointed in data/stages through temporary files renamed into place, so that an interrupted calibration resumes from the last stage completed. This directory can be deleted at any time to free disk space.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import pickle as pkl
+from typing import Callable, Dict
+
+from src.persistence import atomic_write, file_lock
+from src.settings import DATA_DIR, create_dir
+
+STAGES_DIR = DATA_DIR / "stages"
+FILE_DIGESTS_FILE_NAME = "file_digests.json"
+STAGE_KEYS_FILE_NAME = "stages.json"
+CHUNK_SIZE = 2**24
+
+
+### HASHES ###
+
+
+def read_file_digests(digests_path: pathlib.PosixPath) -> Dict[str, Dict]:
+    """Reads the cache of the file digests
+
+    Args:
+        digests_path (pathlib.PosixPath): JSON file of the cache
+
+    Returns:
+        Dict[str, Dict]: size, modification time and digest of each file, by path
+    """
+    if not os.path.isfile(digests_path):
+        return {}
+    with open(digests_path, "r") as f:
+        return json.load(f)
+
+
+def file_digest(path: pathlib.PosixPath) -> str:
+    """Hashes the content of a file, reusing the digest computed before if the file's size and modification time haven't changed
+
+    Args:
+        path (pathlib.PosixPath): file to hash
+
+    Returns:
+        str: sha256 digest of the content
+    """
+    path = pathlib.Path(path).resolve()
+    stat = os.stat(path)
+    digests_path = STAGES_DIR / FILE_DIGESTS_FILE_NAME
+    known = read_file_digests(digests_path=digests_path).get(str(path))
+    if (
+        known is not None
+        and known["size"] == stat.st_size
+        and known["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return known["digest"]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+
+    # other processes may have added digests since the cache was read
+    create_dir(STAGES_DIR)
+    with file_lock(digests_path.with_name(f".{digests_path.name}.lock")):
+        digests = read_file_digests(digests_path=digests_path)
+        digests[str(path)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "digest": sha.hexdigest(),
+        }
+        atomic_write(
+            path=digests_path,
+            write=lambda f: json.dump(digests, f, indent=2),
+            mode="w",
+        )
+    return sha.hexdigest()
+
+
+def stage_key(stage: str, parent_key: str = None, **inputs) -> str:
+    """Hashes the inputs of a stage together with the key of the stage it starts from
+
+    Args:
+        stage (str): name of the stage
+        parent_key (str, optional): key of the upstream stage, None for the first one. Defaults to None.
+        **inputs: JSON-serializable inputs of the stage (file digests, parameters)
+
+    Returns:
+        str: key of the stage
+    """
+    content = json.dumps(
+        {"stage": stage, "parent": parent_key, "inputs": inputs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+### CACHE ###
+
+
+def stage_path(
+    stage: str, key: str, cache_dir: pathlib.PosixPath = None
+) -> pathlib.PosixPath:
+    """Formats the path of a stage's output
+
+    Args:
+        stage (str): name of the stage
+        key (str): key of the stage, see stage_key
+        cache_dir (pathlib.PosixPath, optional): directory of the output, data/stages if None. Defaults to None.
+
+    Returns:
+        pathlib.PosixPath: path of the pickled output
+    """
+    if cache_dir is None:
+        cache_dir = STAGES_DIR
+    return pathlib.Path(cache_dir) / f"{stage}__{key}.pickle"
+
+
+def cached_stage(
+    stage: str,
+    key: str,
+    compute: Callable,
+    cache_dir: pathlib.PosixPath = None,
+    force: bool = False,
+):
+    """Loads the output of a stage if it has already been computed with the same inputs, or computes and saves it
+
+    Args:
+        stage (str): name of the stage
+        key (str): key of the stage, see stage_key
+        compute (Callable): computes the output of the stage, without argument
+        cache_dir (pathlib.PosixPath, optional): directory of the output, data/stages if None. Defaults to None.
+        force (bool, optional): True to compute the output even if it is cached. Defaults to False.
+
+    Returns:
+        Any: output of the stage
+    """
+    path = stage_path(stage=stage, key=key, cache_dir=cache_dir)
+    if not force and os.path.isfile(path):
+        with open(path, "rb") as f:
+            return pkl.load(f)
+
+    # single flight: a process computing the same stage holds the lock, the others wait and load its output
+    with file_lock(path.with_name(f".{path.name}.lock")):
+        if not force and os.path.isfile(path):
+            with open(path, "rb") as f:
+                return pkl.load(f)
+        output = compute()
+        atomic_write(path=path, write=lambda f: pkl.dump(output, f, protocol=4))
+    return output
+
+
+def discard_stage(stage: str, key: str, cache_dir: pathlib.PosixPath = None) -> None:
+    """Deletes the output of a stage, once it isn't needed anymore
+
+    Args:
+        stage (str): name of the stage
+        key (str): key of the stage, see stage_key
+        cache_dir (pathlib.PosixPath, optional): directory of the output, data/stages if None. Defaults to None.
+    """
+    path = stage_path(stage=stage, key=key, cache_dir=cache_dir)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+### CALIBRATED MODELS ###
+
+
+def read_stage_keys(model_dir: pathlib.PosixPath) -> Dict:
+    """Reads the keys of the stages the calibrated model of model_dir was built from
+
+    Args:
+        model_dir (pathlib.PosixPath): directory of the calibrated model
+
+    Returns:
+        Dict: stage keys by stage name, None if unknown
+    """
+    path = pathlib.Path(model_dir) / STAGE_KEYS_FILE_NAME
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_stage_keys(model_dir: pathlib.PosixPath, keys: Dict) -> None:
+    """Records the keys of the stages a calibrated model was built from
+
+    Args:
+        model_dir (pathlib.PosixPath): directory of the calibrated model
+        keys (Dict): stage keys by stage name
+    """
+    atomic_write(
+        path=pathlib.Path(model_dir) / STAGE_KEYS_FILE_NAME,
+        write=lambda f: json.dump(keys, f, indent=2),
+        mode="w",
+    )
@@ -1,3 +1,5 @@
+from typing import Dict
+
 GHG_PARAMS = {
     "name_FR": "GES",
     "name_EN": "GHG",
@@ -257,3 +259,18 @@ LANDUSE_PARAMS = {
         "autres usages": {"exiobase_keys": ["Other land Use: Total"], "weight": 1},
     },
 }
+
+
+### FILE NAMES ###
+
+
+def stressor_shortname(stressor_params: Dict) -> str:
+    """Formats the english name of a stressor for file paths, as in the names of the models, panels and jobs
+
+    Args:
+        stressor_params (Dict): dictionnary with the stressors' french name, english name, unit and a proxy
+
+    Returns:
+        str: lowercase alphanumeric name, e.g. 'ghg'
+    """
+    return "".join(filter(str.isalnum, stressor_params["name_EN"].lower()))
@@ -0,0 +1,113 @@
+"""Structural path analysis of a region's footprint
+
+The footprint of a final demand y is s L y = sum over paths of s_i0 A_i0i1 ... A_ik-1ik y_ik, each path going upstream from a product of the final demand (ik) to the sector emitting (i0).
+The paths are enumerated best-first from the final demand with a priority queue: a partial path ending upstream at j with value v can't lead to more than m_j v, m = s L being the multipliers, so branches below the threshold (or below the k-th best path found) are pruned.
+"""
+
+import heapq
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+from src.leontief import leontief_operator
+
+
+def structural_path_analysis(
+    model,
+    region: str = "FR",
+    n_paths: int = 100,
+    threshold: float = 1e-4,
+    max_depth: int = 6,
+    imported: bool = True,
+) -> pd.DataFrame:
+    """Finds the supply chain paths carrying the largest emissions into region's final demand
+
+    Args:
+        model (Union[Model, Counterfactual]): object Model or Counterfactual defined in model.py
+        region (str, optional): region whose final demand ends the paths. Defaults to "FR".
+        n_paths (int, optional): number of paths to return. Defaults to 100.
+        threshold (float, optional): paths and branches below this share of the (imported) footprint are pruned. Defaults to 1e-4.
+        max_depth (int, optional): maximal number of production stages before the final demand. Defaults to 6.
+        imported (bool, optional): True to keep only the emissions from outside region (D_imp), False for the whole footprint without F_Y (D_cba). Defaults to True.
+
+    Returns:
+        pd.DataFrame: paths sorted by decreasing value, with their value, share of the (imported) footprint, depth, emitting sector and path from the emitting sector to the final demand
+    """
+    iot = model.iot
+    nodes = iot.A.index
+    A_columns = np.ascontiguousarray(iot.A.values.T, dtype="float64")
+    s = iot.stressor_extension.S.values.sum(axis=0).astype("float64")
+    if imported:
+        s = s * (nodes.get_level_values(0) != region)
+    # models and counterfactuals saved before the matrix-free solvers have no solver
+    m = leontief_operator(iot=iot, method=getattr(model, "solver", "dense"))(
+        s, transpose=True
+    )
+    y = iot.Y[region].values.sum(axis=1).astype("float64")
+    total = float(m @ y)
+    threshold = threshold * total
+
+    # partial paths as (-upper bound, counter, path from final demand upstream, value)
+    counter = 0
+    queue = []
+    for j in np.flatnonzero(m * y >= threshold):
+        queue.append((-m[j] * y[j], counter, (j,), y[j]))
+        counter += 1
+    heapq.heapify(queue)
+
+    best = []  # min-heap of (value, counter, path)
+    while queue:
+        bound, _, path, value = heapq.heappop(queue)
+        floor = best[0][0] if len(best) == n_paths else threshold
+        if -bound < floor:
+            break
+
+        j = path[-1]
+        emissions = s[j] * value
+        if emissions >= floor:
+            heapq.heappush(best, (emissions, counter, path))
+            counter += 1
+            if len(best) > n_paths:
+                heapq.heappop(best)
+
+        if len(path) <= max_depth:
+            children_values = A_columns[j] * value
+            children_bounds = children_values * m
+            for i in np.flatnonzero(children_bounds >= floor):
+                heapq.heappush(
+                    queue,
+                    (-children_bounds[i], counter, path + (i,), children_values[i]),
+                )
+                counter += 1
+
+    rows = []
+    for emissions, _, path in sorted(best, reverse=True):
+        rows.append(
+            {
+                "value": emissions,
+                "share": emissions / total,
+                "depth": len(path) - 1,
+                "emitting_region": nodes[path[-1]][0],
+                "emitting_sector": nodes[path[-1]][1],
+                "path": " -> ".join(
+                    f"{nodes[i][0]}/{nodes[i][1]}" for i in reversed(path)
+                ),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def paths_coverage(paths: pd.DataFrame) -> Dict:
+    """Summarizes how much of the footprint the paths explain
+
+    Args:
+        paths (pd.DataFrame): paths returned by structural_path_analysis
+
+    Returns:
+        Dict: number of paths, share of the footprint they cover, and share covered by each depth
+    """
+    return {
+        "paths": len(paths),
+        "coverage": paths["share"].sum(),
+        "coverage_by_depth": paths.groupby("depth")["share"].sum().to_dict(),
+    }
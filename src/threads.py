@@ -0,0 +1,115 @@
+"""Budget of BLAS threads, shared between worker processes and the multithreaded linear algebra
+
+The Leontief inversion, the products with L and the pandas matrix products run on a multithreaded BLAS, which by default uses all the cores.
+When several models are built in parallel processes, each process must use only its share of the cores, otherwise the threads oversubscribe them.
+The budget is kept in an environment variable, so that it is inherited by the worker processes, and applied with threadpoolctl around each compute entry point (see respect_thread_budget).
+Without threadpoolctl, only the BLAS environment variables are set, which affect the processes started afterwards.
+"""
+
+import os
+import warnings
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+THREAD_BUDGET_ENV_VAR = "MATMAT_BLAS_THREADS"
+BLAS_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def available_cores() -> int:
+    """Counts the cores the current process may run on
+
+    Returns:
+        int: number of cores
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_cores(workers: int, cores: int = None) -> int:
+    """Splits cores between worker processes
+
+    Args:
+        workers (int): number of worker processes
+        cores (int, optional): number of cores to share, all the available ones if None. Defaults to None.
+
+    Returns:
+        int: number of BLAS threads of each worker
+    """
+    if cores is None:
+        cores = available_cores()
+    return max(1, cores // max(1, workers))
+
+
+def get_thread_budget() -> int:
+    """Reads the BLAS threads budget of the current process
+
+    Returns:
+        int: number of BLAS threads, None if no budget is set
+    """
+    threads = os.environ.get(THREAD_BUDGET_ENV_VAR)
+    return None if threads is None else int(threads)
+
+
+def set_thread_budget(threads: int) -> None:
+    """Sets the BLAS threads budget of the current process and of the processes it starts
+
+    Args:
+        threads (int): number of BLAS threads
+    """
+    os.environ[THREAD_BUDGET_ENV_VAR] = str(threads)
+    for name in BLAS_ENV_VARS:
+        os.environ[name] = str(threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=threads, user_api="blas")
+    else:
+        # the BLAS of the current process has already read the environment variables
+        warnings.warn(
+            "threadpoolctl isn't installed, the budget of BLAS threads only applies to the processes started afterwards",
+            RuntimeWarning,
+        )
+
+
+@contextmanager
+def thread_budget(threads: int) -> Iterator[None]:
+    """Limits the BLAS threads within a block
+
+    Args:
+        threads (int): number of BLAS threads, no limit if None
+    """
+    if threads is None or threadpool_limits is None:
+        yield
+    else:
+        with threadpool_limits(limits=threads, user_api="blas"):
+            yield
+
+
+def respect_thread_budget(function: Callable) -> Callable:
+    """Decorates a compute entry point so that it runs within the budget of BLAS threads, if one is set
+
+    Args:
+        function (Callable): function to decorate
+
+    Returns:
+        Callable: decorated function
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with thread_budget(threads=get_thread_budget()):
+            return function(*args, **kwargs)
+
+    return wrapper
@@ -2,17 +2,34 @@ import os
 import numpy as np
 import pandas as pd
 import pathlib
-import pickle as pkl
-import pycountry
 import pymrio
 from pymrio.tools import ioutil
-from scipy.io import loadmat
-from typing import Dict
+from pymrio.tools.iomath import calc_S
+from typing import Dict, List, Tuple, Union
 import warnings
-import wget
-
-from src.settings import AGGREGATION_DIR
 
+from src.counterfactual_iot import (
+    ACCOUNTS,
+    CounterfactualExtension,
+    CounterfactualIOSystem,
+)
+from src.downloads import EXIOBASE_DOI
+from src.leontief import LeontiefSolver, calc_accounts
+from src.persistence import atomic_write_dir
+from src.profiling import span
+from src.settings import AGGREGATION_DIR, PRECISIONS, create_dir
+from src.stages import (
+    STAGES_DIR,
+    cached_stage,
+    discard_stage,
+    file_digest,
+    read_stage_keys,
+    stage_key,
+    stage_path,
+    write_stage_keys,
+)
+from src.threads import respect_thread_budget
+from src.validation import supply_use_balance
 
 # remove pandas warning related to pymrio future deprecations
 warnings.simplefilter(action="ignore", category=FutureWarning)
@@ -23,24 +40,40 @@ warnings.simplefilter(action="ignore", category=FutureWarning)
 
 def recal_stressor_per_region(
     iot: pymrio.IOSystem,
+    solver: str = "dense",
 ) -> pymrio.core.mriosystem.Extension:
     """Computes the account matrices D_cba, D_pba, D_imp and D_exp
        Based on pymrio.tools.iomath's function 'calc_accounts', see https://github.com/konstantinstadler/pymrio
 
     Args:
         iot (pymrio.IOSystem): pymrio MRIO object
+        solver (str, optional): Leontief solver, 'dense' multiplies with L, the others don't need it (see leontief.py). Defaults to 'dense'.
 
     Returns:
         pymrio.core.mriosystem.Extension: extension with account matrices completed
     """
     extension = iot.stressor_extension.copy()
 
+    if solver != "dense":
+        accounts = calc_accounts(
+            S=extension.S,
+            Y=iot.Y,
+            solver=LeontiefSolver(A=iot.A, method=solver),
+        )
+        for name in ["D_cba", "D_pba", "D_imp", "D_exp"]:
+            setattr(extension, name, accounts[name])
+        return extension
+
     S = iot.stressor_extension.S
     L = iot.L
     Y_vect = iot.Y.sum(level=0, axis=1)
     nbsectors = len(iot.get_sectors())
 
-    Y_diag = ioutil.diagonalize_blocks(Y_vect.values, blocksize=nbsectors)
+    # same as ioutil.diagonalize_blocks, keeping the precision of Y
+    Y_diag = np.zeros((len(Y_vect), len(Y_vect)), dtype=Y_vect.values.dtype)
+    rows = np.arange(len(Y_vect))
+    for col, reg in enumerate(Y_vect.columns):
+        Y_diag[rows, col * nbsectors + rows % nbsectors] = Y_vect[reg].values
     Y_diag = pd.DataFrame(Y_diag, index=Y_vect.index, columns=Y_vect.index)
     x_diag = L.dot(Y_diag)
 
@@ -64,7 +97,7 @@ def recal_stressor_per_region(
     )
 
     # for the traded accounts set the domestic industry output to zero
-    dom_block = np.zeros((nbsectors, nbsectors))
+    dom_block = np.zeros((nbsectors, nbsectors), dtype=x_diag.values.dtype)
     x_trade = pd.DataFrame(
         ioutil.set_block(x_diag.values, dom_block),
         index=x_diag.index,
@@ -88,6 +121,107 @@ def recal_stressor_per_region(
     return extension
 
 
+def check_precision(precision: str) -> np.dtype:
+    """Checks that a precision is available for the models
+
+    Args:
+        precision (str): name of a floating point type ('float64' or 'float32')
+
+    Returns:
+        np.dtype: corresponding numpy type
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"the precision {precision} is unknown, it must be one of {PRECISIONS}."
+        )
+    return np.dtype(precision)
+
+
+def cast_iot(iot: pymrio.IOSystem, precision: str) -> pymrio.IOSystem:
+    """Converts all the numerical matrices of a pymrio object and of its extensions to a given precision
+
+    Args:
+        iot (pymrio.IOSystem): pymrio MRIO object
+        precision (str): name of a floating point type ('float64' or 'float32')
+
+    Returns:
+        pymrio.IOSystem: pymrio object with matrices of the given precision
+    """
+    dtype = check_precision(precision)
+    for obj in [iot] + list(iot.get_extensions(data=True)):
+        for name in list(
+            obj.get_DataFrame(data=False, with_unit=False, with_population=False)
+        ):
+            df = getattr(obj, name)
+            if any(df.dtypes != dtype):
+                setattr(obj, name, df.astype(dtype))
+    return iot
+
+
+def calc_leontief(iot: pymrio.IOSystem, solver: str = "dense") -> pymrio.IOSystem:
+    """Computes the missing x, A and L in the precision of Z, without the extensions
+
+    Args:
+        iot (pymrio.IOSystem): pymrio MRIO object with Z and Y
+        solver (str, optional): Leontief solver, L is only computed by the 'dense' one (see leontief.py). Defaults to 'dense'.
+
+    Returns:
+        pymrio.IOSystem: pymrio object with x, A and L computed
+    """
+    dtype = iot.Z.values.dtype
+    if iot.x is None:
+        iot.x = (iot.Z.sum(axis=1) + iot.Y.sum(axis=1)).to_frame("indout")
+    if iot.A is None:
+        x = iot.x["indout"].values
+        recix = np.zeros_like(x)
+        np.divide(1, x, out=recix, where=x != 0)
+        iot.A = iot.Z * recix
+    if iot.L is None and solver == "dense":
+        iot.L = pd.DataFrame(
+            np.linalg.inv(np.eye(len(iot.A), dtype=dtype) - iot.A.values),
+            index=iot.A.index,
+            columns=iot.A.columns,
+        )
+    return iot
+
+
+def calc_system(iot: pymrio.IOSystem, solver: str = "dense") -> pymrio.IOSystem:
+    """Computes the missing x, A and L in the precision of Z, then all the extensions
+       Replaces pymrio.IOSystem.calc_all, whose Leontief inversion always works in float64
+
+    Args:
+        iot (pymrio.IOSystem): pymrio MRIO object with Z and Y
+        solver (str, optional): Leontief solver, the matrix-free ones compute the multipliers and accounts without L (see leontief.py). Defaults to 'dense'.
+
+    Returns:
+        pymrio.IOSystem: pymrio object with all matrices computed
+    """
+    iot = calc_leontief(iot=iot, solver=solver)
+    if solver == "dense":
+        iot.calc_all()
+        return iot
+
+    # same matrices as calc_all followed by recal_stressor_per_region, without L
+    leontief_solver = LeontiefSolver(A=iot.A, method=solver)
+    for extension in iot.get_extensions(data=True):
+        if extension.S is None:
+            extension.S = calc_S(extension.F, iot.x)
+        accounts = calc_accounts(S=extension.S, Y=iot.Y, solver=leontief_solver)
+        extension.M = accounts.pop("M")
+        # pymrio aggregates its accounts, which are summed over the regions of origin
+        for name, matrix in accounts.items():
+            setattr(
+                extension,
+                name,
+                matrix.groupby(level=1, sort=False).sum().reindex(extension.S.index),
+            )
+            setattr(extension, f"{name}_reg", None)
+        extension.calc_system(x=iot.x, Y=iot.Y, population=iot.population)
+        for name, matrix in accounts.items():
+            setattr(extension, name, matrix)
+    return iot
+
+
 def convert_region_from_capital_matrix(reg: str) -> str:
     """Converts a capital matrix-formatted region code into an Exiobase-formatted region code
 
@@ -98,6 +232,8 @@ def convert_region_from_capital_matrix(reg: str) -> str:
         str: Exiobase v3-formatted region code
     """
 
+    import pycountry
+
     try:
         return pycountry.countries.get(alpha_3=reg).alpha_2
     except AttributeError:
@@ -109,22 +245,38 @@ def convert_region_from_capital_matrix(reg: str) -> str:
             raise (ValueError, f"the country code {reg} is unkown.")
 
 
-def load_Kbar(year: int, system: str, path: pathlib.PosixPath) -> pd.DataFrame:
-    """Loads capital consumption matrix as a Pandas dataframe (including downloading if necessary)
+def download_Kbar(year: int, system: str, path: pathlib.PosixPath) -> None:
+    """Downloads the capital consumption matrix if it isn't there yet
 
     Args:
         year (int): year in 4 digits
         system (str): system ('pxp', 'pxi')
         path (pathlib.PosixPath): where to save the .mat file
-
-    Returns:
-        pd.DataFrame: same formatting than pymrio's Z matrix
     """
     if not os.path.isfile(path):
+        import wget
+
+        create_dir(pathlib.Path(path).parent)
         wget.download(
             f"https://zenodo.org/record/3874309/files/Kbar_exio_v3_6_{year}{system}.mat",
             str(path),
         )
+
+
+def load_Kbar(year: int, system: str, path: pathlib.PosixPath) -> pd.DataFrame:
+    """Loads capital consumption matrix as a Pandas dataframe (including downloading if necessary)
+
+    Args:
+        year (int): year in 4 digits
+        system (str): system ('pxp', 'pxi')
+        path (pathlib.PosixPath): where to save the .mat file
+
+    Returns:
+        pd.DataFrame: same formatting than pymrio's Z matrix
+    """
+    from scipy.io import loadmat
+
+    download_Kbar(year=year, system=system, path=path)
     data_dict = loadmat(path)
     data_array = data_dict["KbarCfc"]
     capital_regions = [
@@ -143,165 +295,371 @@ def load_Kbar(year: int, system: str, path: pathlib.PosixPath) -> pd.DataFrame:
 ### DATA BUILDERS ###
 
 
-def build_reference_data(model) -> pymrio.IOSystem:
-    """Builds the pymrio object given reference's settings
+def load_raw_exiobase(model, key: str, force: bool = False) -> pymrio.IOSystem:
+    """Loads the raw Exiobase data, from the pickle file of the parsing stage if it already exists
 
     Args:
         model (Model): object Model defined in model.py
+        key (str): key of the parsing stage, see calibration_stage_keys
+        force (bool, optional): True to parse the raw data even if it has already been parsed. Defaults to False.
 
     Returns:
-        pymrio.IOSystem: pymrio object
+        pymrio.IOSystem: raw pymrio object
     """
+    path = stage_path(stage="parsing", key=key, cache_dir=model.exiobase_dir)
+    legacy_path = model.exiobase_dir / model.exiobase_pickle_file_name
+    if os.path.isfile(legacy_path) and not os.path.isfile(path):
+        os.replace(legacy_path, path)  # pickled by former versions
+    return cached_stage(
+        stage="parsing",
+        key=key,
+        compute=lambda: pymrio.parse_exiobase3(  # may need RAM + SWAP ~ 15 Gb
+            model.exiobase_dir / model.raw_file_name
+        ),
+        cache_dir=model.exiobase_dir,
+        force=force,
+    )
 
-    # checks if calibration is necessary
-    force_calib = not os.path.isfile(model.model_dir / "file_parameters.json")
 
-    # create directories if necessary
-    for path in [model.exiobase_dir, model.model_dir, model.figures_dir]:
-        if not os.path.isdir(path):
-            os.mkdir(path)
-
-    # downloading data if necessary
-    if not os.path.isfile(model.exiobase_dir / model.raw_file_name):
-        print("Downloading data... (may take a few minutes)")
-        pymrio.download_exiobase3(
-            storage_folder=model.exiobase_dir,
-            system=model.system,
-            years=model.base_year,
+def endogenize_capital(
+    iot: pymrio.IOSystem, Kbar: pd.DataFrame, verbose: bool = True
+) -> pymrio.IOSystem:
+    """Moves capital consumption from final demand (gross fixed capital formation) to intermediate consumption
+
+    Args:
+        iot (pymrio.IOSystem): raw pymrio object
+        Kbar (pd.DataFrame): capital consumption matrix, same formatting than pymrio's Z matrix
+        verbose (bool, optional): True to print the supply/use balance check. Defaults to True.
+
+    Returns:
+        pymrio.IOSystem: pymrio object with endogenous capital
+    """
+    iot.Z += Kbar
+    iot.Y.loc[
+        slice(None), (slice(None), "Gross fixed capital formation")
+    ] -= Kbar.groupby(axis=1, level=0).sum()
+
+    if verbose:
+
+        # capital endogenization check
+
+        supply = iot.Y.sum(axis=1, level=1)["Gross fixed capital formation"] + iot.Z.sum(
+            axis=1
+        )
+        use = (
+            iot.Z.sum(axis=0)
+            + iot.satellite.F.iloc[:9].sum(axis=0)
+            - iot.satellite.F.loc["Operating surplus: Consumption of fixed capital"]
+        )
+        balance = supply_use_balance(supply=supply, use=use)
+        print(
+            "--- Vérification de l'équilibre emplois/ressources après endogénéisation du capital ---"
         )
-        print("Data downloaded successfully !")
+        print(f"Le R² des vecteurs emplois/ressources est de {balance['r2']}.")
+        print(f"Emplois - Ressources = {balance['gap']}")
+        print(f"abs(Emplois - Ressources) / Emplois = {balance['relative_gap']}")
+        print(f"max(Emplois - Ressources) = {balance['max_gap']}")
 
-    if model.calib or force_calib:
+    return iot
 
-        print("Loading data... (may take a few minutes)")
 
-        # import exiobase data
-        if os.path.isfile(model.exiobase_dir / model.exiobase_pickle_file_name):
-            with open(model.exiobase_dir / model.exiobase_pickle_file_name, "rb") as f:
-                iot = pkl.load(f)
-        else:
-            iot = pymrio.parse_exiobase3(  # may need RAM + SWAP ~ 15 Gb
-                model.exiobase_dir / model.raw_file_name
-            )
-            with open(model.exiobase_dir / model.exiobase_pickle_file_name, "wb") as f:
-                pkl.dump(iot, f)
+def extract_stressors(iot: pymrio.IOSystem, stressor_dict: Dict) -> pymrio.IOSystem:
+    """Builds the stressor extension from the Exiobase satellite accounts and removes the useless extensions
 
-        # endogenize capital
-        if model.capital:
-            Kbar = load_Kbar(
-                year=model.base_year,
-                system=model.system,
-                path=model.capital_consumption_path,
-            )
-            iot.Z += Kbar
-            iot.Y.loc[
-                slice(None), (slice(None), "Gross fixed capital formation")
-            ] -= Kbar.groupby(axis=1, level=0).sum()
-
-            # capital endogenization check
-
-            supply = iot.Y.sum(axis=1, level=1)[
-                "Gross fixed capital formation"
-            ] + iot.Z.sum(axis=1)
-            use = (
-                iot.Z.sum(axis=0)
-                + iot.satellite.F.iloc[:9].sum(axis=0)
-                - iot.satellite.F.loc["Operating surplus: Consumption of fixed capital"]
-            )
-            print(
-                "--- Vérification de l'équilibre emplois/ressources après endogénéisation du capital ---"
-            )
-            print(f"Le R² des vecteurs emplois/ressources est de {supply.corr(use)}.")
-            print(f"Emplois - Ressources = {use.sum() - supply.sum()}")
-            print(
-                f"abs(Emplois - Ressources) / Emplois = {abs(use.sum() - supply.sum()) / use.sum()}"
-            )
-            print(f"max(Emplois - Ressources) = {max(use - supply)}")
+    Args:
+        iot (pymrio.IOSystem): raw pymrio object
+        stressor_dict (Dict): dictionnary of comparable stressors (name as key, dictionnary as value with the list of corresponding Exiobase stressors and their weight)
 
-        # extract emissions
-        extension_list = list()
+    Returns:
+        pymrio.IOSystem: pymrio object with its stressor extension
+    """
+    extension_list = list()
 
-        for stressor in model.stressor_dict.keys():
+    for stressor in stressor_dict.keys():
 
-            extension = pymrio.Extension(stressor)
+        extension = pymrio.Extension(stressor)
 
-            for elt in ["F", "F_Y", "unit"]:
+        for elt in ["F", "F_Y", "unit"]:
 
-                component = getattr(iot.satellite, elt).loc[
-                    model.stressor_dict[stressor]["exiobase_keys"]
-                ]
+            component = getattr(iot.satellite, elt).loc[
+                stressor_dict[stressor]["exiobase_keys"]
+            ]
 
-                if elt == "unit":
-                    component = pd.DataFrame(
-                        component.values[0],
-                        index=pd.Index([stressor]),
-                        columns=["unit"],
-                    )
-                else:
-                    component = (
-                        component.sum(axis=0).to_frame(stressor).T
-                        * model.stressor_dict[stressor]["weight"]
-                    )
+            if elt == "unit":
+                component = pd.DataFrame(
+                    component.values[0],
+                    index=pd.Index([stressor]),
+                    columns=["unit"],
+                )
+            else:
+                component = (
+                    component.sum(axis=0).to_frame(stressor).T
+                    * stressor_dict[stressor]["weight"]
+                )
+
+            setattr(extension, elt, component)
+
+        extension_list.append(extension)
+
+    iot.stressor_extension = pymrio.concate_extension(extension_list, name="stressors")
+
+    # del useless extensions
+    iot.remove_extension(["satellite", "impacts"])
+
+    return iot
 
-                setattr(extension, elt, component)
 
-            extension_list.append(extension)
+def load_aggregation_matrices(aggregation_name: str) -> Dict[str, pd.DataFrame]:
+    """Reads the regional and sectorial aggregation matrices from data/aggregation
+
+    Args:
+        aggregation_name (str): name of the aggregation matrix used
 
-        iot.stressor_extension = pymrio.concate_extension(
-            extension_list, name="stressors"
+    Returns:
+        Dict[str, pd.DataFrame]: aggregation matrices (old categories as rows, new ones as columns) with keys 'sectors' and 'regions'
+    """
+    agg_matrix = {
+        axis: pd.read_excel(
+            AGGREGATION_DIR / f"{aggregation_name}.xlsx", sheet_name=axis
         )
+        for axis in ["sectors", "regions"]
+    }
+    agg_matrix["sectors"].set_index(
+        ["category", "sub_category", "sector"], inplace=True
+    )
+    agg_matrix["regions"].set_index(["Country name", "Country code"], inplace=True)
+    return agg_matrix
 
-        # del useless extensions
-        iot.remove_extension(["satellite", "impacts"])
 
-        # import aggregation matrices
-        agg_matrix = {
-            axis: pd.read_excel(
-                AGGREGATION_DIR / f"{model.aggregation_name}.xlsx", sheet_name=axis
-            )
-            for axis in ["sectors", "regions"]
-        }
-        agg_matrix["sectors"].set_index(
-            ["category", "sub_category", "sector"], inplace=True
+def aggregate_iot(
+    iot: pymrio.IOSystem, agg_matrix: Dict[str, pd.DataFrame]
+) -> pymrio.IOSystem:
+    """Applies regional and sectorial aggregations and resets the pymrio object to flows
+
+    Args:
+        iot (pymrio.IOSystem): pymrio object
+        agg_matrix (Dict[str, pd.DataFrame]): aggregation matrices, as returned by load_aggregation_matrices
+
+    Returns:
+        pymrio.IOSystem: aggregated pymrio object
+    """
+    iot.aggregate(
+        region_agg=agg_matrix["regions"].T.values,
+        sector_agg=agg_matrix["sectors"].T.values,
+        region_names=agg_matrix["regions"].columns.tolist(),
+        sector_names=agg_matrix["sectors"].columns.tolist(),
+    )
+
+    # reset A, L, S, S_Y, M and all of the account matrices
+    iot = iot.reset_to_flows()
+    for extension in iot.get_extensions(data=True):
+        extension.reset_to_flows()
+
+    return iot
+
+
+def calibration_stage_keys(model) -> Dict[str, str]:
+    """Hashes the inputs of each calibration stage, chained with the upstream stages
+
+    Args:
+        model (Model): object Model defined in model.py
+
+    Returns:
+        Dict[str, str]: keys of the stages 'parsing', 'capital', 'aggregation', 'leontief' and 'accounts'
+    """
+    keys = {
+        "parsing": stage_key(
+            stage="parsing",
+            raw_data=file_digest(model.exiobase_dir / model.raw_file_name),
         )
-        agg_matrix["regions"].set_index(["Country name", "Country code"], inplace=True)
-
-        # apply regional and sectorial agregations
-        iot.aggregate(
-            region_agg=agg_matrix["regions"].T.values,
-            sector_agg=agg_matrix["sectors"].T.values,
-            region_names=agg_matrix["regions"].columns.tolist(),
-            sector_names=agg_matrix["sectors"].columns.tolist(),
+    }
+    if model.capital:
+        keys["capital"] = stage_key(
+            stage="capital",
+            parent_key=keys["parsing"],
+            capital_consumption=file_digest(model.capital_consumption_path),
         )
+    else:
+        keys["capital"] = keys["parsing"]
+    keys["aggregation"] = stage_key(
+        stage="aggregation",
+        parent_key=keys["capital"],
+        aggregation=file_digest(AGGREGATION_DIR / f"{model.aggregation_name}.xlsx"),
+    )
+    # the dense solver's key is unchanged, so that the models calibrated before the matrix-free solvers stay valid
+    solver = {} if model.solver == "dense" else {"solver": model.solver}
+    keys["leontief"] = stage_key(
+        stage="leontief",
+        parent_key=keys["aggregation"],
+        precision=model.precision,
+        **solver,
+    )
+    keys["accounts"] = stage_key(
+        stage="accounts", parent_key=keys["leontief"], stressors=model.stressor_dict
+    )
+    return keys
 
-        # reset A, L, S, S_Y, M and all of the account matrices
-        iot = iot.reset_to_flows()
-        iot.stressor_extension.reset_to_flows()
 
-        # compute missing matrices
-        iot.calc_all()
+@respect_thread_budget
+def build_reference_data(model) -> Tuple[pymrio.IOSystem, bool]:
+    """Builds the pymrio object given reference's settings
+       The calibration is split into stages (parsing, capital endogenization, aggregation, Leontief inversion, stressor accounts) checkpointed under content hashes of their inputs, so that only the stages downstream of a changed input are computed again, and an interrupted calibration resumes from its last checkpoint
 
-        # compute emission accounts by region
-        iot.stressor_extension = recal_stressor_per_region(iot=iot)
+    Args:
+        model (Model): object Model defined in model.py
 
-        # save model
-        iot.save_all(model.model_dir)
+    Returns:
+        Tuple[pymrio.IOSystem, bool]: pymrio object, and True if it was calibrated again (calib or changed inputs), so that the counterfactuals saved so far are outdated
+    """
 
-        print("Data loaded successfully !")
+    # create directories if necessary
+    for path in [model.exiobase_dir, model.model_dir, model.figures_dir]:
+        create_dir(path)
+
+    with span("build_reference_data", model=model.summary_long):
+
+        # downloading data if necessary
+        if not os.path.isfile(model.exiobase_dir / model.raw_file_name):
+            print("Downloading data... (may take a few minutes)")
+            with span("download"):
+                pymrio.download_exiobase3(
+                    storage_folder=model.exiobase_dir,
+                    system=model.system,
+                    years=model.base_year,
+                    doi=EXIOBASE_DOI,
+                )
+            print("Data downloaded successfully !")
+        if model.capital:
+            download_Kbar(
+                year=model.base_year,
+                system=model.system,
+                path=model.capital_consumption_path,
+            )
 
-    else:
+        # checks if calibration is necessary, models calibrated by former versions have no stage keys
+        keys = calibration_stage_keys(model=model)
+        saved_keys = read_stage_keys(model_dir=model.model_dir)
+        up_to_date = os.path.isfile(model.model_dir / "file_parameters.json") and (
+            saved_keys is None or saved_keys == keys
+        )
 
-        # import calibration data previously built with calib = True
-        iot = pymrio.parse_exiobase3(model.model_dir)
+        rebuilt = model.calib or not up_to_date
+        if rebuilt:
 
-    return iot
+            print("Loading data... (may take a few minutes)")
+            stages_dir = STAGES_DIR / model.summary_shortest
+            outputs = {}
+
+            def parsed() -> pymrio.IOSystem:
+                with span("parsing"):
+                    return load_raw_exiobase(model=model, key=keys["parsing"])
+
+            def capital_endogenized() -> pymrio.IOSystem:
+                if not model.capital:
+                    return parsed()
+
+                def compute() -> pymrio.IOSystem:
+                    Kbar = load_Kbar(
+                        year=model.base_year,
+                        system=model.system,
+                        path=model.capital_consumption_path,
+                    )
+                    return endogenize_capital(iot=parsed(), Kbar=Kbar)
+
+                with span("capital_endogenisation"):
+                    return cached_stage(
+                        stage="capital",
+                        key=keys["capital"],
+                        compute=compute,
+                        cache_dir=stages_dir,
+                    )
+
+            def aggregated() -> pymrio.IOSystem:
+                # apply regional and sectorial agregations to the whole satellite, the stressors are extracted afterwards
+                def compute() -> pymrio.IOSystem:
+                    iot = capital_endogenized()
+                    iot.remove_extension("impacts")
+                    return aggregate_iot(
+                        iot=iot,
+                        agg_matrix=load_aggregation_matrices(
+                            aggregation_name=model.aggregation_name
+                        ),
+                    )
+
+                if "aggregation" not in outputs:
+                    with span("aggregation", aggregation=model.aggregation_name):
+                        outputs["aggregation"] = cached_stage(
+                            stage="aggregation",
+                            key=keys["aggregation"],
+                            compute=compute,
+                            cache_dir=stages_dir,
+                        )
+                return outputs["aggregation"]
+
+            def compute_leontief() -> Dict[str, pd.DataFrame]:
+                iot = calc_leontief(
+                    iot=cast_iot(iot=aggregated(), precision=model.precision),
+                    solver=model.solver,
+                )
+                return {"x": iot.x, "A": iot.A, "L": iot.L}
+
+            with span("leontief"):
+                leontief = cached_stage(
+                    stage="leontief",
+                    key=keys["leontief"],
+                    compute=compute_leontief,
+                    cache_dir=stages_dir,
+                )
+
+            def compute_accounts() -> pymrio.IOSystem:
+                iot = cast_iot(iot=aggregated(), precision=model.precision)
+                for name, matrix in leontief.items():
+                    setattr(iot, name, matrix)
+
+                # extract emissions
+                with span("stressor_extraction"):
+                    iot = extract_stressors(iot=iot, stressor_dict=model.stressor_dict)
+                    iot = cast_iot(iot=iot, precision=model.precision)
+
+                # compute emission accounts by region
+                iot = calc_system(iot=iot, solver=model.solver)
+                if model.solver == "dense":
+                    iot.stressor_extension = recal_stressor_per_region(iot=iot)
+                return cast_iot(iot=iot, precision=model.precision)
+
+            with span("accounts"):
+                iot = cached_stage(
+                    stage="accounts",
+                    key=keys["accounts"],
+                    compute=compute_accounts,
+                    cache_dir=stages_dir,
+                )
+
+            # save model, empty stage keys mark an unfinished save
+            with span("save_all"):
+                write_stage_keys(model_dir=model.model_dir, keys={})
+                atomic_write_dir(directory=model.model_dir, write=iot.save_all)
+                write_stage_keys(model_dir=model.model_dir, keys=keys)
+            discard_stage(stage="accounts", key=keys["accounts"], cache_dir=stages_dir)
+
+            print("Data loaded successfully !")
+
+        else:
+
+            # import calibration data previously built with calib = True
+            with span("load_calibrated"):
+                iot = pymrio.parse_exiobase3(model.model_dir)
+                iot = cast_iot(iot=iot, precision=model.precision)
 
+    return iot, rebuilt
 
+
+@respect_thread_budget
 def build_counterfactual_data(
     model,
     scenar_function,
     reloc: bool = False,
-) -> pymrio.IOSystem:
+) -> CounterfactualIOSystem:
     """Builds the pymrio object given reference's settings and the scenario parameters
 
     Args:
@@ -309,22 +667,40 @@ def build_counterfactual_data(
         scenar_function (Callable[[Model, bool], Tuple[pd.DataFrame]]): builds the new Z and Y matrices
         reloc (bool, optional): True if relocation is allowed. Defaults to False.
     Returns:
-        pymrio.IOSystem: modified pymrio model
+        CounterfactualIOSystem: modified pymrio model, sharing the unchanged matrices with the reference (see counterfactual_iot.py)
     """
 
-    iot = model.iot.copy()
-
-    iot.Z, iot.Y = scenar_function(model=model, reloc=reloc)
-
-    iot.A = None
-    iot.x = None
-    iot.L = None
-
-    iot.calc_all()
-
-    iot.stressor_extension = recal_stressor_per_region(
-        iot=iot,
-    )
+    with span(
+        "build_counterfactual_data",
+        model=model.summary_long,
+        scenario=getattr(scenar_function, "__name__", scenar_function),
+        reloc=reloc,
+    ):
+
+        with span("scenario"):
+            Z, Y = scenar_function(model=model, reloc=reloc)
+        dtype = check_precision(model.precision)
+        Z = Z.astype(dtype)
+        Y = Y.astype(dtype)
+
+        with span("calc_all"):
+            core = calc_leontief(iot=pymrio.IOSystem(Z=Z, Y=Y), solver=model.solver)
+
+        # only the changed columns of Z and Y are stored, the other matrices are read from the reference
+        iot = CounterfactualIOSystem(parent=model.iot, Z=Z, Y=Y, x=core.x, L=core.L)
+        del core
+
+        with span("accounts"):
+            iot._materialized.update({"Z": Z, "Y": Y})
+            iot.stressor_extension = model.iot.stressor_extension
+            extension = recal_stressor_per_region(iot=iot, solver=model.solver)
+            iot.stressor_extension = CounterfactualExtension(
+                parent=model.iot.stressor_extension,
+                accounts={
+                    name: getattr(extension, name).astype(dtype) for name in ACCOUNTS
+                },
+            )
+            iot.release()
 
     return iot
 
@@ -604,6 +980,81 @@ def footprint_extractor(model, region: str = "FR") -> Dict:
     }
 
 
+def footprint_table(model, by: str = None) -> pd.DataFrame:
+    """Computes the footprint components of all the regions in one pass over the account matrices
+
+    Args:
+        model (Union[Model, Counterfactual]): object Model or Counterfactual defined in model.py
+        by (str, optional): None for one row per region, 'sector' or 'stressor' for one row per region and sector (or stressor). F_Y has no sectorial breakdown and is left out by sector. Defaults to None.
+
+    Returns:
+        pd.DataFrame: values of -D_exp, D_pba, D_imp and F_Y (columns, as in footprint_extractor) for each region (rows)
+    """
+    if by not in [None, "sector", "stressor"]:
+        raise ValueError(f"by must be None, 'sector' or 'stressor', not {by}")
+
+    stressor_extension = model.iot.stressor_extension
+    columns = stressor_extension.D_pba.columns
+    regions = columns.get_level_values(0).unique()
+    sectors = columns.get_level_values(1).unique()
+    stressors = stressor_extension.D_pba.index.get_level_values(1).unique()
+    shape = (len(regions), len(stressors), len(regions), len(sectors))
+
+    # accounts as (row region, stressor, column region, sector), selected by column region
+    accounts = {
+        "Exportations": -stressor_extension.D_exp.values.reshape(shape),
+        "Production": stressor_extension.D_pba.values.reshape(shape),
+        "Importations": stressor_extension.D_imp.values.reshape(shape),
+    }
+    F_Y = stressor_extension.F_Y.values.reshape(len(stressors), len(regions), -1)
+
+    if by is None:
+        table = {
+            name: account.sum(axis=(0, 1, 3)) for name, account in accounts.items()
+        }
+        table["Consommation"] = F_Y.sum(axis=(0, 2))
+        return pd.DataFrame(table, index=pd.Index(regions, name="region"))
+
+    if by == "sector":
+        table = {
+            name: account.sum(axis=(0, 1)).ravel() for name, account in accounts.items()
+        }
+        index = pd.MultiIndex.from_product(
+            [regions, sectors], names=["region", "sector"]
+        )
+    else:
+        table = {
+            name: account.sum(axis=(0, 3)).T.ravel()
+            for name, account in accounts.items()
+        }
+        table["Consommation"] = F_Y.sum(axis=2).T.ravel()
+        index = pd.MultiIndex.from_product(
+            [regions, stressors], names=["region", "stressor"]
+        )
+    return pd.DataFrame(table, index=index)
+
+
+def footprint_panel(models: Union[List, Dict], by: str = None) -> pd.DataFrame:
+    """Stacks the footprint tables of several models or counterfactuals
+
+    Args:
+        models (Union[List, Dict]): objects Model or Counterfactual defined in model.py, in a list or in a dictionnary with their names as keys
+        by (str, optional): breakdown of the tables, see footprint_table. Defaults to None.
+
+    Returns:
+        pd.DataFrame: footprint tables, with the names of the models (counterfactuals' names, or models' summary_long) as first index level
+    """
+    if not isinstance(models, dict):
+        models = {
+            getattr(model, "name", None) or model.summary_long: model
+            for model in models
+        }
+    return pd.concat(
+        {name: footprint_table(model=model, by=by) for name, model in models.items()},
+        names=["model"],
+    )
+
+
 ### AUXILIARY FUNCTIONS FOR FIGURES EDITING ###
 
 
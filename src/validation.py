@@ -0,0 +1,298 @@
+"""Consistency checks of the calibrated models and of their counterfactuals
+
+All the checks are vectorised NumPy operations on the matrices' values and return one row of a report each:
+    - balance: production equals intermediate plus final uses (x = Z.1 + Y.1)
+    - leontief: production is reproduced by the Leontief inverse (x = L.y), solved without L for the matrix-free models
+    - negative_*: negative entries of Z, x, L (if any) and of the final demand other than changes in inventories and valuables
+    - column_sums: largest column sum of A, which must be below 1 for the value added to be positive
+    - spectral_radius: spectral radius of A, which must be below 1 for the model to be productive
+    - trade_conservation (counterfactuals only): the uses of each product by each column of Z and Y, summed over the supplying regions, are the reference's ones
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.sparse.linalg import eigs
+from typing import Dict, Tuple
+
+from src.leontief import leontief_operator
+
+REPORT_COLUMNS = ["value", "threshold", "passed", "location"]
+# final demand categories which can be negative
+SIGNED_Y_CATEGORIES = ("Changes in inventories", "Changes in valuables")
+
+
+### AUXILIARY FUNCTIONS ###
+
+
+def check_row(value: float, threshold: float, location=None) -> Dict:
+    """Formats the result of a check as a row of the report
+
+    Args:
+        value (float): measured value, the check passes if it is below the threshold
+        threshold (float): largest value accepted
+        location (optional): row and/or column label of the worst entry. Defaults to None.
+
+    Returns:
+        Dict: row of the report
+    """
+    return {
+        "value": float(value),
+        "threshold": threshold,
+        "passed": bool(value <= threshold),
+        "location": None if location is None else str(location),
+    }
+
+
+def relative_gap(
+    values: np.ndarray, reference: np.ndarray, labels: pd.Index, scale: float = None
+) -> Tuple[float, object]:
+    """Computes the largest gap between two arrays, relatively to the largest reference value
+
+    Args:
+        values (np.ndarray): compared values
+        reference (np.ndarray): reference values, same shape
+        labels (pd.Index): labels of the flattened entries
+        scale (float, optional): value the gaps are divided by, the largest absolute reference value if None. Defaults to None.
+
+    Returns:
+        Tuple[float, object]: largest relative gap and label of the entry where it is found
+    """
+    gaps = np.abs(values - reference).ravel()
+    if scale is None:
+        scale = np.abs(reference).max() if reference.size else 0
+    if gaps.size == 0 or scale == 0:
+        return 0.0, None
+    worst = gaps.argmax()
+    return gaps[worst] / scale, labels[worst]
+
+
+def spectral_radius(A: np.ndarray, tol: float = 1e-6, max_iter: int = 1000) -> float:
+    """Computes the spectral radius of a technical coefficients matrix
+
+    For a nonnegative matrix, the ratios (A.v)_i / v_i of power iterations enclose the spectral radius (Collatz-Wielandt bounds), starting from the largest column sum as upper bound.
+    The upper bound is returned, which errs on the safe side if the iterations converge slowly. Matrices with negative entries go through an Arnoldi method.
+
+    Args:
+        A (np.ndarray): square matrix
+        tol (float, optional): relative accuracy of the power iterations. Defaults to 1e-6.
+        max_iter (int, optional): maximal number of power iterations. Defaults to 1000.
+
+    Returns:
+        float: spectral radius of A (or an upper bound within tol of it)
+    """
+    if (A < 0).any():
+        return float(np.abs(eigs(A, k=1, which="LM", return_eigenvectors=False))[0])
+
+    upper = A.sum(axis=0).max()
+    lower = 0.0
+    previous = np.inf
+    v = np.ones(len(A))
+    for _ in range(max_iter):
+        if upper - lower <= tol * upper:
+            break
+        w = A @ v
+        ratios = w / v
+        lower = max(lower, ratios.min())
+        upper = min(upper, ratios.max())
+        if previous - ratios.max() <= tol * tol * upper:
+            break  # stalled, e.g. on reducible matrices
+        previous = ratios.max()
+        # v stays positive so that the bounds hold
+        v = np.maximum(w / w.max(), np.finfo("float64").tiny)
+    return float(upper)
+
+
+### CHECKS ###
+
+
+def supply_use_balance(supply: pd.Series, use: pd.Series) -> Dict:
+    """Compares the supply and use of each product, e.g. after capital endogenization
+
+    Args:
+        supply (pd.Series): supply of each product
+        use (pd.Series): use (intermediate consumptions and value added) of each product
+
+    Returns:
+        Dict: correlation of the two vectors ('r2'), total gap ('gap'), total gap relatively to the total use ('relative_gap') and largest gap of a product ('max_gap')
+    """
+    supply_values = supply.values.astype("float64")
+    use_values = use.reindex(supply.index).values.astype("float64")
+    gaps = use_values - supply_values
+    return {
+        "r2": float(np.corrcoef(supply_values, use_values)[0, 1]),
+        "gap": float(gaps.sum()),
+        "relative_gap": float(abs(gaps.sum()) / use_values.sum()),
+        "max_gap": float(gaps.max()),
+    }
+
+
+def check_negative_values(iot, tol: float = 0) -> Dict[str, Dict]:
+    """Looks for the most negative entries of Z, x, L (if any) and Y (except the changes in inventories and valuables)
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a model or a counterfactual
+        tol (float, optional): largest negative value accepted, in absolute value. Defaults to 0.
+
+    Returns:
+        Dict[str, Dict]: rows of the report, by check name
+    """
+    unsigned_Y = ~iot.Y.columns.get_level_values(1).isin(SIGNED_Y_CATEGORIES)
+    rows = {}
+    for name, frame, columns in [
+        ("Z", iot.Z, slice(None)),
+        ("x", iot.x, slice(None)),
+        ("L", iot.L, slice(None)),
+        ("Y", iot.Y, unsigned_Y),
+    ]:
+        if frame is None:
+            continue
+        values = frame.values[:, columns]
+        if values.size == 0:
+            rows[f"negative_{name}"] = check_row(value=0, threshold=tol)
+            continue
+        worst = np.unravel_index(values.argmin(), values.shape)
+        rows[f"negative_{name}"] = check_row(
+            value=max(0.0, -values[worst]),
+            threshold=tol,
+            location=(
+                (
+                    frame.index[worst[0]],
+                    frame.columns[columns][worst[1]],
+                )
+                if values[worst] < 0
+                else None
+            ),
+        )
+    return rows
+
+
+def check_productivity(iot, tol: float = 1e-6) -> Dict[str, Dict]:
+    """Checks that the technical coefficients matrix A is productive
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a model or a counterfactual
+        tol (float, optional): margin below 1 of the column sums and of the spectral radius. Defaults to 1e-6.
+
+    Returns:
+        Dict[str, Dict]: rows of the report, by check name
+    """
+    A = iot.A.values
+    column_sums = A.sum(axis=0)
+    worst = column_sums.argmax()
+    return {
+        "column_sums": check_row(
+            value=column_sums[worst],
+            threshold=1 - tol,
+            location=iot.A.columns[worst],
+        ),
+        "spectral_radius": check_row(value=spectral_radius(A), threshold=1 - tol),
+    }
+
+
+def check_balance(iot, tol: float = 1e-6, solver: str = "dense") -> Dict[str, Dict]:
+    """Checks that production equals the total uses and the production given by the Leontief inverse
+       Without L (matrix-free solvers, see leontief.py), L.y is solved with the model's solver
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a model or a counterfactual
+        tol (float, optional): largest gap accepted, relatively to the largest production. Defaults to 1e-6.
+        solver (str, optional): Leontief solver of the model, used if iot has no L. Defaults to 'dense'.
+
+    Returns:
+        Dict[str, Dict]: rows of the report, by check name
+    """
+    x = iot.x.values[:, 0].astype("float64")
+    y = iot.Y.values.sum(axis=1, dtype="float64")
+    uses = iot.Z.values.sum(axis=1, dtype="float64") + y
+    try:
+        leontief = leontief_operator(iot=iot, method=solver)(y)
+    except (ValueError, RuntimeError):
+        # no matrix-free solution if A isn't productive, see check_productivity
+        leontief = np.full_like(y, np.nan)
+    rows = {}
+    for name, estimate in [("balance", uses), ("leontief", leontief)]:
+        value, location = relative_gap(values=estimate, reference=x, labels=iot.x.index)
+        rows[name] = check_row(value=value, threshold=tol, location=location)
+    return rows
+
+
+def check_trade_conservation(iot, reference, tol: float = 1e-6) -> Dict[str, Dict]:
+    """Checks that a reallocation only changed the supplying regions, i.e. that each column of Z and Y uses the same total of each product as in the reference
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a counterfactual
+        reference (pymrio.IOSystem): pymrio object of the reference
+        tol (float, optional): largest gap accepted, relatively to the largest use. Defaults to 1e-6.
+
+    Returns:
+        Dict[str, Dict]: rows of the report, by check name
+    """
+    n_sectors = len(reference.get_sectors())
+    sectors = reference.Z.index.get_level_values(1)[:n_sectors]
+
+    def uses_by_product(matrix: pd.DataFrame) -> np.ndarray:
+        # rows are (region, sector) with the regions as outer level
+        return matrix.values.reshape(-1, n_sectors, matrix.shape[1]).sum(axis=0)
+
+    values, references, labels = [], [], []
+    for name in ["Z", "Y"]:
+        # only the changed columns are compared when the counterfactual stores them apart
+        new = getattr(iot, f"{name}_columns", None)
+        if new is None:
+            new = getattr(iot, name)
+        values.append(uses_by_product(new).ravel())
+        references.append(
+            uses_by_product(getattr(reference, name)[new.columns]).ravel()
+        )
+        labels += [(sector, column) for sector in sectors for column in new.columns]
+    value, location = relative_gap(
+        values=np.concatenate(values),
+        reference=np.concatenate(references),
+        labels=labels,
+        scale=max(
+            np.abs(uses_by_product(getattr(reference, name))).max()
+            for name in ["Z", "Y"]
+        ),
+    )
+    return {
+        "trade_conservation": check_row(value=value, threshold=tol, location=location)
+    }
+
+
+### REPORT ###
+
+
+def validate_iot(
+    iot, reference=None, tol: float = 1e-6, solver: str = "dense"
+) -> pd.DataFrame:
+    """Runs all the checks on a model or a counterfactual
+
+    Args:
+        iot (Union[pymrio.IOSystem, CounterfactualIOSystem]): pymrio object of a model or a counterfactual
+        reference (pymrio.IOSystem, optional): pymrio object of the reference, to check the trade conservation of a counterfactual. Defaults to None.
+        tol (float, optional): relative tolerance of the checks. Defaults to 1e-6.
+        solver (str, optional): Leontief solver of the model, see check_balance. Defaults to 'dense'.
+
+    Returns:
+        pd.DataFrame: report with the measured value, the threshold, whether it passed and the worst entry's labels of each check (rows)
+    """
+    rows = {}
+    rows.update(check_balance(iot=iot, tol=tol, solver=solver))
+    rows.update(check_negative_values(iot=iot))
+    rows.update(check_productivity(iot=iot, tol=tol))
+    if reference is not None:
+        rows.update(check_trade_conservation(iot=iot, reference=reference, tol=tol))
+    return pd.DataFrame.from_dict(rows, orient="index", columns=REPORT_COLUMNS)
+
+
+def print_failed_checks(report: pd.DataFrame, name: str) -> None:
+    """Prints the checks of a report which didn't pass, if any
+
+    Args:
+        report (pd.DataFrame): report returned by validate_iot
+        name (str): name of the model or counterfactual, for the message
+    """
+    failed = report[~report["passed"]]
+    if len(failed):
+        print(f"--- {len(failed)} failed check(s) for {name} ---")
+        print(failed.to_string())
@@ -0,0 +1,161 @@
+"""Tests of the downloader (src/downloads.py) against a local HTTP server serving the files of a temporary directory"""
+
+import asyncio
+import hashlib
+import http.server
+import os
+import pathlib
+import threading
+import time
+
+import pytest
+
+from src.downloads import Prefetcher, download_all, download_file
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the files of the server's directory, answering the Range requests and logging the requests"""
+
+    def do_GET(self) -> None:
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("Range")))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            path = pathlib.Path(self.translate_path(self.path))
+            if not path.is_file():
+                self.send_error(404)
+                return
+            content = path.read_bytes()
+            start = 0
+            if self.headers.get("Range") is not None:
+                start = int(self.headers["Range"].split("=")[1].split("-")[0])
+                if start >= len(content):
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}"
+                )
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(content) - start))
+            self.end_headers()
+            self.wfile.write(content[start:])
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server(tmp_path: pathlib.PosixPath):
+    """Local HTTP server serving tmp_path / 'served', with the requests it received"""
+    served = tmp_path / "served"
+    served.mkdir()
+    httpd = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        lambda *args: RangeRequestHandler(*args, directory=str(served)),
+    )
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.active = httpd.max_active = 0
+    httpd.delay = 0.0
+    httpd.served = served
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def serve(server, name: str, content: bytes) -> dict:
+    """Writes a file served by the server and returns the download task of its checksum and size"""
+    (server.served / name).write_bytes(content)
+    return {
+        "url": server.url + name,
+        "checksum": "md5:" + hashlib.md5(content).hexdigest(),
+        "size": len(content),
+    }
+
+
+def test_resume_part_download(server, tmp_path):
+    content = os.urandom(100_000)
+    task = serve(server, "IOT_2015_pxp.zip", content)
+    path = tmp_path / "downloads" / "IOT_2015_pxp.zip"
+    path.parent.mkdir()
+    # an interrupted download left the first 40 kB
+    path.with_name(path.name + ".part").write_bytes(content[:40_000])
+
+    assert download_file({**task, "path": path}) == path
+    assert path.read_bytes() == content
+    assert not path.with_name(path.name + ".part").exists()
+    assert server.requests == [("/IOT_2015_pxp.zip", "bytes=40000-")]
+
+
+def test_complete_part_file_is_not_downloaded_again(server, tmp_path):
+    content = os.urandom(1_000)
+    task = serve(server, "IOT_2015_pxp.zip", content)
+    path = tmp_path / "IOT_2015_pxp.zip"
+    path.with_name(path.name + ".part").write_bytes(content)
+
+    download_file({**task, "path": path})
+    assert path.read_bytes() == content
+    assert server.requests == []
+
+
+def test_checksum_mismatch(server, tmp_path):
+    task = serve(server, "IOT_2015_pxp.zip", os.urandom(10_000))
+    task["checksum"] = "md5:" + hashlib.md5(b"another file").hexdigest()
+    path = tmp_path / "IOT_2015_pxp.zip"
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        download_file({**task, "path": path})
+    # the corrupted file is neither kept nor resumed
+    assert not path.exists()
+    assert not path.with_name(path.name + ".part").exists()
+
+
+def test_concurrent_download_all(server, tmp_path):
+    server.delay = 0.2
+    contents = {f"IOT_{year}_pxp.zip": os.urandom(50_000) for year in range(2010, 2016)}
+    tasks = [
+        {**serve(server, name, content), "path": tmp_path / name}
+        for name, content in contents.items()
+    ]
+
+    errors = asyncio.run(download_all(tasks=tasks, max_concurrency=3, verbose=False))
+    assert errors == {}
+    for name, content in contents.items():
+        assert (tmp_path / name).read_bytes() == content
+    assert len(server.requests) == len(contents)
+    assert 1 < server.max_active <= 3
+
+
+def test_prefetcher_reports_failures(server, tmp_path):
+    good = {**serve(server, "IOT_2015_pxp.zip", b"good"), "path": tmp_path / "good"}
+    missing = {
+        "url": server.url + "IOT_2016_pxp.zip",
+        "checksum": None,
+        "size": None,
+        "path": tmp_path / "missing",
+    }
+
+    prefetcher = Prefetcher(tasks=[good, missing], verbose=False)
+    # downloads of the prefetcher without retry, so that the test doesn't wait for the backoff
+    prefetcher.errors = asyncio.run(
+        download_all(
+            tasks=prefetcher.tasks,
+            retries=0,
+            futures=prefetcher.futures,
+            verbose=False,
+        )
+    )
+    assert prefetcher.wait(paths=[good["path"]])
+    assert not prefetcher.wait(paths=[good["path"], missing["path"]])
+    assert list(prefetcher.failures(paths=[missing["path"]])) == [missing["path"]]